@@ -0,0 +1,148 @@
+import asyncio
+import bisect
+import ipaddress
+import random
+import resource
+from snmp_diode import ber
+
+# Simulated SNMPv2c agents for the benchmarks. Every agent listens on its
+# own loopback address and serves the system group, ifTable, ifXTable
+# ifAlias and ipAddrTable of a synthetic device with a configurable number
+# of interfaces. Responses can be delayed and requests dropped to mimic
+# WAN links and lossy networks.
+
+DEFAULT_PORT = 16161
+FIRST_ADDRESS = ipaddress.ip_address("127.1.0.1")
+CISCO_2901 = ".1.3.6.1.4.1.9.1.1045"
+
+
+class DeviceMib:
+    # Sorted OID table shared by every agent with the same interface count,
+    # only sysName differs between agents and is answered separately.
+
+    def __init__(self, interfaces):
+        mib = {
+            ".1.3.6.1.2.1.1.2.0": (ber.OBJECT_IDENTIFIER, CISCO_2901),
+            ".1.3.6.1.2.1.1.3.0": (ber.TIMETICKS, 8640000),
+            ".1.3.6.1.2.1.1.5.0": (ber.OCTET_STRING, b""),
+            ".1.3.6.1.2.1.1.6.0": (ber.OCTET_STRING, b"benchmark-lab"),
+        }
+        for index in range(1, interfaces + 1):
+            address = f"10.{index >> 8 & 255}.{index & 255}.1"
+            mib[f".1.3.6.1.2.1.2.2.1.2.{index}"] = (ber.OCTET_STRING, f"GigabitEthernet0/{index}".encode())
+            mib[f".1.3.6.1.2.1.2.2.1.6.{index}"] = (ber.OCTET_STRING, bytes((0, 0x50, 0x56, index >> 16 & 255, index >> 8 & 255, index & 255)))
+            mib[f".1.3.6.1.2.1.2.2.1.7.{index}"] = (ber.INTEGER, 1 if index % 4 else 2)
+            mib[f".1.3.6.1.2.1.31.1.1.1.18.{index}"] = (ber.OCTET_STRING, f"uplink {index}".encode())
+            mib[f".1.3.6.1.2.1.4.20.1.1.{address}"] = (ber.IP_ADDRESS, address)
+            mib[f".1.3.6.1.2.1.4.20.1.2.{address}"] = (ber.INTEGER, index)
+            mib[f".1.3.6.1.2.1.4.20.1.3.{address}"] = (ber.IP_ADDRESS, "255.255.255.0")
+        self.values = mib
+        self.oids = sorted(mib, key=ber.oid_to_tuple)
+        self.keys = [ber.oid_to_tuple(oid) for oid in self.oids]
+
+    def get(self, oid, name):
+        if oid == ".1.3.6.1.2.1.1.5.0":
+            return oid, ber.OCTET_STRING, name
+        value_type, value = self.values.get(oid, (ber.NO_SUCH_OBJECT, None))
+        return oid, value_type, value
+
+    def get_next(self, oid, name):
+        position = bisect.bisect_right(self.keys, ber.oid_to_tuple(oid))
+        if position >= len(self.oids):
+            return oid, ber.END_OF_MIB_VIEW, None
+        return self.get(self.oids[position], name)
+
+
+class AgentProtocol(asyncio.DatagramProtocol):
+    def __init__(self, mib, name, community=b"public", latency=0.0, loss=0.0):
+        self.mib = mib
+        self.name = name
+        self.community = community
+        self.latency = latency
+        self.loss = loss
+        self.transport = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        if self.loss and random.random() < self.loss:
+            return
+        try:
+            message = ber.decode_message(data)
+        except ber.BERError:
+            return
+        if message.community != self.community:
+            return
+        response = ber.encode_message(
+            message.version,
+            message.community,
+            ber.GET_RESPONSE,
+            message.request_id,
+            self.answer(message),
+        )
+        if self.latency:
+            asyncio.get_running_loop().call_later(self.latency, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+    def answer(self, message):
+        oids = [varbind.oid for varbind in message.varbinds]
+        if message.pdu_type == ber.GET_REQUEST:
+            return [self.mib.get(oid, self.name) for oid in oids]
+        if message.pdu_type == ber.GET_NEXT_REQUEST:
+            return [self.mib.get_next(oid, self.name) for oid in oids]
+        if message.pdu_type == ber.GET_BULK_REQUEST:
+            non_repeaters = max(0, min(message.error_status, len(oids)))
+            varbinds = [self.mib.get_next(oid, self.name) for oid in oids[:non_repeaters]]
+            current = oids[non_repeaters:]
+            for _ in range(message.error_index):
+                row = [self.mib.get_next(oid, self.name) for oid in current]
+                varbinds.extend(row)
+                if all(varbind[1] == ber.END_OF_MIB_VIEW for varbind in row):
+                    break
+                current = [varbind[0] for varbind in row]
+            return varbinds
+        return []
+
+
+def fleet_addresses(devices):
+    return [str(FIRST_ADDRESS + index) for index in range(devices)]
+
+
+def raise_file_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        limit = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+
+
+async def start_fleet(devices, interfaces, port=DEFAULT_PORT, latency=0.0, loss=0.0):
+    raise_file_limit(devices + 256)
+    loop = asyncio.get_running_loop()
+    mib = DeviceMib(interfaces)
+    agents = []
+    for index, address in enumerate(fleet_addresses(devices)):
+        name = f"bench-{index:05d}".encode()
+        _, agent = await loop.create_datagram_endpoint(
+            lambda name=name: AgentProtocol(mib, name, latency=latency, loss=loss),
+            local_addr=(address, port),
+        )
+        agents.append(agent)
+    return agents
+
+
+def serve_fleet(devices, interfaces, port, latency, loss, ready, stop):
+    # Entry point for running the fleet in a separate process, so the
+    # agents do not compete with the discovery engine being measured.
+    async def serve():
+        agents = await start_fleet(devices, interfaces, port, latency, loss)
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        for agent in agents:
+            agent.transport.close()
+
+    asyncio.run(serve())
@@ -0,0 +1,78 @@
+import argparse
+import time
+from snmp_diode import ingest, models
+
+# Compares the per-device cost of collecting entities by list concatenation
+# (what entrypoint.main did before the streaming sink) with feeding them to
+# ingest.EntitySink. Serialization is done up front so only the accumulation
+# is measured.
+#
+#   $ python -m benchmarks.bench_accumulation --devices 500 1000 2000 5000
+
+
+class DiscardClient:
+    class Response:
+        errors = []
+
+    def ingest(self, entities):
+        return self.Response()
+
+
+def build_device(index, interfaces):
+    return models.Device(
+        name=f"device-{index}",
+        device_type="cisco2901",
+        manufacturer="Cisco",
+        site="lab",
+        interfaces=[
+            models.Interface(
+                name=f"GigabitEthernet0/{i}",
+                mac_address="00:50:56:AB:CD:EF",
+                address=f"10.{i // 256}.{i % 256}.1/24",
+                enabled=True,
+            )
+            for i in range(interfaces)
+        ],
+    )
+
+
+def concatenate(dumps):
+    entities = []
+    for dump in dumps:
+        entities = entities + dump
+    return len(entities)
+
+
+def stream(dumps):
+    with ingest.EntitySink(DiscardClient()) as sink:
+        for dump in dumps:
+            sink.add(dump)
+    return sink.entities
+
+
+def measure(function, dumps):
+    start = time.perf_counter()
+    function(dumps)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entity accumulation benchmark")
+    parser.add_argument("--devices", type=int, nargs="+", default=[250, 500, 1000, 2000, 5000])
+    parser.add_argument("--interfaces", type=int, default=24)
+    args = parser.parse_args()
+
+    dump = build_device(0, args.interfaces).model_dump()
+    print(f"{'devices':>8} {'entities':>9} {'concat us/dev':>14} {'stream us/dev':>14}")
+    for devices in args.devices:
+        dumps = [dump] * devices
+        concat_time = measure(concatenate, dumps)
+        stream_time = measure(stream, dumps)
+        print(
+            f"{devices:>8} {devices * len(dump):>9} "
+            f"{concat_time / devices * 1e6:>14.1f} {stream_time / devices * 1e6:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
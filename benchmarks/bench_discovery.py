@@ -0,0 +1,142 @@
+import argparse
+import multiprocessing
+import resource
+import statistics
+import time
+from benchmarks.agent import DEFAULT_PORT, fleet_addresses, serve_fleet
+from benchmarks.bench_accumulation import DiscardClient
+from snmp_diode import ingest
+
+# Runs a --network style sweep against a fleet of simulated agents on
+# loopback and reports throughput, PDUs per device, per-device latency and
+# peak RSS for the discovery and the serialization stages.
+#
+#   $ python -m benchmarks.bench_discovery --devices 500 --interfaces 48 --backend async --workers 500
+#   $ python -m benchmarks.bench_discovery --devices 50 --interfaces 2000 --latency 50 --loss 1
+#   $ python -m benchmarks.bench_discovery --devices 50 --latency 800 --timeout-mode adaptive
+#   $ python -m benchmarks.bench_discovery --devices 200 --workers 200 --rate 500 --subnet-rate 200
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_discovery(args, addresses):
+    snmp_data = {
+        "version": 2,
+        "version_data": {"community": "public"},
+        "port": args.port,
+        "max_repetitions": args.max_repetitions,
+        "timeout_mode": args.timeout_mode,
+        "rate_limit": {"rate": args.rate, "subnet_rate": args.subnet_rate, "host_inflight": args.host_inflight},
+    }
+    if args.backend == "async":
+        from snmp_diode import aiodiscover
+
+        results = aiodiscover.run_sweep(addresses, snmp_data, concurrency=args.workers)
+    else:
+        from snmp_diode import sweep
+
+        results = sweep.sweep(addresses, snmp_data, workers=args.workers)
+    return list(results)
+
+
+def run_serialization(devices):
+    latencies = []
+    with ingest.EntitySink(DiscardClient()) as sink:
+        for device in devices:
+            start = time.perf_counter()
+            sink.add(device.model_dump())
+            latencies.append(time.perf_counter() - start)
+    return latencies, sink.entities
+
+
+def report(stage, count, elapsed, latencies, rss, extra=""):
+    latencies = sorted(latencies)
+    print(
+        f"{stage:<14} {count / elapsed if elapsed else 0:>10.1f}/s "
+        f"p50 {percentile(latencies, 50) * 1000:>8.2f} ms "
+        f"p99 {percentile(latencies, 99) * 1000:>8.2f} ms "
+        f"peak rss {rss:>7.1f} MB{extra}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Discovery benchmark against simulated SNMP agents")
+    parser.add_argument("--devices", type=int, default=100, help="Number of simulated agents")
+    parser.add_argument("--interfaces", type=int, default=48, help="Interfaces per simulated agent")
+    parser.add_argument("--latency", type=float, default=0.0, help="Response delay in milliseconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Percentage of requests dropped")
+    parser.add_argument("--backend", choices=["sync", "async"], default="async")
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--max-repetitions", type=int, default=25)
+    parser.add_argument("--timeout-mode", choices=["fixed", "adaptive"], default="fixed")
+    parser.add_argument("--rate", type=float, help="Maximum requests per second")
+    parser.add_argument("--subnet-rate", type=float, help="Maximum requests per second per /24 subnet")
+    parser.add_argument("--host-inflight", type=int, help="Maximum requests outstanding per agent")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    fleet = multiprocessing.Process(
+        target=serve_fleet,
+        args=(args.devices, args.interfaces, args.port, args.latency / 1000, args.loss / 100, ready, stop),
+        daemon=True,
+    )
+    fleet.start()
+    if not ready.wait(timeout=120):
+        fleet.terminate()
+        raise SystemExit("ERROR: simulated agents did not start")
+
+    try:
+        addresses = fleet_addresses(args.devices)
+        start = time.perf_counter()
+        results = run_discovery(args, addresses)
+        discovery_time = time.perf_counter() - start
+        discovery_rss = peak_rss_mb()
+    finally:
+        stop.set()
+        fleet.join(timeout=10)
+
+    devices = [result.device for result in results if result.error is None]
+    errors = len(results) - len(devices)
+    pdus = [result.stats["pdus"] for result in results if "pdus" in result.stats]
+    print(
+        f"devices {args.devices}, interfaces {args.interfaces}, latency {args.latency} ms, "
+        f"loss {args.loss}%, backend {args.backend}, workers {args.workers}, "
+        f"max repetitions {args.max_repetitions}, timeout mode {args.timeout_mode}, "
+        f"rate {args.rate}, subnet rate {args.subnet_rate}, host in-flight {args.host_inflight}"
+    )
+    report(
+        "discovery",
+        len(devices),
+        discovery_time,
+        [result.stats["elapsed"] for result in results],
+        discovery_rss,
+        f" pdus/device {statistics.mean(pdus) if pdus else 0:.1f} errors {errors}",
+    )
+
+    start = time.perf_counter()
+    latencies, entities = run_serialization(devices)
+    serialization_time = time.perf_counter() - start
+    report(
+        "serialization",
+        len(devices),
+        serialization_time,
+        latencies,
+        peak_rss_mb(),
+        f" entities {entities}",
+    )
+
+
+if __name__ == "__main__":
+    main()
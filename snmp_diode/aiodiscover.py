@@ -0,0 +1,226 @@
+import asyncio
+import queue
+import threading
+import time
+import traceback
+from snmp_diode import ber, models, ratelimit, rtt, usm
+from snmp_diode.device import (
+    DiscoveryResult,
+    ADDRESS_COLUMNS,
+    DEFAULT_MAX_REPETITIONS,
+    IF_ADMIN_STATUS,
+    IF_ALIAS,
+    IF_DESCR,
+    IF_PHYS_ADDRESS,
+    INTERFACE_COLUMNS,
+    IP_AD_ENT_ADDR,
+    IP_AD_ENT_IF_INDEX,
+    IP_AD_ENT_NET_MASK,
+    SYSTEM_SCALARS,
+    build_interfaces,
+    get_device_model,
+)
+from snmp_diode.state import MARKERS
+from snmp_diode.transport import AsyncSession, close_dispatcher
+
+
+def build_session(address, snmp_data):
+    if snmp_data["version"] == 3:
+        return AsyncSession(
+            hostname=address,
+            version=3,
+            remote_port=snmp_data.get("port", 161),
+            max_repetitions=snmp_data.get("max_repetitions", DEFAULT_MAX_REPETITIONS),
+            user=usm.build_user(snmp_data["version_data"]),
+            estimator=rtt.for_session(snmp_data),
+            limiter=ratelimit.for_session(snmp_data),
+        )
+    return AsyncSession(
+        hostname=address,
+        community=snmp_data["version_data"]["community"],
+        version=snmp_data["version"],
+        remote_port=snmp_data.get("port", 161),
+        max_repetitions=snmp_data.get("max_repetitions", DEFAULT_MAX_REPETITIONS),
+        estimator=rtt.for_session(snmp_data),
+        limiter=ratelimit.for_session(snmp_data),
+    )
+
+
+def to_text(item):
+    # Mirrors what the sync backend reads from easysnmp sprint values once
+    # the quotes are stripped.
+    if isinstance(item.value, bytes):
+        return item.value.decode("utf-8", errors="replace").replace('"', "")
+    if item.value is None:
+        return ""
+    return str(item.value)
+
+
+def to_mac(item):
+    if not isinstance(item.value, bytes):
+        return ""
+    return ":".join(f"{octet:02X}" for octet in item.value)
+
+
+def to_timeticks(item):
+    return item.value if item.type == ber.TIMETICKS else None
+
+
+async def gater_device_data(address, snmp_data, role=None, site=None, stats=None, state=None, session=None):
+    # A session passed in is left open, so it can be reused across polls of
+    # the same device.
+    if session is None:
+        async with build_session(address, snmp_data) as session:
+            return await collect_device_data(address, session, role, site, stats, state)
+    return await collect_device_data(address, session, role, site, stats, state)
+
+
+async def collect_device_data(address, session, role=None, site=None, stats=None, state=None):
+    pdus = session.pdus
+    scalars = await get_system_scalars(session)
+    manufacturer, device_type = get_device_model(to_text(scalars["sysobjectid"]))
+
+    markers = {marker: to_timeticks(scalars[marker]) for marker in MARKERS}
+    previous = None if state is None else state.cached_state(address, markers)
+    if previous is None:
+        interfaces = await process_interfaces(session)
+    else:
+        interfaces = previous.device.interfaces
+
+    device_data = {
+        "name": to_text(scalars["name"]),
+        "manufacturer": manufacturer,
+        "device_type": device_type,
+        "site": to_text(scalars["location"]),
+        "interfaces": interfaces,
+    }
+    if site is not None:
+        device_data["site"] = site
+
+    if role is not None:
+        device_data["role"] = role
+
+    if stats is not None:
+        stats["pdus"] = session.pdus - pdus
+        stats["markers"] = markers
+        if previous is not None:
+            stats["walked"] = previous.walked
+
+    return models.Device(**device_data)
+
+
+async def get_system_scalars(session):
+    items = await session.get(list(SYSTEM_SCALARS.values()))
+    return dict(zip(SYSTEM_SCALARS, items))
+
+
+async def process_interfaces(session):
+    interfaces = {}
+    for interface_id, row in (await session.walk_table(INTERFACE_COLUMNS)).items():
+        if IF_DESCR not in row:
+            continue
+        interfaces[interface_id] = {"index": interface_id, "name": to_text(row[IF_DESCR])}
+        if IF_PHYS_ADDRESS in row:
+            interfaces[interface_id]["mac"] = to_mac(row[IF_PHYS_ADDRESS])
+        if IF_ADMIN_STATUS in row:
+            interfaces[interface_id]["enabled"] = row[IF_ADMIN_STATUS].value == 1
+        if IF_ALIAS in row:
+            interfaces[interface_id]["description"] = to_text(row[IF_ALIAS])
+
+    addresses = {}
+    for row in (await session.walk_table(ADDRESS_COLUMNS)).values():
+        if IP_AD_ENT_ADDR not in row:
+            continue
+        address = row[IP_AD_ENT_ADDR].value
+        addresses[address] = {"address": address}
+        if IP_AD_ENT_IF_INDEX in row:
+            addresses[address]["if_oid"] = str(row[IP_AD_ENT_IF_INDEX].value)
+        if IP_AD_ENT_NET_MASK in row:
+            addresses[address]["netmask"] = row[IP_AD_ENT_NET_MASK].value
+
+    return build_interfaces(interfaces, addresses)
+
+
+async def discover_host(address, snmp_data, role=None, site=None, state=None, pool=None):
+    # With a pool.SessionPool the session is borrowed from it.
+    stats = {}
+    start = time.perf_counter()
+    try:
+        if pool is None:
+            device_data = await gater_device_data(address, snmp_data, role, site, stats, state)
+        else:
+            with pool.session(address, snmp_data) as session:
+                device_data = await gater_device_data(address, snmp_data, role, site, stats, state, session)
+        return DiscoveryResult(address, device_data, None, stats)
+    except Exception as e:
+        error_message = f"{str(e)}\n{traceback.format_exc()}"
+        return DiscoveryResult(address, None, error_message, stats)
+    finally:
+        stats["elapsed"] = time.perf_counter() - start
+
+
+async def sweep(addresses, snmp_data, role=None, site=None, concurrency=256, state=None):
+    pending = set()
+    for address in addresses:
+        pending.add(
+            asyncio.ensure_future(discover_host(str(address), snmp_data, role, site, state))
+        )
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            yield task.result()
+
+
+def run_sweep(addresses, snmp_data, role=None, site=None, concurrency=256, state=None):
+    # Runs the async sweep on an event loop in a helper thread and hands the
+    # results back as a regular generator, like sweep.sweep does. The queue
+    # is bounded like the in-flight hosts, a consumer slower than discovery,
+    # such as Diode ingestion, holds the sweep back instead of letting the
+    # finished devices pile up.
+    results = queue.Queue(maxsize=concurrency)
+    done = object()
+    running = {}
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        running["loop"] = loop
+        running["task"] = asyncio.current_task()
+        try:
+            async for result in sweep(addresses, snmp_data, role, site, concurrency, state):
+                try:
+                    results.put_nowait(result)
+                except queue.Full:
+                    await loop.run_in_executor(None, results.put, result)
+        finally:
+            close_dispatcher()
+
+    def runner():
+        try:
+            asyncio.run(produce())
+        except BaseException as e:
+            results.put(e)
+        results.put(done)
+
+    thread = threading.Thread(target=runner, name="snmp-diode-async", daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results.get()
+            if result is done:
+                return
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        if thread.is_alive():
+            # The consumer stopped early, the sweep is cancelled and the
+            # results still on their way are dropped, so the producer is
+            # never left blocked on the full queue.
+            running["loop"].call_soon_threadsafe(running["task"].cancel)
+            while results.get() is not done:
+                pass
+        thread.join()
@@ -0,0 +1,404 @@
+from collections import namedtuple
+
+# Minimal BER codec for SNMP messages, just enough for the GET, GETNEXT
+# and GETBULK requests used by discovery and their responses, plus the
+# SNMPv3 message framing needed for engine discovery.
+
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+OPAQUE = 0x44
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+GET_RESPONSE = 0xA2
+SET_REQUEST = 0xA3
+GET_BULK_REQUEST = 0xA5
+REPORT = 0xA8
+
+VERSION_1 = 0
+VERSION_2C = 1
+VERSION_3 = 3
+
+USM_SECURITY_MODEL = 3
+MSG_FLAG_AUTH = 0x01
+MSG_FLAG_PRIV = 0x02
+MSG_FLAG_REPORTABLE = 0x04
+MAX_MESSAGE_SIZE = 65507
+
+UNSIGNED_TYPES = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+EXCEPTION_TYPES = (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW)
+
+Varbind = namedtuple("Varbind", ["oid", "type", "value"])
+Message = namedtuple(
+    "Message",
+    [
+        "version",
+        "community",
+        "pdu_type",
+        "request_id",
+        "error_status",
+        "error_index",
+        "varbinds",
+    ],
+)
+V3Message = namedtuple(
+    "V3Message",
+    ["msg_id", "max_size", "flags", "security_model", "security_parameters", "data"],
+)
+USMParameters = namedtuple(
+    "USMParameters",
+    ["engine_id", "engine_boots", "engine_time", "user_name", "auth_parameters", "priv_parameters"],
+)
+
+
+class BERError(ValueError):
+    pass
+
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes((length,))
+    raw = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes((0x80 | len(raw),)) + raw
+
+
+def encode_tlv(tag, payload):
+    return bytes((tag,)) + encode_length(len(payload)) + payload
+
+
+def encode_integer(value, tag=INTEGER):
+    if tag in UNSIGNED_TYPES:
+        raw = value.to_bytes(value.bit_length() // 8 + 1, "big")
+    else:
+        raw = value.to_bytes((value + (value < 0)).bit_length() // 8 + 1, "big", signed=True)
+    return encode_tlv(tag, raw)
+
+
+def encode_oid(oid):
+    arcs = oid_to_tuple(oid)
+    if len(arcs) < 2:
+        raise BERError(f"OID {oid} must have at least two arcs")
+    payload = bytearray()
+    for arc in (arcs[0] * 40 + arcs[1],) + arcs[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        payload.extend(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(payload))
+
+
+def encode_value(value_type, value):
+    if value_type in (INTEGER,) + UNSIGNED_TYPES:
+        return encode_integer(value, value_type)
+    if value_type in (OCTET_STRING, OPAQUE):
+        if isinstance(value, str):
+            value = value.encode()
+        return encode_tlv(value_type, value)
+    if value_type == OBJECT_IDENTIFIER:
+        return encode_oid(value)
+    if value_type == IP_ADDRESS:
+        return encode_tlv(IP_ADDRESS, bytes(int(octet) for octet in value.split(".")))
+    if value_type == NULL or value_type in EXCEPTION_TYPES:
+        return encode_tlv(value_type, b"")
+    raise BERError(f"Unsupported value type 0x{value_type:02x}")
+
+
+def encode_varbinds(varbinds):
+    payload = b"".join(
+        encode_tlv(SEQUENCE, encode_oid(oid) + encode_value(value_type, value))
+        for oid, value_type, value in varbinds
+    )
+    return encode_tlv(SEQUENCE, payload)
+
+
+def encode_pdu(pdu_type, request_id, varbinds, error_status=0, error_index=0):
+    return encode_tlv(
+        pdu_type,
+        encode_integer(request_id)
+        + encode_integer(error_status)
+        + encode_integer(error_index)
+        + encode_varbinds(varbinds),
+    )
+
+
+def encode_message(
+    version,
+    community,
+    pdu_type,
+    request_id,
+    varbinds,
+    error_status=0,
+    error_index=0,
+):
+    # For GETBULK requests error_status and error_index carry non-repeaters
+    # and max-repetitions.
+    if isinstance(community, str):
+        community = community.encode()
+    return encode_tlv(
+        SEQUENCE,
+        encode_integer(version)
+        + encode_tlv(OCTET_STRING, community)
+        + encode_pdu(pdu_type, request_id, varbinds, error_status, error_index),
+    )
+
+
+def encode_request(version, community, pdu_type, request_id, oids, non_repeaters=0, max_repetitions=0):
+    varbinds = [(oid, NULL, None) for oid in oids]
+    return encode_message(
+        version, community, pdu_type, request_id, varbinds, non_repeaters, max_repetitions
+    )
+
+
+def encode_request_pdu(pdu_type, request_id, oids, non_repeaters=0, max_repetitions=0):
+    # The bare PDU, for SNMPv3 where it travels in a ScopedPDU.
+    return encode_pdu(pdu_type, request_id, [(oid, NULL, None) for oid in oids], non_repeaters, max_repetitions)
+
+
+def decode_tlv(data, offset=0):
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+    except IndexError:
+        raise BERError("Truncated BER header") from None
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    end = offset + length
+    if end > len(data):
+        raise BERError("Truncated BER value")
+    return tag, offset, end
+
+
+def decode_oid(raw):
+    arcs = []
+    arc = 0
+    for byte in raw:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    if not arcs:
+        raise BERError("Empty OID")
+    first = arcs[0]
+    if first < 80:
+        head = [first // 40, first % 40]
+    else:
+        head = [2, first - 80]
+    return "." + ".".join(str(arc) for arc in head + arcs[1:])
+
+
+def decode_value(tag, raw):
+    if tag == INTEGER:
+        return int.from_bytes(raw, "big", signed=True)
+    if tag in UNSIGNED_TYPES:
+        return int.from_bytes(raw, "big")
+    if tag in (OCTET_STRING, OPAQUE):
+        return bytes(raw)
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(raw)
+    if tag == IP_ADDRESS:
+        return ".".join(str(octet) for octet in raw)
+    if tag == NULL or tag in EXCEPTION_TYPES:
+        return None
+    # Types left out of SNMPv2, such as NsapAddress or UInteger32 still sent
+    # by old agents, are kept raw rather than failing the whole response.
+    return bytes(raw)
+
+
+def _decode_integer(data, offset, expected=INTEGER):
+    tag, start, end = decode_tlv(data, offset)
+    if tag != expected:
+        raise BERError(f"Expected tag 0x{expected:02x}, got 0x{tag:02x}")
+    return int.from_bytes(data[start:end], "big", signed=True), end
+
+
+def decode_varbinds(data, offset):
+    tag, start, end = decode_tlv(data, offset)
+    if tag != SEQUENCE:
+        raise BERError("Malformed varbind list")
+    varbinds = []
+    while start < end:
+        _, item_start, item_end = decode_tlv(data, start)
+        oid_tag, oid_start, oid_end = decode_tlv(data, item_start)
+        if oid_tag != OBJECT_IDENTIFIER:
+            raise BERError("Malformed varbind")
+        value_tag, value_start, value_end = decode_tlv(data, oid_end)
+        varbinds.append(
+            Varbind(
+                decode_oid(data[oid_start:oid_end]),
+                value_tag,
+                decode_value(value_tag, data[value_start:value_end]),
+            )
+        )
+        start = item_end
+    return varbinds, end
+
+
+def decode_pdu(data, offset):
+    pdu_type, start, _ = decode_tlv(data, offset)
+    request_id, start = _decode_integer(data, start)
+    error_status, start = _decode_integer(data, start)
+    error_index, start = _decode_integer(data, start)
+    varbinds, _ = decode_varbinds(data, start)
+    return pdu_type, request_id, error_status, error_index, varbinds
+
+
+def decode_message(data):
+    data = memoryview(data)
+    tag, start, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERError("Not an SNMP message")
+    version, start = _decode_integer(data, start)
+    tag, community_start, start = decode_tlv(data, start)
+    if tag != OCTET_STRING:
+        raise BERError("Malformed community")
+    community = bytes(data[community_start:start])
+    return Message(version, community, *decode_pdu(data, start))
+
+
+def encode_usm_parameters(
+    engine_id=b"",
+    engine_boots=0,
+    engine_time=0,
+    user_name=b"",
+    auth_parameters=b"",
+    priv_parameters=b"",
+):
+    if isinstance(user_name, str):
+        user_name = user_name.encode()
+    return encode_tlv(
+        SEQUENCE,
+        encode_tlv(OCTET_STRING, engine_id)
+        + encode_integer(engine_boots)
+        + encode_integer(engine_time)
+        + encode_tlv(OCTET_STRING, user_name)
+        + encode_tlv(OCTET_STRING, auth_parameters)
+        + encode_tlv(OCTET_STRING, priv_parameters),
+    )
+
+
+def encode_scoped_pdu(context_engine_id, context_name, pdu):
+    if isinstance(context_name, str):
+        context_name = context_name.encode()
+    return encode_tlv(
+        SEQUENCE,
+        encode_tlv(OCTET_STRING, context_engine_id)
+        + encode_tlv(OCTET_STRING, context_name)
+        + pdu,
+    )
+
+
+def encode_v3_message(msg_id, flags, security_parameters, data, max_size=MAX_MESSAGE_SIZE):
+    # data is either an encoded ScopedPDU or, with privacy, the encrypted
+    # ScopedPDU already wrapped in an OCTET STRING.
+    return encode_tlv(
+        SEQUENCE,
+        encode_integer(VERSION_3)
+        + encode_tlv(
+            SEQUENCE,
+            encode_integer(msg_id)
+            + encode_integer(max_size)
+            + encode_tlv(OCTET_STRING, bytes((flags,)))
+            + encode_integer(USM_SECURITY_MODEL),
+        )
+        + encode_tlv(OCTET_STRING, security_parameters)
+        + data,
+    )
+
+
+def encode_v3_discovery(msg_id, request_id):
+    # Unauthenticated request with an empty engine ID, agents answer it with
+    # a Report carrying their engine ID, boots and time (RFC 3414 4.).
+    return encode_v3_message(
+        msg_id,
+        MSG_FLAG_REPORTABLE,
+        encode_usm_parameters(),
+        encode_scoped_pdu(b"", b"", encode_pdu(GET_REQUEST, request_id, [])),
+    )
+
+
+def decode_version(data):
+    data = memoryview(data)
+    tag, start, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERError("Not an SNMP message")
+    return _decode_integer(data, start)[0]
+
+
+def decode_v3_message(data):
+    data = memoryview(data)
+    tag, start, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERError("Not an SNMP message")
+    version, start = _decode_integer(data, start)
+    if version != VERSION_3:
+        raise BERError(f"Not an SNMPv3 message, version {version}")
+    tag, header_start, start = decode_tlv(data, start)
+    if tag != SEQUENCE:
+        raise BERError("Malformed SNMPv3 header")
+    msg_id, header_start = _decode_integer(data, header_start)
+    max_size, header_start = _decode_integer(data, header_start)
+    _, flags_start, header_start = decode_tlv(data, header_start)
+    flags = data[flags_start] if header_start > flags_start else 0
+    security_model, header_start = _decode_integer(data, header_start)
+    tag, params_start, start = decode_tlv(data, start)
+    if tag != OCTET_STRING:
+        raise BERError("Malformed SNMPv3 security parameters")
+    return V3Message(
+        msg_id,
+        max_size,
+        flags,
+        security_model,
+        bytes(data[params_start:start]),
+        bytes(data[start:]),
+    )
+
+
+def decode_usm_parameters(data):
+    data = memoryview(data)
+    tag, start, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERError("Malformed USM security parameters")
+    fields = []
+    for expected in (OCTET_STRING, INTEGER, INTEGER, OCTET_STRING, OCTET_STRING, OCTET_STRING):
+        tag, value_start, end = decode_tlv(data, start)
+        if tag != expected:
+            raise BERError("Malformed USM security parameters")
+        raw = data[value_start:end]
+        if tag == INTEGER:
+            fields.append(int.from_bytes(raw, "big", signed=True))
+        else:
+            fields.append(bytes(raw))
+        start = end
+    return USMParameters(*fields)
+
+
+def decode_scoped_pdu(data):
+    data = memoryview(data)
+    tag, start, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise BERError("Malformed ScopedPDU")
+    _, engine_start, start = decode_tlv(data, start)
+    context_engine_id = bytes(data[engine_start:start])
+    _, name_start, start = decode_tlv(data, start)
+    context_name = bytes(data[name_start:start])
+    return (context_engine_id, context_name) + decode_pdu(data, start)
+
+
+def oid_to_tuple(oid):
+    return tuple(int(arc) for arc in oid.strip(".").split("."))
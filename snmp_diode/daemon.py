@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import queue
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from snmp_diode import ratelimit, state as state_store
+from snmp_diode.pool import SessionPool, default_max_size
+from snmp_diode.scheduler import DEFAULT_GROUP, PollGroup, Schedule, Scheduler
+
+# Long running collector behind `snmp-diode serve`. Instead of sweeping
+# once and exiting, every target is polled again every interval seconds,
+# spread by a random jitter so the polls of a large network do not bunch
+# up. Targets can be split in groups with their own interval, priority
+# and deadline, see snmp_diode.scheduler. The registry, the sysObjectID
+# cache, a pool of SNMP sessions and the Diode connection stay warm for the
+# lifetime of the process.
+
+DEFAULT_INTERVAL = 300
+DEFAULT_JITTER = 0.1
+
+# Seconds a partially filled batch waits before it is sent to Diode.
+FLUSH_INTERVAL = 5.0
+
+# Upper bound on how long the main loop sleeps, so a stop request is seen.
+TICK = 1.0
+
+
+class SyncPoller:
+    # Polls with easysnmp sessions on a thread pool. A target is never
+    # polled twice at the same time, so its session is never shared.
+
+    def __init__(self, snmp_data, role, site, workers, cache, pool_size, pool_idle):
+        from snmp_diode import discover, sweep
+
+        self.sweep = sweep
+        self.snmp_data = snmp_data
+        self.role = role
+        self.site = site
+        self.cache = cache
+        self.pool = SessionPool(discover.build_session, pool_size, pool_idle)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def poll(self, address):
+        return self.executor.submit(self._poll, address)
+
+    def _poll(self, address):
+        return self.sweep.discover_host(address, self.snmp_data, self.role, self.site, self.cache, self.pool)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+
+class AsyncPoller:
+    # Polls on an event loop running in a helper thread, with the
+    # AsyncSessions kept between polls and their requests multiplexed over
+    # the loop's shared sockets.
+
+    def __init__(self, snmp_data, role, site, cache, pool_size, pool_idle):
+        from snmp_diode import aiodiscover
+
+        self.aiodiscover = aiodiscover
+        self.snmp_data = snmp_data
+        self.role = role
+        self.site = site
+        self.cache = cache
+        self.pool = SessionPool(aiodiscover.build_session, pool_size, pool_idle)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="snmp-diode-serve", daemon=True)
+        self.thread.start()
+
+    def poll(self, address):
+        return asyncio.run_coroutine_threadsafe(self._poll(address), self.loop)
+
+    async def _poll(self, address):
+        return await self.aiodiscover.discover_host(
+            address, self.snmp_data, self.role, self.site, self.cache, self.pool
+        )
+
+    async def _close_sessions(self):
+        # AsyncSessions are closed on the loop they run on.
+        self.pool.close()
+        self.aiodiscover.close_dispatcher()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._close_sessions(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class Daemon:
+    def __init__(
+        self,
+        targets,
+        snmp_data,
+        sink,
+        role=None,
+        site=None,
+        backend="sync",
+        workers=32,
+        interval=DEFAULT_INTERVAL,
+        jitter=DEFAULT_JITTER,
+        schedule=None,
+        store=None,
+        change_detection=False,
+        resync_every=None,
+        pool_size=None,
+        pool_idle=None,
+    ):
+        # schedule is a scheduler.Schedule, by default every target is
+        # polled every interval. store is a StateStore devices are recorded
+        # in. resync_every enables delta ingestion, one ledger run per
+        # cycle, with a full resync every resync_every of them (0 never). A
+        # cycle ends once every target was polled, or shed, since it
+        # started, so it follows the intervals of the schedule groups.
+        # pool_size and pool_idle bound the idle sessions kept between
+        # polls, see pool.SessionPool. pool_size defaults to what the open
+        # file limit allows, see pool.default_max_size, pool_idle to twice
+        # the longest interval so a session outlives the wait for its next
+        # poll.
+        self.addresses = [str(address) for address in targets]
+        self.snmp_data = snmp_data
+        self.sink = sink
+        self.role = role
+        self.site = site
+        self.backend = backend
+        self.workers = workers
+        self.interval = interval
+        self.jitter = jitter
+        if schedule is None:
+            schedule = Schedule(PollGroup(DEFAULT_GROUP, interval, 0, interval))
+        self.schedule = schedule
+        self.store = store
+        self.change_detection = change_detection
+        self.resync_every = resync_every
+        if pool_size is None:
+            pool_size = default_max_size(backend, workers)
+        self.pool_size = pool_size
+        if pool_idle is None:
+            pool_idle = 2 * max(group.interval for group in schedule.groups.values())
+        self.pool_idle = pool_idle
+        self.stopping = threading.Event()
+        self.polls = 0
+        self.errors = 0
+        self.cycle_failed_batches = 0
+
+    def stop(self, *_):
+        self.stopping.set()
+
+    def build_poller(self):
+        cache = self.store if self.change_detection else None
+        if self.backend == "async":
+            return AsyncPoller(self.snmp_data, self.role, self.site, cache, self.pool_size, self.pool_idle)
+        return SyncPoller(self.snmp_data, self.role, self.site, self.workers, cache, self.pool_size, self.pool_idle)
+
+    def start_cycle(self):
+        run, full = self.store.start_run(self.resync_every)
+        self.sink.ledger = state_store.IngestLedger(self.store, run, full)
+        return run, full
+
+    def finish_cycle(self, cycle):
+        self.sink.flush()
+        # Cycles without --apply send nothing and do not count as runs.
+        if self.sink.client is not None:
+            self.store.finish_run(*cycle, self.sink.failed_batches > self.cycle_failed_batches)
+        self.cycle_failed_batches = self.sink.failed_batches
+
+    def handle(self, result):
+        self.polls += 1
+        if result.error is not None:
+            self.errors += 1
+            print(f"ERROR: {result.address} - {result.error}")
+            return
+        reused = ", interfaces unchanged" if "walked" in result.stats else ""
+        print(f"INFO: {result.address} - polled with {result.stats['pdus']} SNMP requests{reused}")
+        if self.store is not None:
+            self.store.record(
+                result.address, result.device, result.stats.get("markers"), result.stats.get("walked")
+            )
+        self.sink.add(result.device.model_dump())
+
+    def run(self):
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+
+        # The first polls of every group are spread over its interval.
+        now = time.monotonic()
+        scheduler = Scheduler(self.jitter)
+        group_sizes = collections.Counter()
+        for address in self.addresses:
+            group = self.schedule.group_for(address)
+            group_sizes[group.name] += 1
+            scheduler.add(address, group, now + random.uniform(0, group.interval))
+        for name, size in sorted(group_sizes.items()):
+            group = self.schedule.groups[name]
+            print(f"INFO: serving {size} targets of group {name} every {group.interval}s, priority {group.priority}")
+
+        poller = self.build_poller()
+        finished = queue.Queue()
+        in_flight = 0
+        last_flush = now
+        shed = collections.Counter()
+        cycle = None
+        if self.resync_every is not None:
+            cycle = self.start_cycle()
+            # Targets not polled yet in this cycle.
+            cycle_targets = set(self.addresses)
+        try:
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                polls, missed = scheduler.take(now, self.workers - in_flight)
+                for target in polls:
+                    future = poller.poll(target.address)
+                    future.add_done_callback(lambda future, target=target: finished.put((target, future)))
+                    in_flight += 1
+                shed.update(target.group.name for target in missed)
+                if cycle is not None:
+                    cycle_targets.difference_update(target.address for target in missed)
+
+                wait = TICK
+                next_due = scheduler.next_due()
+                if next_due is not None and in_flight < self.workers:
+                    wait = min(wait, max(0.0, next_due - now))
+                try:
+                    target, future = finished.get(timeout=wait)
+                except queue.Empty:
+                    pass
+                else:
+                    in_flight -= 1
+                    self.handle(future.result())
+                    now = time.monotonic()
+                    scheduler.reschedule(target, now)
+                    if cycle is not None:
+                        cycle_targets.discard(target.address)
+
+                if now - last_flush >= FLUSH_INTERVAL:
+                    self.sink.flush()
+                    if shed:
+                        groups = ", ".join(f"{name} {count}" for name, count in sorted(shed.items()))
+                        print(f"WARNING: {sum(shed.values())} polls shed behind schedule: {groups}")
+                        shed.clear()
+                    last_flush = now
+                if cycle is not None and not cycle_targets and self.addresses:
+                    self.finish_cycle(cycle)
+                    cycle = self.start_cycle()
+                    cycle_targets = set(self.addresses)
+        finally:
+            # Let the polls in flight finish, they are bounded by the SNMP
+            # timeouts.
+            while in_flight:
+                in_flight -= 1
+                self.handle(finished.get()[1].result())
+            poller.close()
+            self.sink.flush()
+            print(f"INFO: stopped after {self.polls} polls, {self.errors} errors, {scheduler.shed} shed")
+            pool = poller.pool
+            print(
+                f"INFO: session pool {pool.hits} hits, {pool.misses} misses, "
+                f"{pool.evicted} evicted, {pool.overflowed} of them because the pool was full"
+            )
+            limiter = ratelimit.for_session(self.snmp_data)
+            if limiter is not None:
+                print(f"INFO: rate limit held back SNMP requests {limiter.delayed} times")
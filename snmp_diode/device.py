@@ -0,0 +1,87 @@
+import functools
+import logging
+import netaddr
+from collections import namedtuple
+from snmp_diode import models
+from snmp_diode.registry import get_registry
+
+# What both discovery backends, discover over easysnmp and aiodiscover over
+# the asyncio transport, read from a device and build from it. Kept free of
+# easysnmp so the async backend runs without the native net-snmp build.
+
+DiscoveryResult = namedtuple("DiscoveryResult", ["address", "device", "error", "stats"])
+
+# System group scalars fetched in a single GET, new scalars should be added
+# here so they travel in the same PDU.
+SYSTEM_SCALARS = {
+    "name": ".1.3.6.1.2.1.1.5.0",
+    "sysobjectid": ".1.3.6.1.2.1.1.2.0",
+    "location": ".1.3.6.1.2.1.1.6.0",
+    # sysUpTime, ifTableLastChange and ifStackLastChange, for change
+    # detection.
+    "uptime": ".1.3.6.1.2.1.1.3.0",
+    "if_table_last_change": ".1.3.6.1.2.1.31.1.5.0",
+    "if_stack_last_change": ".1.3.6.1.2.1.31.1.6.0",
+}
+
+logger = logging.getLogger(__name__)
+
+# Distinct sysObjectIDs whose resolution is kept, fleets usually share a
+# handful of them.
+DEVICE_MODEL_CACHE_SIZE = 1024
+
+# Rows requested per GETBULK PDU, 0 falls back to one GETNEXT per row.
+DEFAULT_MAX_REPETITIONS = 25
+
+IF_DESCR = ".1.3.6.1.2.1.2.2.1.2"
+IF_PHYS_ADDRESS = ".1.3.6.1.2.1.2.2.1.6"
+IF_ADMIN_STATUS = ".1.3.6.1.2.1.2.2.1.7"
+IF_ALIAS = ".1.3.6.1.2.1.31.1.1.1.18"
+IP_AD_ENT_ADDR = ".1.3.6.1.2.1.4.20.1.1"
+IP_AD_ENT_IF_INDEX = ".1.3.6.1.2.1.4.20.1.2"
+IP_AD_ENT_NET_MASK = ".1.3.6.1.2.1.4.20.1.3"
+
+# ifAlias lives in ifXTable but shares the ifIndex, so it is walked along
+# with the ifTable columns.
+INTERFACE_COLUMNS = [IF_DESCR, IF_PHYS_ADDRESS, IF_ADMIN_STATUS, IF_ALIAS]
+ADDRESS_COLUMNS = [IP_AD_ENT_ADDR, IP_AD_ENT_IF_INDEX, IP_AD_ENT_NET_MASK]
+
+
+def build_interfaces(interfaces, addresses):
+    for address in addresses:
+        if addresses[address].get("if_oid") in interfaces and "netmask" in addresses[address]:
+            ipnet = netaddr.IPNetwork(
+                    f'{addresses[address]["address"]}/{addresses[address]["netmask"]}'
+                )
+            interfaces[addresses[address]["if_oid"]]["address"] = f"{ipnet.ip}/{ipnet.prefixlen}"
+
+    output = []
+    for interface in interfaces:
+        iface_data = {
+            "name": interfaces[interface]["name"].replace('"', ""),
+            "mac_address": interfaces[interface].get("mac", ""),
+            "enabled": interfaces[interface].get("enabled", False),
+        }
+        if "description" in interfaces[interface]:
+            iface_data["description"] = interfaces[interface]["description"]
+        else:
+            iface_data["description"] = ""
+
+        if "address" in interfaces[interface]:
+            iface_data["address"] = interfaces[interface]["address"]
+
+        output.append(models.Interface(**iface_data))
+    return output
+
+
+@functools.lru_cache(maxsize=DEVICE_MODEL_CACHE_SIZE)
+def get_device_model(sysoid):
+    logger.debug("resolving sysObjectID %s", sysoid)
+    manufacturer = "unknow"
+    device_type = "unknow"
+    name, product = get_registry().resolve(sysoid)
+    if name is not None:
+        manufacturer = name
+    if product is not None:
+        device_type = product
+    return (manufacturer, device_type)
@@ -1,12 +1,158 @@
-from easysnmp import Session
-import netaddr
-from snmp_diode import models
-from snmp_diode.sysobjectid import manufacturers
+from easysnmp import EasySNMPTimeoutError, Session
+import re
+import time
+from snmp_diode import models, ratelimit, rtt, usm
+from snmp_diode.device import (
+    ADDRESS_COLUMNS,
+    DEFAULT_MAX_REPETITIONS,
+    IF_ADMIN_STATUS,
+    IF_ALIAS,
+    IF_DESCR,
+    IF_PHYS_ADDRESS,
+    INTERFACE_COLUMNS,
+    IP_AD_ENT_ADDR,
+    IP_AD_ENT_IF_INDEX,
+    IP_AD_ENT_NET_MASK,
+    SYSTEM_SCALARS,
+    build_interfaces,
+    get_device_model,
+)
+from snmp_diode.state import MARKERS
+from snmp_diode.table import TableWalk
 
+# TimeTicks as printed by net-snmp, "(12345) 0:02:03.45" or the quick print
+# form "0:0:02:03.45" (days:hours:minutes:seconds.hundredths).
+TIMETICKS_RAW = re.compile(r"\((\d+)\)")
+TIMETICKS_PRINTED = re.compile(r"^(\d+):(\d+):(\d+):(\d+)(?:\.(\d+))?$")
 
-def gater_device_data(address, snmp_data, role=None, site=None):
+# easysnmp's retries, used as the adaptive timeout mode's retries too.
+DEFAULT_RETRIES = 3
+
+# Relative change of the adaptive timeout beyond which a pooled session is
+# updated with the new one, see DiscoverySession.refresh.
+TIMEOUT_DRIFT = 0.25
+
+END_OF_WALK_TYPES = ("ENDOFMIBVIEW", "NOSUCHOBJECT", "NOSUCHINSTANCE")
+
+
+class DiscoverySession:
+    # Wraps an easysnmp.Session so that table walks use GETBULK and every
+    # request PDU sent to the device is counted. With an rtt.RTTEstimator
+    # every request is timed, net-snmp retransmits on its own so only the
+    # requests answered within the first timeout are sampled. With a
+    # ratelimit.RateLimiter every request waits for its request slot and
+    # tokens, the retransmissions of net-snmp are not paced.
+
+    def __init__(
+        self,
+        session,
+        max_repetitions=DEFAULT_MAX_REPETITIONS,
+        estimator=None,
+        address=None,
+        timeout=None,
+        retries=None,
+        limiter=None,
+    ):
+        self.session = session
+        self.max_repetitions = max_repetitions
+        self.estimator = estimator
+        self.address = address
+        self.timeout = timeout
+        self.retries = retries
+        self.limiter = limiter
+        self.pdus = 0
+
+    def refresh(self):
+        # easysnmp sessions keep the timeout they were built with, a pooled
+        # session is given the current adaptive one when borrowed again.
+        if self.estimator is None:
+            return
+        timeout, retries = self.estimator.timeout(self.address, DEFAULT_RETRIES)
+        if retries == self.retries and abs(timeout - self.timeout) <= self.timeout * TIMEOUT_DRIFT:
+            return
+        self.session.update_session(timeout=timeout, retries=retries)
+        self.timeout = timeout
+        self.retries = retries
+
+    def _request(self, method, *args):
+        self.pdus += 1
+        if self.limiter is None:
+            return self._call(method, *args)
+        self.limiter.acquire(self.address)
+        try:
+            self.limiter.wait(self.address)
+            return self._call(method, *args)
+        finally:
+            self.limiter.release(self.address)
+
+    def _call(self, method, *args):
+        if self.estimator is None:
+            return method(*args)
+        start = time.monotonic()
+        try:
+            result = method(*args)
+        except EasySNMPTimeoutError:
+            self.estimator.backoff(self.address, self.timeout)
+            raise
+        elapsed = time.monotonic() - start
+        if elapsed < self.timeout:
+            self.estimator.sample(self.address, elapsed)
+        return result
+
+    def get(self, oids):
+        return self._request(self.session.get, oids)
+
+    def get_next(self, oids):
+        return self._request(self.session.get_next, oids)
+
+    def get_bulk(self, oids, non_repeaters=0, max_repetitions=DEFAULT_MAX_REPETITIONS):
+        return self._request(self.session.get_bulk, oids, non_repeaters, max_repetitions)
+
+    def walk_table(self, columns):
+        walk = TableWalk(columns, full_oid, is_end_of_walk)
+        while not walk.done:
+            if self.max_repetitions > 0:
+                batch = self.get_bulk(walk.next_oids(), 0, self.max_repetitions)
+            else:
+                batch = self.get_next(walk.next_oids())
+            walk.merge(batch)
+        return walk.rows
+
+
+def is_end_of_walk(item):
+    return item.snmp_type in END_OF_WALK_TYPES
+
+
+def full_oid(item):
+    oid = "." + item.oid.strip(".")
+    if item.oid_index:
+        return f"{oid}.{item.oid_index}"
+    return oid
+
+
+def timeticks(item):
+    if is_end_of_walk(item):
+        return None
+    value = item.value.strip('"').strip()
+    if value.isdigit():
+        return int(value)
+    match = TIMETICKS_RAW.search(value)
+    if match:
+        return int(match.group(1))
+    match = TIMETICKS_PRINTED.match(value)
+    if match:
+        days, hours, minutes, seconds = (int(part) for part in match.group(1, 2, 3, 4))
+        hundredths = int((match.group(5) or "0").ljust(2, "0")[:2])
+        return (((days * 24 + hours) * 60 + minutes) * 60 + seconds) * 100 + hundredths
+    return None
+
+
+def build_session(address, snmp_data):
+    estimator = rtt.for_session(snmp_data)
+    limiter = ratelimit.for_session(snmp_data)
     session_data = {
         "hostname": address,
+        "remote_port": snmp_data.get("port", 161),
         "use_sprint_value": True,
         "version": snmp_data["version"],
         "use_long_names": True,
@@ -25,24 +171,53 @@ def gater_device_data(address, snmp_data, role=None, site=None):
             session_data["auth_password"] = snmp_data["version_data"]["auth"]
             session_data["privacy_protocol"] = snmp_data["version_data"]["privacy_protocol"]
             session_data["privacy_password"] = snmp_data["version_data"]["privacy"]
-        
-    
-    session = Session(**session_data)    
+        # With the engine known, cached from an earlier poll, net-snmp skips
+        # its discovery round trip.
+        engine = usm.discover_engine(
+            address, session_data["remote_port"], retries=DEFAULT_RETRIES, estimator=estimator, limiter=limiter
+        )
+        session_data["security_engine_id"] = engine.engine_id.hex()
+        session_data["context_engine_id"] = engine.engine_id.hex()
+        session_data["engine_boots"] = engine.boots
+        session_data["engine_time"] = usm.engine_time(engine)
+
+    if estimator is not None:
+        session_data["timeout"], session_data["retries"] = estimator.timeout(address, DEFAULT_RETRIES)
+    return DiscoverySession(
+        Session(**session_data),
+        snmp_data.get("max_repetitions", DEFAULT_MAX_REPETITIONS),
+        estimator,
+        address,
+        session_data.get("timeout"),
+        session_data.get("retries"),
+        limiter,
+    )
 
-    device_name_oid = session.get(".1.3.6.1.2.1.1.5.0")
-    sysid_oid = session.get(".1.3.6.1.2.1.1.2.0")
-    location_oid = session.get(".1.3.6.1.2.1.1.6.0")
 
-    device_data = {"hostname": device_name_oid.value}
-    manufacturer, device_type = get_device_model(sysid_oid.value)
+def gater_device_data(address, snmp_data, role=None, site=None, stats=None, state=None, session=None):
+    # With a StateStore as state, the interfaces recorded by the previous
+    # run are reused when sysUpTime, ifTableLastChange and ifStackLastChange
+    # show nothing changed since. A DiscoverySession can be passed in to
+    # reuse it across polls of the same device.
+    if session is None:
+        session = build_session(address, snmp_data)
+    pdus = session.pdus
 
-    interfaces = process_interfaces(session)
+    scalars = get_system_scalars(session)
+    manufacturer, device_type = get_device_model(scalars["sysobjectid"].value)
+
+    markers = {marker: timeticks(scalars[marker]) for marker in MARKERS}
+    previous = None if state is None else state.cached_state(address, markers)
+    if previous is None:
+        interfaces = process_interfaces(session)
+    else:
+        interfaces = previous.device.interfaces
 
     device_data = {
-        "name": device_name_oid.value.replace('"', ""),
+        "name": scalars["name"].value.replace('"', ""),
         "manufacturer": manufacturer,
         "device_type": device_type,
-        "site": location_oid.value.replace('"', ""),
+        "site": scalars["location"].value.replace('"', ""),
         "interfaces": interfaces,
     }
     if site is not None:
@@ -50,107 +225,45 @@ def gater_device_data(address, snmp_data, role=None, site=None):
 
     if role is not None:
         device_data["role"] = role
-        
-    return models.Device(**device_data)
 
+    if stats is not None:
+        stats["pdus"] = session.pdus - pdus
+        stats["markers"] = markers
+        if previous is not None:
+            stats["walked"] = previous.walked
 
-def process_interfaces(session):
-    if_name = session.walk(".1.3.6.1.2.1.2.2.1.2")
-
-    interfaces = {}
-    for item in if_name:
-        iface_name = item.value
-        interface_id = item.oid_index
-        interfaces[interface_id] = {"index": interface_id, "name": iface_name}
-
-    if_mac = session.walk("1.3.6.1.2.1.2.2.1.6")
-
-    for item in if_mac:
-        iface_name = item.value
-        interface_id = item.oid_index
-        interfaces[interface_id]["mac"] = item.value.replace('"', "")[:-1].replace(
-            " ", ":"
-        )
+    return models.Device(**device_data)
 
-    if_admin = session.walk("1.3.6.1.2.1.2.2.1.7")
 
+def get_system_scalars(session):
+    items = session.get(list(SYSTEM_SCALARS.values()))
+    return dict(zip(SYSTEM_SCALARS, items))
 
-    for item in if_admin:
-        iface_name = item.value
-        interface_id = item.oid_index
-        enabled = False
-        if item.value == "1":
-            enabled = True
-        interfaces[interface_id]["enabled"] = enabled
 
-    address_items = session.walk(".1.3.6.1.2.1.4.20.1.1")
+def process_interfaces(session):
+    interfaces = {}
+    for interface_id, row in session.walk_table(INTERFACE_COLUMNS).items():
+        if IF_DESCR not in row:
+            continue
+        interfaces[interface_id] = {"index": interface_id, "name": row[IF_DESCR].value}
+        if IF_PHYS_ADDRESS in row:
+            interfaces[interface_id]["mac"] = row[IF_PHYS_ADDRESS].value.replace('"', "")[:-1].replace(
+                " ", ":"
+            )
+        if IF_ADMIN_STATUS in row:
+            interfaces[interface_id]["enabled"] = row[IF_ADMIN_STATUS].value == "1"
+        if IF_ALIAS in row:
+            interfaces[interface_id]["description"] = row[IF_ALIAS].value.replace('"', "")
 
     addresses = {}
-    for item in address_items:
-        addresses[item.value] = {"address": item.value}
-
-    address_if_items = session.walk(".1.3.6.1.2.1.4.20.1.2")
-
-    for item in address_if_items:
-        full_oid = f"{item.oid}.{item.oid_index}"
-        address = full_oid.replace(".1.3.6.1.2.1.4.20.1.2.", "")
-        if address in addresses:
-            addresses[address]["if_oid"] = item.value
-
-    address_mask_items = session.walk(".1.3.6.1.2.1.4.20.1.3")
-
-    for item in address_mask_items:
-        full_oid = f"{item.oid}.{item.oid_index}"
-        address = full_oid.replace(".1.3.6.1.2.1.4.20.1.3.", "")
-        if address in addresses:
-            addresses[address]["netmask"] = item.value
-
-    for address in addresses:
-        if addresses[address]["if_oid"] in interfaces:
-            ipnet = netaddr.IPNetwork(
-                    f'{addresses[address]["address"]}/{addresses[address]["netmask"]}'
-                )
-            interfaces[addresses[address]["if_oid"]]["address"] = f"{ipnet.ip}/{ipnet.prefixlen}"
-
-    description_items = session.walk(".1.3.6.1.2.1.31.1.1.1.18")
-    
-
-    for item in description_items:
-        interface_id = item.oid_index
-        if interface_id in interfaces:
-            interfaces[interface_id]["description"] = item.value.replace('"', "")
-
-    output = []
-    for interface in interfaces:
-        iface_data = {
-            "name": interfaces[interface]["name"].replace('"', ""),
-            "mac_address": interfaces[interface]["mac"],
-            "enabled": interfaces[interface]["enabled"],
-        }
-        if "description" in interfaces[interface]:
-            iface_data["description"] = interfaces[interface]["description"]
-        else:
-            iface_data["description"] = ""
-
-        if "address" in interfaces[interface]:
-            iface_data["address"] = interfaces[interface]["address"]
-
-        output.append(models.Interface(**iface_data))
-    return output
-
-
-def get_device_model(sysoid):
-    print(sysoid)
-    manufacturer = "unknow"
-    device_type = "unknow"
-    sysoid_list = sysoid.split(".")
-    if sysoid_list[0] == "":
-        sysoid_list = sysoid_list[1:]
-    if len(sysoid_list) > 6:
-        man_id = int(sysoid_list[6])
-        if man_id in manufacturers:
-            manufacturer = manufacturers[man_id]["name"]
-            model_id = int(sysoid_list[-1])
-            if model_id in manufacturers[man_id]["products"]:
-                device_type = manufacturers[man_id]["products"][model_id]
-    return (manufacturer, device_type)
+    for row in session.walk_table(ADDRESS_COLUMNS).values():
+        if IP_AD_ENT_ADDR not in row:
+            continue
+        address = row[IP_AD_ENT_ADDR].value
+        addresses[address] = {"address": address}
+        if IP_AD_ENT_IF_INDEX in row:
+            addresses[address]["if_oid"] = row[IP_AD_ENT_IF_INDEX].value
+        if IP_AD_ENT_NET_MASK in row:
+            addresses[address]["netmask"] = row[IP_AD_ENT_NET_MASK].value
+
+    return build_interfaces(interfaces, addresses)
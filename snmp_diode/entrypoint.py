@@ -1,18 +1,24 @@
-import traceback
 import argparse
+import contextlib
+import logging
 import netaddr
 import os
+import sys
+import time
 from netboxlabs.diode.sdk import DiodeClient
-from snmp_diode import discover
+from snmp_diode import aiodiscover, daemon, device, ingest, probe, procsweep, ratelimit, rtt, scheduler, shard, state, usm
 
 
 parser = argparse.ArgumentParser(description="SNMP Discovery Tool for NetBoxLabs Diode")
 
 snmpv3_levels = ["noAuthNoPriv", "authNoPriv", "authPriv"]
 snmpv3_auth_protocols = ["MD5", "SHA"] 
+backends = ["sync", "async"]
 
 parser.add_argument("-t", "--host", type=str, help="Target Host Address", required=False)
 parser.add_argument("-n", "--network", type=str, help="Target Network Address", required=False)
+parser.add_argument("--targets", type=str, help="File listing target addresses, networks and hostnames, one per line", required=False)
+parser.add_argument("-p", "--port", type=int, default=161, help="SNMP Port", required=False)
 parser.add_argument("-v", "--version", type=str, help="SNMP Version", required=True)
 parser.add_argument("-c", "--community", type=str, help="SNMP Community String", required=False)
 parser.add_argument("-u", "--username", type=str, help="SNMPv3 Username", required=False)
@@ -26,17 +32,54 @@ parser.add_argument("-k", "--api_key", type=str, help="Diode API Key", required=
 parser.add_argument( "--apply", action="store_true", default=False, help="Apply the changes to NetBox", required=False,)
 parser.add_argument("-r", "--role" , type=str, help="Role of the device", required=False)
 parser.add_argument("-s", "--site", type=str, help="Site of the device", required=False)
+parser.add_argument("-w", "--workers", type=int, default=32, help="Number of hosts discovered in parallel", required=False)
+parser.add_argument("-b", "--backend", type=str, default="sync", help="Discovery backend", required=False, choices=backends)
+parser.add_argument("-m", "--max-repetitions", type=int, default=25, help="Rows fetched per GETBULK request, 0 walks tables with GETNEXT", required=False)
+parser.add_argument("--timeout-mode", type=str, default="fixed", help="SNMP request timeouts, fixed or adaptive to the round trip time measured per host and subnet", required=False, choices=rtt.TIMEOUT_MODES)
+parser.add_argument("--rate", type=float, help="Maximum SNMP requests sent per second", required=False)
+parser.add_argument("--subnet-rate", type=float, help="Maximum SNMP requests sent per second to every /24 or /64 subnet", required=False)
+parser.add_argument("--host-inflight", type=int, help="Maximum SNMP requests outstanding per host", required=False)
+parser.add_argument("--batch-size", type=int, default=ingest.DEFAULT_BATCH_SIZE, help="Maximum entities sent to Diode per ingest request", required=False)
+parser.add_argument("--batch-bytes", type=int, default=ingest.DEFAULT_BATCH_BYTES, help="Maximum serialized bytes sent to Diode per ingest request", required=False)
+parser.add_argument("--debug", action="store_true", default=False, help="Enable debug logging", required=False)
+parser.add_argument("--probe", action="store_true", default=False, help="Probe every address with a single SNMP GET and only discover the responders", required=False)
+parser.add_argument("--probe-timeout", type=float, default=0.5, help="Seconds to wait for probe responses", required=False)
+parser.add_argument("--probe-retries", type=int, default=1, help="Number of probe retries for silent addresses", required=False)
+parser.add_argument("--probe-rate", type=int, default=1000, help="Probe packets sent per second", required=False)
+parser.add_argument("--processes", type=int, default=1, help="Number of worker processes the targets are split across", required=False)
+parser.add_argument("--direct-ingest", action="store_true", default=False, help="With --processes, every worker process ingests into Diode on its own", required=False)
+parser.add_argument("--shard", type=str, help="Only discover this shard of the targets, INDEX/COUNT such as 3/8", required=False)
+parser.add_argument("--shard-report", type=str, help="Write a JSON completion report for the shard to this file", required=False)
+parser.add_argument("--state", type=str, help="SQLite file recording the devices discovered by every run", required=False)
+parser.add_argument("--change-detection", action="store_true", default=False, help="Reuse the interfaces from --state when sysUpTime and ifTableLastChange show no change", required=False)
+parser.add_argument("--max-cache-age", type=int, default=state.DEFAULT_MAX_AGE, help="Seconds after which --change-detection walks the interface tables again", required=False)
+parser.add_argument("--delta", action="store_true", default=False, help="Only ingest the entities that changed since their last successful ingest, recorded in --state", required=False)
+parser.add_argument("--resync-every", type=int, default=0, help="With --delta, send every entity once every N runs, 0 never forces a full resync", required=False)
+parser.add_argument("--interval", type=float, default=daemon.DEFAULT_INTERVAL, help="With serve, seconds between two polls of a target", required=False)
+parser.add_argument("--jitter", type=float, default=daemon.DEFAULT_JITTER, help="With serve, random spread of the poll interval as a fraction of it", required=False)
+parser.add_argument("--schedule", type=str, help="With serve, JSON file assigning targets to groups with their own interval, priority and deadline", required=False)
+parser.add_argument("--pool-size", type=int, help="With serve, idle SNMP sessions kept warm between polls, by default as many as the open file limit allows", required=False)
+parser.add_argument("--pool-idle", type=float, help="With serve, seconds an idle SNMP session is kept, twice the longest interval by default", required=False)
  
 
 def main():
-    args = parser.parse_args()
+    # `snmp-diode serve ...` takes the same options and keeps polling the
+    # targets instead of sweeping them once.
+    argv = sys.argv[1:]
+    serve = argv[:1] == ["serve"]
+    if serve:
+        argv = argv[1:]
+    args = parser.parse_args(argv)
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
     versions = ["2", "2c", "3"]
-    if args.host is None and args.network is None:
-        print("Please provide either a target IP address or a target network address")
+    target_options = [args.host, args.network, args.targets]
+    if all(option is None for option in target_options):
+        print("Please provide either a target IP address, a target network address or a targets file")
         exit(1)
-    if args.host is not None and args.network is not None:
+    if sum(option is not None for option in target_options) > 1:
         print(
-            "Please provide either a target IP address or a target network address, not both"
+            "Please provide either a target IP address, a target network address or a targets file, not several"
         )
         exit(1)
     if args.version not in versions:
@@ -50,8 +93,27 @@ def main():
     elif args.version == "3":
         version = 3
 
+    if args.max_repetitions < 0:
+        print("Please provide a max repetitions value of 0 or greater")
+        exit(1)
+
+    if any(rate is not None and rate <= 0 for rate in (args.rate, args.subnet_rate, args.host_inflight)):
+        print("Please provide a rate, subnet rate and host in-flight limit greater than 0")
+        exit(1)
+
+    # Every worker process paces its own requests and every one of them
+    # reaches every subnet, see procsweep, so they split the rates.
+    processes = max(args.processes, 1)
     snmp_data = {
         "version": version,
+        "port": args.port,
+        "max_repetitions": args.max_repetitions,
+        "timeout_mode": args.timeout_mode,
+        "rate_limit": {
+            "rate": None if args.rate is None else args.rate / processes,
+            "subnet_rate": None if args.subnet_rate is None else args.subnet_rate / processes,
+            "host_inflight": args.host_inflight,
+        },
     }
     if version == 2:
         snmp_data["version_data"] = {"community": args.community}
@@ -109,42 +171,249 @@ def main():
             print("Please provide a Diode API key, with the --api_key or -k flag, or set the DIODE_API_KEY environment variable")
             exit(1)
 
-    entities = []
-    discover_errors = {}
+    if args.batch_size < 1 or args.batch_bytes < 1:
+        print("Please provide a batch size and batch bytes greater than 0")
+        exit(1)
+
+    if args.workers < 1:
+        print("Please provide a number of workers greater than 0")
+        exit(1)
+
+    if args.processes < 1:
+        print("Please provide a number of processes greater than 0")
+        exit(1)
+
+    if args.direct_ingest and (not args.apply or args.processes < 2):
+        print("--direct-ingest requires --apply and --processes greater than 1")
+        exit(1)
+
+    if args.change_detection and not args.state:
+        print("--change-detection requires --state")
+        exit(1)
+
+    if args.delta and not args.state:
+        print("--delta requires --state")
+        exit(1)
+
+    if args.resync_every < 0:
+        print("Please provide a resync interval of 0 or greater")
+        exit(1)
+
+    if args.schedule and not serve:
+        print("--schedule requires serve")
+        exit(1)
+
+    if serve:
+        if args.processes > 1 or args.probe:
+            print("--processes and --probe are not supported with serve")
+            exit(1)
+        if args.interval <= 0 or not 0 <= args.jitter < 1:
+            print("Please provide an interval greater than 0 and a jitter between 0 and 1")
+            exit(1)
+        if (args.pool_size is not None and args.pool_size < 0) or (args.pool_idle is not None and args.pool_idle <= 0):
+            print("Please provide a pool size of 0 or greater and a pool idle time greater than 0")
+            exit(1)
+
+    if args.backend == "async" and version == 3:
+        try:
+            usm.build_user(snmp_data["version_data"])
+        except usm.USMError as e:
+            print(e)
+            exit(1)
+
+    if args.shard_report and not args.shard:
+        print("--shard-report requires --shard")
+        exit(1)
+
+    if args.shard:
+        try:
+            shard_index, shard_count = shard.parse_shard(args.shard)
+        except shard.ShardError as e:
+            print(f"ERROR: {e}")
+            exit(1)
+
+    started = time.time()
     if args.host:
+        targets = [args.host]
+    elif args.network:
+        targets = netaddr.IPNetwork(args.network)
+    else:
         try:
-            device_data = discover.gater_device_data(args.host, snmp_data, args.role, args.site)
-            entities = entities + device_data.model_dump()
-        except Exception as e:
-            error_message = f"{str(e)}\n{traceback.format_exc()}"
-            discover_errors[args.host] = error_message
-
-    if args.network:
-        network = netaddr.IPNetwork(args.network)
-        for address in network:
+            targets = shard.load_targets(args.targets)
+        except OSError as e:
+            print(f"ERROR: can not read targets file: {e}")
+            exit(1)
+    if args.shard:
+        targets = shard.ShardedTargets(targets, shard_index, shard_count)
+
+    if args.probe:
+        if args.probe_rate < 1:
+            print("Please provide a probe rate greater than 0")
+            exit(1)
+        targets = probe.run_probe(
+            targets, snmp_data, args.probe_timeout, args.probe_retries, args.probe_rate
+        )
+        print(f"INFO: {len(targets)} addresses answered the SNMP probe")
+
+    diode = {
+        "target": args.diode,
+        "app_name": "snmp-diode",
+        "app_version": "0.0.1",
+        "api_key": api_key,
+    }
+    store = None
+    ledger_run = None
+    ledger = None
+    if args.state:
+        store = state.StateStore(args.state, args.max_cache_age)
+        usm.engines.attach(store)
+        if args.delta and not serve:
+            ledger_run = store.start_run(args.resync_every)
+            ledger = state.IngestLedger(store, *ledger_run)
+
+    if serve:
+        default_group = scheduler.PollGroup(scheduler.DEFAULT_GROUP, args.interval, 0, args.interval)
+        schedule = scheduler.Schedule(default_group)
+        if args.schedule:
             try:
-                device_data = discover.gater_device_data(str(address), snmp_data, args.role, args.site)
-                entities = entities + device_data.model_dump()
-            except Exception as e:
-                error_message = f"{str(e)}\n{traceback.format_exc()}"
-                discover_errors[address] = error_message
+                schedule = scheduler.load_schedule(args.schedule, default_group)
+            except scheduler.ScheduleError as e:
+                print(f"ERROR: {e}")
+                exit(1)
+        client = DiodeClient(**diode) if args.apply else None
+        with client or contextlib.nullcontext(), ingest.EntitySink(
+            client, args.batch_size, args.batch_bytes
+        ) as sink:
+            daemon.Daemon(
+                targets,
+                snmp_data,
+                sink,
+                args.role,
+                args.site,
+                args.backend,
+                args.workers,
+                args.interval,
+                args.jitter,
+                schedule,
+                store,
+                args.change_detection,
+                args.resync_every if args.delta else None,
+                args.pool_size,
+                args.pool_idle,
+            ).run()
+        if store is not None:
+            store.close()
+        return
+
+    process_sweep = None
+    if args.processes > 1:
+        process_sweep = procsweep.ProcessSweep(
+            targets,
+            snmp_data,
+            args.role,
+            args.site,
+            args.processes,
+            args.backend,
+            args.workers,
+            args.batch_size,
+            args.batch_bytes,
+            diode if args.direct_ingest else None,
+            args.state,
+            args.change_detection,
+            args.max_cache_age,
+            ledger_run,
+        )
+    else:
+        cache = store if args.change_detection else None
+        if args.backend == "async":
+            results = aiodiscover.run_sweep(targets, snmp_data, args.role, args.site, args.workers, cache)
+        else:
+            # Imported here, easysnmp is only needed by the sync backend.
+            from snmp_diode import sweep
+
+            results = sweep.sweep(targets, snmp_data, args.role, args.site, args.workers, cache)
+
+    if args.apply and not args.direct_ingest:
+        client = DiodeClient(**diode)
+    else:
+        client = None
+
+    discover_errors = {}
+    discovered = 0
+    unchanged = 0
+    with client or contextlib.nullcontext(), ingest.EntitySink(
+        client, args.batch_size, args.batch_bytes, ledger
+    ) as sink:
+        if process_sweep is not None:
+            results = process_sweep.results(sink)
+        for result in results:
+            if result.error is not None:
+                discover_errors[result.address] = result.error
+            else:
+                discovered += 1
+                reused = ", interfaces unchanged" if "walked" in result.stats else ""
+                print(f"INFO: {result.address} - discovered with {result.stats['pdus']} SNMP requests{reused}")
+                if result.device is not None:
+                    if store is not None:
+                        result.stats["changed"] = store.record(
+                            result.address, result.device, result.stats.get("markers"), result.stats.get("walked")
+                        )
+                    sink.add(result.device.model_dump())
+                if result.stats.get("changed") is False:
+                    unchanged += 1
+
+    if process_sweep is not None:
+        for summary in process_sweep.summaries:
+            if summary.error is not None:
+                discover_errors[f"worker {summary.index}"] = summary.error
+        print(f"INFO: sysObjectID cache {process_sweep.cache_hits} hits, {process_sweep.cache_misses} misses")
+    else:
+        cache_info = device.get_device_model.cache_info()
+        print(f"INFO: sysObjectID cache {cache_info.hits} hits, {cache_info.misses} misses")
+        limiter = ratelimit.for_session(snmp_data)
+        if limiter is not None:
+            print(f"INFO: rate limit held back SNMP requests {limiter.delayed} times")
+
+    if args.state:
+        print(f"INFO: {unchanged} of {discovered} devices unchanged since the previous run")
+    if ledger_run is not None:
+        run, full = ledger_run
+        if full:
+            print(f"INFO: delta run {run} is a full resync")
+        else:
+            print(f"INFO: delta run {run}, {sink.unchanged} unchanged entities not sent")
+        if args.apply:
+            store.finish_run(run, full, sink.failed_batches > 0)
+    if store is not None:
+        store.close()
 
     if discover_errors:
         print("ERROR: The following errors were encountered during discovery:")
         for address, error in discover_errors.items():
             print(f"ERROR: {address} - {error}")
 
-    if not args.apply:
-        print(entities)
-    else:
-        with DiodeClient(
-            target=args.diode,
-            app_name="snmp-diode",
-            app_version="0.0.1",
-            api_key=api_key,
-        ) as client:
-            response = client.ingest(entities=entities)
-            if response.errors:
-                print(f"FAIL: response errors: {response.errors}")
-            else:
-                print("INFO: data ingested successfully")
+    if args.apply:
+        if sink.failed_batches:
+            print(f"FAIL: {sink.failed_batches} of {sink.batches} batches failed to ingest")
+        else:
+            print(f"INFO: data ingested successfully, {sink.entities} entities in {sink.batches} batches")
+
+    if args.shard:
+        print(
+            f"INFO: shard {args.shard} complete, {discovered} devices discovered, "
+            f"{len(discover_errors)} errors in {time.time() - started:.1f}s"
+        )
+        if args.shard_report:
+            shard.write_report(
+                args.shard_report,
+                {
+                    "shard": shard_index + 1,
+                    "shards": shard_count,
+                    "started": started,
+                    "finished": time.time(),
+                    "discovered": discovered,
+                    "errors": sorted(discover_errors),
+                    "batches": sink.batches,
+                    "failed_batches": sink.failed_batches,
+                },
+            )
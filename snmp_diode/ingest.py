@@ -0,0 +1,121 @@
+import hashlib
+import traceback
+
+# Diode's gRPC server rejects messages larger than 4 MiB by default, keep
+# batches comfortably below that.
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_BATCH_BYTES = 3 * 1024 * 1024
+
+
+def entity_key(entity, digest):
+    # Identity of the NetBox object an entity describes, so a changed
+    # device, interface or address replaces the digest recorded for it.
+    kind = entity.WhichOneof("entity")
+    if kind == "device":
+        return f"device|{entity.device.site.name}|{entity.device.name}"
+    if kind == "interface":
+        interface = entity.interface
+        return f"interface|{interface.device.site.name}|{interface.device.name}|{interface.name}"
+    if kind == "ip_address":
+        ip_address = entity.ip_address
+        return f"ip_address|{ip_address.address}|{ip_address.interface.device.name}|{ip_address.interface.name}"
+    return f"{kind}|{digest}"
+
+
+def fingerprint(entity):
+    # (identity, content digest) of an entity, ignoring its timestamp.
+    if entity.HasField("timestamp"):
+        stripped = type(entity)()
+        stripped.CopyFrom(entity)
+        stripped.ClearField("timestamp")
+        entity = stripped
+    digest = hashlib.blake2b(entity.SerializeToString(deterministic=True), digest_size=16).hexdigest()
+    return entity_key(entity, digest), digest
+
+
+class EntitySink:
+    # Buffers entities as devices are discovered and pushes them to Diode
+    # whenever the buffer reaches batch_size entities or batch_bytes of
+    # serialized protobuf. Without a client the batches are printed, which
+    # is what the dry mode shows.
+    #
+    # With a ledger (state.IngestLedger) only the entities whose content
+    # changed since their last successful ingest are sent, and the ledger
+    # is updated once a batch is accepted.
+
+    def __init__(self, client=None, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=DEFAULT_BATCH_BYTES, ledger=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.ledger = ledger
+        self.buffer = []
+        self.buffer_fingerprints = []
+        self.buffer_bytes = 0
+        self.batches = 0
+        self.entities = 0
+        self.failed_batches = 0
+        self.unchanged = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def add(self, entities):
+        fingerprints = None
+        if self.ledger is not None:
+            fingerprints = [fingerprint(entity) for entity in entities]
+            unchanged = self.ledger.unchanged(fingerprints)
+            changed = [position for position, (key, _) in enumerate(fingerprints) if key not in unchanged]
+            self.unchanged += len(entities) - len(changed)
+            entities = [entities[position] for position in changed]
+            fingerprints = [fingerprints[position] for position in changed]
+        for position, entity in enumerate(entities):
+            size = entity.ByteSize()
+            if self.buffer and self.buffer_bytes + size > self.batch_bytes:
+                self.flush()
+            self.buffer.append(entity)
+            if fingerprints is not None:
+                self.buffer_fingerprints.append(fingerprints[position])
+            self.buffer_bytes += size
+            if len(self.buffer) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch = self.buffer
+        fingerprints = self.buffer_fingerprints
+        self.buffer = []
+        self.buffer_fingerprints = []
+        self.buffer_bytes = 0
+        self.send(batch, fingerprints)
+
+    def send(self, batch, fingerprints=None):
+        # Pushes an already assembled batch, used by flush and for the
+        # batches built by the worker processes of a process sweep.
+        self.batches += 1
+        self.entities += len(batch)
+        if self.client is None:
+            print(batch)
+            return
+        try:
+            response = self.client.ingest(entities=batch)
+        except Exception as e:
+            self.failed_batches += 1
+            print(f"FAIL: batch {self.batches} of {len(batch)} entities: {str(e)}\n{traceback.format_exc()}")
+            return
+        if response.errors:
+            self.failed_batches += 1
+            print(f"FAIL: batch {self.batches} response errors: {response.errors}")
+            return
+        if self.ledger is not None:
+            self.ledger.commit(fingerprints or [fingerprint(entity) for entity in batch])
+
+    def merge_counters(self, batches, entities, failed_batches, unchanged=0):
+        # Accounts for batches another sink sent on our behalf.
+        self.batches += batches
+        self.entities += entities
+        self.failed_batches += failed_batches
+        self.unchanged += unchanged
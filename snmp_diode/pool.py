@@ -0,0 +1,141 @@
+import contextlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Warm SNMP sessions kept between the polls of the daemon, keyed by host
+# and credential set. A session is borrowed for a whole poll, every phase
+# of the discovery uses it, and handed back once the poll succeeded. A
+# poll that failed drops its session, the next one starts from a fresh
+# session. Idle sessions are evicted once unused for idle_timeout seconds,
+# and beyond max_size the least recently used ones go first, every
+# easysnmp session holds a socket.
+
+DEFAULT_MAX_SIZE = 4096
+
+# File descriptors the sync backend leaves to everything but the idle
+# sessions: the state store, the Diode connection, the sessions of the
+# polls in flight and the interpreter itself.
+FD_HEADROOM = 256
+
+logger = logging.getLogger(__name__)
+
+
+def default_max_size(backend="sync", workers=0):
+    # AsyncSessions share the sockets of the event loop, easysnmp sessions
+    # each hold one and must stay below the open file limit.
+    if backend == "async":
+        return DEFAULT_MAX_SIZE
+    try:
+        import resource
+    except ImportError:
+        return min(DEFAULT_MAX_SIZE, 1024 - FD_HEADROOM - workers)
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_MAX_SIZE
+    return max(min(DEFAULT_MAX_SIZE, soft - FD_HEADROOM - workers), 0)
+
+
+def credentials(snmp_data):
+    # The part of snmp_data a session is bound to.
+    version_data = tuple(sorted(snmp_data["version_data"].items()))
+    return (snmp_data["version"], snmp_data.get("port", 161), snmp_data.get("max_repetitions"), version_data)
+
+
+def close_session(session):
+    # easysnmp sessions are released with their last reference.
+    close = getattr(session, "close", None)
+    if close is not None:
+        close()
+
+
+class SessionPool:
+    def __init__(self, build_session, max_size=DEFAULT_MAX_SIZE, idle_timeout=None, clock=time.monotonic):
+        # build_session(address, snmp_data) makes a new session,
+        # idle_timeout None keeps idle sessions until max_size is reached.
+        # clock gives the current time in seconds.
+        self.build_session = build_session
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        # Shared by the poll threads of the sync backend.
+        self.lock = threading.Lock()
+        # Idle sessions in the order they were released, oldest first.
+        self.idle = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        # Of the evicted sessions, those that went because the pool was
+        # full rather than idle for too long.
+        self.overflowed = 0
+
+    def __len__(self):
+        return len(self.idle)
+
+    def acquire(self, address, snmp_data):
+        key = (address, credentials(snmp_data))
+        with self.lock:
+            evicted = self._evict(self.clock())
+            entry = self.idle.pop(key, None)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        for session in evicted:
+            close_session(session)
+        if entry is not None:
+            return entry[0]
+        return self.build_session(address, snmp_data)
+
+    def release(self, address, snmp_data, session):
+        key = (address, credentials(snmp_data))
+        evicted = []
+        with self.lock:
+            previous = self.idle.pop(key, None)
+            if previous is not None:
+                evicted.append(previous[0])
+            now = self.clock()
+            self.idle[key] = (session, now)
+            evicted.extend(self._evict(now))
+        for session in evicted:
+            close_session(session)
+
+    def _evict(self, now):
+        # Holding the lock, returns the evicted sessions to close.
+        evicted = []
+        while self.idle:
+            key, (session, released) = next(iter(self.idle.items()))
+            expired = self.idle_timeout is not None and now - released > self.idle_timeout
+            if not expired and len(self.idle) <= self.max_size:
+                break
+            del self.idle[key]
+            evicted.append(session)
+            if not expired:
+                if not self.overflowed:
+                    logger.warning(
+                        "session pool full at %d idle sessions, evicting the least recently used ones, "
+                        "raise --pool-size along with the open file limit to keep them",
+                        self.max_size,
+                    )
+                self.overflowed += 1
+                logger.debug("session pool full, evicted the session of %s", key[0])
+        self.evicted += len(evicted)
+        return evicted
+
+    @contextlib.contextmanager
+    def session(self, address, snmp_data):
+        session = self.acquire(address, snmp_data)
+        try:
+            yield session
+        except BaseException:
+            close_session(session)
+            raise
+        self.release(address, snmp_data, session)
+
+    def close(self):
+        with self.lock:
+            sessions = [session for session, _ in self.idle.values()]
+            self.idle.clear()
+        for session in sessions:
+            close_session(session)
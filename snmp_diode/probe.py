@@ -0,0 +1,165 @@
+import asyncio
+import ipaddress
+import socket
+from snmp_diode import ber, ratelimit
+from snmp_diode.transport import next_request_id
+
+SYSOBJECTID_OID = ".1.3.6.1.2.1.1.2.0"
+
+
+class _ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, expected):
+        self.transport = None
+        self.expected = expected
+        self.responders = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        address = addr[0]
+        request_id = self.expected.get(address)
+        if request_id is None:
+            return
+        try:
+            if ber.decode_version(data) == ber.VERSION_3:
+                response_id = ber.decode_v3_message(data).msg_id
+            else:
+                response_id = ber.decode_message(data).request_id
+        except ber.BERError:
+            return
+        if response_id == request_id:
+            self.responders.add(address)
+            del self.expected[address]
+
+    def error_received(self, exc):
+        pass
+
+
+def build_probe(snmp_data, request_id):
+    if snmp_data["version"] == 3:
+        # Engine discovery needs no credentials and every v3 agent answers it.
+        return ber.encode_v3_discovery(request_id, request_id)
+    return ber.encode_request(
+        ber.VERSION_2C,
+        snmp_data["version_data"]["community"],
+        ber.GET_REQUEST,
+        request_id,
+        [SYSOBJECTID_OID],
+    )
+
+
+async def resolve(addresses, port):
+    # {address: ip} for the addresses given as IP addresses or resolvable
+    # hostnames, the others are left out.
+    loop = asyncio.get_running_loop()
+    resolved = {}
+    hostnames = []
+    for address in addresses:
+        try:
+            resolved[address] = str(ipaddress.ip_address(address))
+        except ValueError:
+            hostnames.append(address)
+    infos = await asyncio.gather(
+        *(loop.getaddrinfo(hostname, port, type=socket.SOCK_DGRAM) for hostname in hostnames),
+        return_exceptions=True,
+    )
+    for hostname, info in zip(hostnames, infos):
+        if isinstance(info, OSError) or not info:
+            continue
+        if isinstance(info, BaseException):
+            raise info
+        resolved[hostname] = info[0][4][0]
+    return resolved
+
+
+async def paced(targets, limiter):
+    # Yields the targets as their subnet tokens come due, see
+    # ratelimit.RateLimiter.reserve_subnet, every subnet at its own pace.
+    if limiter is None:
+        for target in targets:
+            yield target
+        return
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    due = sorted((limiter.reserve_subnet(address, now), index) for index, (address, _) in enumerate(targets))
+    for when, index in due:
+        delay = when - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield targets[index]
+
+
+async def probe(addresses, snmp_data, timeout=0.5, retries=1, rate=1000):
+    # Sends one small GET for sysObjectID to every IP address, paced at
+    # `rate` packets per second over a single socket per address family,
+    # and returns the IP addresses that answered. The rate limits of
+    # snmp_data, see ratelimit, apply on top.
+    loop = asyncio.get_running_loop()
+    limiter = ratelimit.for_session(snmp_data)
+    port = snmp_data.get("port", 161)
+    expected = {}
+    endpoints = {}
+    probes = {}
+
+    async def endpoint(family):
+        if family not in endpoints:
+            _, endpoints[family] = await loop.create_datagram_endpoint(
+                lambda: _ProbeProtocol(expected), family=family
+            )
+        return endpoints[family]
+
+    targets = []
+    for address in addresses:
+        family = socket.AF_INET6 if ipaddress.ip_address(address).version == 6 else socket.AF_INET
+        targets.append((address, family))
+
+    try:
+        for _ in range(retries + 1):
+            interval = 1 / rate
+            next_send = loop.time()
+            async for address, family in paced(targets, limiter):
+                if limiter is not None:
+                    delay = limiter.reserve_global(loop.time()) - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    # The time spent waiting for tokens is not caught up on.
+                    next_send = max(next_send, loop.time())
+                if address not in probes:
+                    request_id = next_request_id()
+                    expected[address] = request_id
+                    probes[address] = build_probe(snmp_data, request_id)
+                protocol = await endpoint(family)
+                protocol.transport.sendto(probes[address], (address, port))
+                next_send += interval
+                delay = next_send - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await asyncio.sleep(timeout)
+            if not expected:
+                break
+            targets = [target for target in targets if target[0] in expected]
+    finally:
+        for protocol in endpoints.values():
+            protocol.transport.close()
+
+    responders = set()
+    for protocol in endpoints.values():
+        responders |= protocol.responders
+    return responders
+
+
+async def probe_targets(addresses, snmp_data, timeout=0.5, retries=1, rate=1000):
+    # Hostnames are resolved first and probed at their address, those that
+    # do not resolve are reported and count as unreachable.
+    resolved = await resolve(addresses, snmp_data.get("port", 161))
+    for address in addresses:
+        if address not in resolved:
+            print(f"WARNING: {address} - can not resolve the hostname, skipped by the probe")
+    responders = await probe(list(dict.fromkeys(resolved.values())), snmp_data, timeout, retries, rate)
+    return [address for address in addresses if resolved.get(address) in responders]
+
+
+def run_probe(addresses, snmp_data, timeout=0.5, retries=1, rate=1000):
+    addresses = [str(address) for address in addresses]
+    return asyncio.run(probe_targets(addresses, snmp_data, timeout, retries, rate))
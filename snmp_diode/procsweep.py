@@ -0,0 +1,245 @@
+import contextlib
+import itertools
+import multiprocessing
+import queue
+import traceback
+from collections import namedtuple
+from netboxlabs.diode.sdk.diode.v1.ingester_pb2 import Entity as EntityPb
+from snmp_diode import device, ingest, usm
+from snmp_diode.state import DEFAULT_MAX_AGE, IngestLedger, StateStore
+
+# Spreads a sweep over worker processes so pydantic validation, protobuf
+# building and netaddr parsing use every core. Worker i of N discovers every
+# N-th target starting at i, runs it through its own EntitySink and either
+# ingests the batches itself (direct) or streams them serialized back to the
+# parent, which forwards them to its sink. Per host results are streamed back
+# without the device, it never leaves the worker.
+
+RESULT = "result"
+BATCH = "batch"
+DONE = "done"
+
+# Messages buffered per worker before the workers block, batches can be up
+# to batch_bytes each.
+QUEUE_DEPTH = 16
+
+WorkerSummary = namedtuple(
+    "WorkerSummary",
+    [
+        "index",
+        "addresses",
+        "batches",
+        "entities",
+        "failed_batches",
+        "unchanged",
+        "cache_hits",
+        "cache_misses",
+        "error",
+    ],
+)
+
+
+class _Response:
+    errors = ()
+
+
+class QueueClient:
+    # Stands in for DiodeClient in the workers when batches go through the
+    # parent process.
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def ingest(self, entities):
+        self.messages.put((BATCH, [entity.SerializeToString() for entity in entities]))
+        return _Response()
+
+
+def build_client(diode):
+    from netboxlabs.diode.sdk import DiodeClient
+
+    return DiodeClient(**diode)
+
+
+def discover_shard(targets, index, count, snmp_data, role, site, backend, workers, store):
+    addresses = (str(address) for address in itertools.islice(targets, index, None, count))
+    if backend == "async":
+        from snmp_diode import aiodiscover
+
+        return aiodiscover.run_sweep(addresses, snmp_data, role, site, workers, store)
+    from snmp_diode import sweep
+
+    return sweep.sweep(addresses, snmp_data, role, site, workers, store)
+
+
+def run_worker(
+    messages,
+    targets,
+    index,
+    count,
+    snmp_data,
+    role,
+    site,
+    backend,
+    workers,
+    batch_size,
+    batch_bytes,
+    diode,
+    state,
+    change_detection,
+    max_cache_age,
+    ledger_run,
+):
+    addresses = 0
+    sink = None
+    error = None
+    try:
+        client = QueueClient(messages) if diode is None else build_client(diode)
+        store = None if state is None else StateStore(state, max_cache_age)
+        if store is not None:
+            usm.engines.attach(store)
+        ledger = None
+        if ledger_run is not None:
+            # Batches going through the parent are committed there.
+            ledger = IngestLedger(store, *ledger_run, readonly=diode is None)
+        with store or contextlib.nullcontext(), ingest.EntitySink(client, batch_size, batch_bytes, ledger) as sink:
+            for result in discover_shard(
+                targets, index, count, snmp_data, role, site, backend, workers, store if change_detection else None
+            ):
+                addresses += 1
+                if result.device is not None:
+                    if store is not None:
+                        result.stats["changed"] = store.record(
+                            result.address, result.device, result.stats.get("markers"), result.stats.get("walked")
+                        )
+                    sink.add(result.device.model_dump())
+                messages.put((RESULT, result._replace(device=None)))
+    except Exception as e:
+        error = f"{str(e)}\n{traceback.format_exc()}"
+    cache_info = device.get_device_model.cache_info()
+    messages.put(
+        (
+            DONE,
+            WorkerSummary(
+                index,
+                addresses,
+                sink.batches if sink and diode else 0,
+                sink.entities if sink and diode else 0,
+                sink.failed_batches if sink and diode else 0,
+                sink.unchanged if sink else 0,
+                cache_info.hits,
+                cache_info.misses,
+                error,
+            ),
+        )
+    )
+
+
+class ProcessSweep:
+    def __init__(
+        self,
+        targets,
+        snmp_data,
+        role=None,
+        site=None,
+        processes=2,
+        backend="sync",
+        workers=1,
+        batch_size=ingest.DEFAULT_BATCH_SIZE,
+        batch_bytes=ingest.DEFAULT_BATCH_BYTES,
+        diode=None,
+        state=None,
+        change_detection=False,
+        max_cache_age=DEFAULT_MAX_AGE,
+        ledger_run=None,
+    ):
+        # diode holds the DiodeClient keyword arguments when every worker
+        # should ingest on its own, None to send the batches through the
+        # parent. state is the path of a StateStore every worker records
+        # its devices in, and with change_detection reuses unchanged
+        # interfaces from. ledger_run is the (run, full) of a delta
+        # ingestion run started on that store. targets must be picklable, a list, a
+        # netaddr.IPNetwork or one of the shard iterables.
+        self.targets = targets
+        self.snmp_data = snmp_data
+        self.role = role
+        self.site = site
+        self.processes = processes
+        self.backend = backend
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.diode = diode
+        self.state = state
+        self.change_detection = change_detection
+        self.max_cache_age = max_cache_age
+        self.ledger_run = ledger_run
+        self.summaries = []
+
+    @property
+    def cache_hits(self):
+        return sum(summary.cache_hits for summary in self.summaries)
+
+    @property
+    def cache_misses(self):
+        return sum(summary.cache_misses for summary in self.summaries)
+
+    def results(self, sink):
+        # Yields DiscoveryResult tuples without the device as hosts finish.
+        # Batches from the workers are handed to sink, and the batches the
+        # workers ingested themselves are accounted on it.
+        # Spawned rather than forked, the gRPC runtime does not survive a
+        # fork and the parent may already hold a DiodeClient.
+        context = multiprocessing.get_context("spawn")
+        messages = context.Queue(maxsize=self.processes * QUEUE_DEPTH)
+        workers = {}
+        for index in range(self.processes):
+            worker = context.Process(
+                target=run_worker,
+                args=(
+                    messages,
+                    self.targets,
+                    index,
+                    self.processes,
+                    self.snmp_data,
+                    self.role,
+                    self.site,
+                    self.backend,
+                    self.workers,
+                    self.batch_size,
+                    self.batch_bytes,
+                    self.diode,
+                    self.state,
+                    self.change_detection,
+                    self.max_cache_age,
+                    self.ledger_run,
+                ),
+                name=f"snmp-diode-worker-{index}",
+                daemon=True,
+            )
+            worker.start()
+            workers[index] = worker
+
+        try:
+            while workers:
+                try:
+                    kind, payload = messages.get(timeout=1)
+                except queue.Empty:
+                    for index, worker in list(workers.items()):
+                        if not worker.is_alive():
+                            del workers[index]
+                            self.summaries.append(
+                                WorkerSummary(index, 0, 0, 0, 0, 0, 0, 0, f"worker exited with code {worker.exitcode}")
+                            )
+                    continue
+                if kind == RESULT:
+                    yield payload
+                elif kind == BATCH:
+                    sink.send([EntityPb.FromString(entity) for entity in payload])
+                elif kind == DONE:
+                    self.summaries.append(payload)
+                    sink.merge_counters(payload.batches, payload.entities, payload.failed_batches, payload.unchanged)
+                    workers.pop(payload.index).join()
+        finally:
+            for worker in workers.values():
+                worker.terminate()
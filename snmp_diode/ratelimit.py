@@ -0,0 +1,152 @@
+import collections
+import functools
+import threading
+import time
+from snmp_diode import rtt
+
+# Request pacing, --rate, --subnet-rate and --host-inflight. Some agents and
+# the firewalls in front of them drop everything, or raise an alarm, once
+# hit with more than a few dozen packets per second. Every request packet
+# takes a token from a global bucket and from the bucket of its destination
+# subnet, /24 or /64 as for rtt, and waits for them when they are empty. On
+# top of that at most host_inflight requests are outstanding per host, the
+# others queue until one is answered or times out.
+
+# Seconds worth of tokens a bucket saves up. Kept short so the rate also
+# holds over any single second, not only on average.
+BURST = 0.1
+
+
+class TokenBucket:
+    # rate tokens per second. The bucket is kept as the time its tokens run
+    # out at the current pace (generic cell rate algorithm), so a packet
+    # reserves the time it may be sent at instead of polling for a token.
+
+    __slots__ = ("interval", "tolerance", "due")
+
+    def __init__(self, rate, burst=BURST):
+        self.interval = 1 / rate
+        self.tolerance = (max(burst * rate, 1) - 1) * self.interval
+        self.due = 0.0
+
+    def available(self, now):
+        when = self.due - self.tolerance
+        # Rounding errors accumulated over the intervals are no wait.
+        return now if when <= now + 1e-9 else when
+
+    def take(self, when):
+        self.due = max(self.due, when) + self.interval
+
+
+class RateLimiter:
+    def __init__(self, rate=None, subnet_rate=None, host_inflight=None):
+        # rate and subnet_rate in packets per second, None lifts a limit.
+        # Shared by the discovery threads of the sync backend.
+        self.lock = threading.Lock()
+        self.freed = threading.Condition(self.lock)
+        self.bucket = None if rate is None else TokenBucket(rate)
+        self.subnet_rate = subnet_rate
+        self.subnets = {}
+        # The subnet bucket of every host, None for hostnames.
+        self.hosts = {}
+        self.host_inflight = host_inflight
+        self.inflight = collections.Counter()
+        # Waits for a token, a packet can wait for both of its tokens.
+        self.delayed = 0
+
+    def _subnet_bucket(self, address):
+        # Holding the lock.
+        if self.subnet_rate is None:
+            return None
+        try:
+            return self.hosts[address]
+        except KeyError:
+            pass
+        bucket = None
+        key = rtt.subnet_of(address)
+        if key is not None:
+            bucket = self.subnets.get(key)
+            if bucket is None:
+                bucket = self.subnets[key] = TokenBucket(self.subnet_rate)
+        self.hosts[address] = bucket
+        return bucket
+
+    def reserve_subnet(self, address, now):
+        # The time, now or later, the next packet to address gets its
+        # subnet token at. The token is taken, the packet then waits for
+        # its global token, see reserve_global. Taken one after the other,
+        # the packets held back by a busy subnet do not take the global
+        # tokens the packets to the other subnets could use meanwhile.
+        with self.lock:
+            return self._reserve(self._subnet_bucket(address), now)
+
+    def reserve_global(self, now):
+        # The time, now or later, the next packet gets its global token at.
+        with self.lock:
+            return self._reserve(self.bucket, now)
+
+    def _reserve(self, bucket, now):
+        # Holding the lock.
+        if bucket is None:
+            return now
+        when = bucket.available(now)
+        bucket.take(when)
+        if when > now:
+            self.delayed += 1
+        return when
+
+    def wait(self, address):
+        # Blocks until the next packet to address may be sent.
+        for reserve in (functools.partial(self.reserve_subnet, address), self.reserve_global):
+            now = time.monotonic()
+            when = reserve(now)
+            if when > now:
+                time.sleep(when - now)
+
+    def try_acquire(self, address):
+        # Takes a request slot of address if one is free, for callers that
+        # can not block.
+        if self.host_inflight is None:
+            return True
+        with self.lock:
+            if self.inflight[address] >= self.host_inflight:
+                return False
+            self.inflight[address] += 1
+            return True
+
+    def acquire(self, address):
+        # Blocks until a request slot of address is free and takes it.
+        if self.host_inflight is None:
+            return
+        with self.freed:
+            while self.inflight[address] >= self.host_inflight:
+                self.freed.wait()
+            self.inflight[address] += 1
+
+    def release(self, address):
+        if self.host_inflight is None:
+            return
+        with self.freed:
+            self.inflight[address] -= 1
+            if not self.inflight[address]:
+                del self.inflight[address]
+            self.freed.notify_all()
+
+
+# One per set of limits, living as long as the process so the sessions of
+# a sweep, or of every daemon cycle, share their buckets.
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def for_session(snmp_data):
+    # The limiter sessions built from snmp_data use, None without limits.
+    limits = snmp_data.get("rate_limit") or {}
+    key = (limits.get("rate"), limits.get("subnet_rate"), limits.get("host_inflight"))
+    if key == (None, None, None):
+        return None
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(*key)
+    return limiter
@@ -0,0 +1,187 @@
+import array
+import mmap
+import os
+import struct
+import sys
+import threading
+
+# Compact, memory mapped form of the sysObjectID registry, laid out as an
+# OID prefix trie:
+#
+#   header  magic, format version, node count, string bytes
+#   nodes   arc, first child, child count, label kind, name offset, name length
+#   strings UTF-8 names
+#   digest  optional, DIGEST_MAGIC and the SHA-256 of the build inputs
+#
+# Node 0 is the root of the OID tree. The children of every node are stored
+# next to each other sorted by arc, so resolving an OID is a single walk
+# from the root doing a binary search per arc, remembering the deepest
+# manufacturer and product labels passed on the way (longest prefix match).
+# Vendors can therefore register products at any depth below their
+# enterprise number.
+
+MAGIC = b"SDRG"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sHHII")
+NODE_FIELDS = 6
+NODE = struct.Struct("<" + "I" * NODE_FIELDS)
+DIGEST_MAGIC = b"SDRD"
+
+NO_LABEL = 0
+MANUFACTURER = 1
+PRODUCT = 2
+
+ENTERPRISES = (1, 3, 6, 1, 4, 1)
+
+# Where the products of the legacy tables in snmp_diode.sysobjectid live,
+# relative to the enterprise. Products keyed by a plain number are placed
+# below this subtree, products keyed by a tuple of arcs are taken as is.
+PRODUCT_SUBTREES = {
+    9: (1,),  # CISCO-SMI ciscoProducts
+}
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "sysobjectid.bin")
+
+
+class RegistryError(Exception):
+    pass
+
+
+class Registry:
+    def __init__(self, path=DEFAULT_PATH):
+        with open(path, "rb") as registry_file:
+            self._data = mmap.mmap(registry_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.node_count, string_bytes = HEADER.unpack_from(self._data, 0)
+        if magic != MAGIC:
+            raise RegistryError(f"{path} is not a sysObjectID registry")
+        if version != FORMAT_VERSION:
+            raise RegistryError(f"{path} has unsupported format version {version}")
+        nodes_end = HEADER.size + self.node_count * NODE.size
+        if sys.byteorder == "little":
+            self._nodes = memoryview(self._data)[HEADER.size:nodes_end].cast("I")
+        else:
+            self._nodes = array.array("I", self._data[HEADER.size:nodes_end])
+            self._nodes.byteswap()
+        self._strings = nodes_end
+        trailer = self._data[nodes_end + string_bytes:]
+        self.digest = None
+        if trailer[:len(DIGEST_MAGIC)] == DIGEST_MAGIC:
+            self.digest = trailer[len(DIGEST_MAGIC):].hex()
+
+    def close(self):
+        if isinstance(self._nodes, memoryview):
+            self._nodes.release()
+        self._data.close()
+
+    def _label(self, node):
+        base = node * NODE_FIELDS
+        start = self._strings + self._nodes[base + 4]
+        return self._data[start:start + self._nodes[base + 5]].decode("utf-8")
+
+    def resolve(self, oid):
+        # Returns (manufacturer, device_type) for a dotted OID string, either
+        # of them None when no registered prefix matches.
+        nodes = self._nodes
+        node = 0
+        manufacturer = product = None
+        for arc in oid.strip(".").split("."):
+            try:
+                arc = int(arc)
+            except ValueError:
+                break
+            low = nodes[node * NODE_FIELDS + 1]
+            end = high = low + nodes[node * NODE_FIELDS + 2]
+            while low < high:
+                middle = (low + high) // 2
+                if nodes[middle * NODE_FIELDS] < arc:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low == end or nodes[low * NODE_FIELDS] != arc:
+                break
+            node = low
+            kind = nodes[node * NODE_FIELDS + 3]
+            if kind == MANUFACTURER:
+                manufacturer = node
+            elif kind == PRODUCT:
+                product = node
+        return (
+            None if manufacturer is None else self._label(manufacturer),
+            None if product is None else self._label(product),
+        )
+
+
+def registry_entries(manufacturers):
+    # Flattens the snmp_diode.sysobjectid layout,
+    # {enterprise: {"name": str, "products": {product: str}}}, into
+    # (oid arcs, kind, name) entries.
+    for enterprise, entry in manufacturers.items():
+        prefix = ENTERPRISES + (enterprise,)
+        yield prefix, MANUFACTURER, entry["name"]
+        subtree = PRODUCT_SUBTREES.get(enterprise, ())
+        for product, name in entry["products"].items():
+            if isinstance(product, tuple):
+                yield prefix + product, PRODUCT, name
+            else:
+                yield prefix + subtree + (product,), PRODUCT, name
+
+
+def write_registry(entries, path=DEFAULT_PATH, digest=None):
+    root = {"children": {}, "kind": NO_LABEL, "name": ""}
+    for arcs, kind, name in entries:
+        node = root
+        for arc in arcs:
+            node = node["children"].setdefault(arc, {"children": {}, "kind": NO_LABEL, "name": ""})
+        node["kind"] = kind
+        node["name"] = name
+
+    # Breadth first, so the children of every node end up contiguous.
+    order = [root]
+    position = 0
+    while position < len(order):
+        node = order[position]
+        node["first_child"] = len(order)
+        for arc in sorted(node["children"]):
+            child = node["children"][arc]
+            child["arc"] = arc
+            order.append(child)
+        position += 1
+
+    strings = bytearray()
+    nodes = bytearray()
+    for node in order:
+        raw = node["name"].encode("utf-8")
+        nodes.extend(
+            NODE.pack(
+                node.get("arc", 0),
+                node["first_child"],
+                len(node["children"]),
+                node["kind"],
+                len(strings),
+                len(raw),
+            )
+        )
+        strings.extend(raw)
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(order), len(strings))
+    trailer = b""
+    if digest is not None:
+        trailer = DIGEST_MAGIC + bytes.fromhex(digest)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as registry_file:
+        registry_file.write(header + nodes + strings + trailer)
+    os.replace(tmp_path, path)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    # Opened on first use so importing discover stays cheap.
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = Registry()
+    return _registry
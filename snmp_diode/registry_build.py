@@ -0,0 +1,281 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import runpy
+from snmp_diode.registry import (
+    DEFAULT_PATH,
+    ENTERPRISES,
+    MANUFACTURER,
+    PRODUCT,
+    Registry,
+    RegistryError,
+    registry_entries,
+    write_registry,
+)
+
+# Builds snmp_diode/sysobjectid.bin from local sources:
+#
+#   --legacy    Python module with a `manufacturers` dict, the layout of
+#               snmp_diode/sysobjectid.py
+#   --pen       IANA Private Enterprise Numbers text file (enterprise-numbers)
+#   --products  vendor product MIBs (CISCO-PRODUCTS-MIB, ...), every leaf
+#               OBJECT IDENTIFIER or OBJECT-IDENTITY they define is a product
+#   --mib       MIBs only needed to resolve names (CISCO-SMI, ...)
+#
+# Later sources override earlier ones for the same OID. Every input is
+# parsed once and cached by content hash, so a rebuild after a single vendor
+# MIB changed only parses that file. The digest of all inputs is stored in
+# the artifact, which lets `check` tell whether it is current by hashing the
+# inputs without parsing or importing any of them.
+
+BUILD_VERSION = 1
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "snmp-diode", "registry")
+
+MIB_ROOTS = {
+    "ccitt": (0,),
+    "iso": (1,),
+    "joint-iso-ccitt": (2,),
+    "org": (1, 3),
+    "dod": (1, 3, 6),
+    "internet": (1, 3, 6, 1),
+    "directory": (1, 3, 6, 1, 1),
+    "mgmt": (1, 3, 6, 1, 2),
+    "mib-2": (1, 3, 6, 1, 2, 1),
+    "experimental": (1, 3, 6, 1, 3),
+    "private": (1, 3, 6, 1, 4),
+    "enterprises": ENTERPRISES,
+    "security": (1, 3, 6, 1, 5),
+    "snmpV2": (1, 3, 6, 1, 6),
+    "snmpModules": (1, 3, 6, 1, 6, 3),
+    "zeroDotZero": (0, 0),
+}
+
+MIB_NOISE = re.compile(r'"[^"]*"|--.*?(?:--|$)', re.M)
+OID_ASSIGNMENT = re.compile(r"\b([a-z][\w-]*)\s+OBJECT\s+IDENTIFIER\s*::=\s*\{([^}]*)\}")
+MACRO_ASSIGNMENT = re.compile(
+    r"\b([a-z][\w-]*)\s+(MODULE-IDENTITY|OBJECT-IDENTITY|OBJECT-TYPE|NOTIFICATION-TYPE|"
+    r"OBJECT-GROUP|NOTIFICATION-GROUP|MODULE-COMPLIANCE|AGENT-CAPABILITIES)\b"
+    r"(?:(?!::=).)*::=\s*\{([^}]*)\}",
+    re.S,
+)
+OID_COMPONENT = re.compile(r"^(?:[a-zA-Z][\w-]*\()?(\d+)\)?$")
+PEN_NUMBER = re.compile(r"^(\d+)\s*$")
+
+
+class RegistryBuildError(Exception):
+    pass
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def inputs_digest(inputs):
+    digest = hashlib.sha256(f"snmp-diode registry build {BUILD_VERSION}\n".encode())
+    for role, path in inputs:
+        digest.update(f"{role}:{file_digest(path)}\n".encode())
+    return digest.hexdigest()
+
+
+def parse_legacy(path):
+    manufacturers = runpy.run_path(path)["manufacturers"]
+    return [[list(arcs), kind, name] for arcs, kind, name in registry_entries(manufacturers)]
+
+
+def parse_pen(path):
+    enterprises = {}
+    number = None
+    with open(path, encoding="utf-8", errors="replace") as pen:
+        for line in pen:
+            line = line.rstrip("\n")
+            match = PEN_NUMBER.match(line)
+            if match:
+                number = match.group(1)
+            elif number is not None and line.startswith("  ") and not line.startswith("   "):
+                enterprises[number] = line.strip()
+                number = None
+    return enterprises
+
+
+def parse_oid_value(value, name):
+    tokens = value.split()
+    if not tokens:
+        raise RegistryBuildError(f"Empty OID value for {name}")
+    arcs = []
+    for token in tokens[1:]:
+        match = OID_COMPONENT.match(token)
+        if not match:
+            raise RegistryBuildError(f"Unsupported OID component {token} in {name}")
+        arcs.append(int(match.group(1)))
+    parent = tokens[0]
+    match = OID_COMPONENT.match(parent)
+    if match and parent[0].isdigit():
+        return None, [int(match.group(1))] + arcs
+    return parent.split("(")[0], arcs
+
+
+def parse_mib(path):
+    with open(path, encoding="utf-8", errors="replace") as mib:
+        text = MIB_NOISE.sub(lambda match: '""' if match.group(0).startswith('"') else " ", mib.read())
+    definitions = {}
+    for name, value in OID_ASSIGNMENT.findall(text):
+        definitions[name] = ["oid"] + list(parse_oid_value(value, name))
+    for name, macro, value in MACRO_ASSIGNMENT.findall(text):
+        kind = "identity" if macro == "OBJECT-IDENTITY" else "other"
+        definitions[name] = [kind] + list(parse_oid_value(value, name))
+    return definitions
+
+
+def resolve_mib_names(definitions):
+    resolved = {name: arcs for name, arcs in MIB_ROOTS.items()}
+
+    def resolve(name, seen=()):
+        if name in resolved:
+            return resolved[name]
+        if name not in definitions or name in seen:
+            return None
+        _, parent, arcs = definitions[name]
+        if parent is None:
+            resolved[name] = tuple(arcs)
+        else:
+            base = resolve(parent, seen + (name,))
+            if base is None:
+                return None
+            resolved[name] = base + tuple(arcs)
+        return resolved[name]
+
+    for name in definitions:
+        resolve(name)
+    return resolved
+
+
+def product_entries(product_definitions, resolved):
+    entries = []
+    for definitions in product_definitions:
+        oids = {}
+        for name, (kind, _, _) in definitions.items():
+            oid = resolved.get(name)
+            if kind in ("oid", "identity") and oid is not None:
+                oids[oid] = name
+        parents = {oid[:depth] for oid in oids for depth in range(1, len(oid))}
+        for oid, name in oids.items():
+            if oid not in parents and oid[:len(ENTERPRISES)] == ENTERPRISES and len(oid) > len(ENTERPRISES) + 1:
+                entries.append((oid, PRODUCT, name))
+    return entries
+
+
+class ParseCache:
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, role, path, parser):
+        digest = file_digest(path)
+        cache_path = os.path.join(self.directory, f"{role}-{BUILD_VERSION}-{digest}.json")
+        if os.path.exists(cache_path):
+            with open(cache_path) as cache_file:
+                self.hits += 1
+                return json.load(cache_file)
+        parsed = parser(path)
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w") as cache_file:
+            json.dump(parsed, cache_file)
+        os.replace(tmp_path, cache_path)
+        return parsed
+
+
+def build_inputs(args):
+    inputs = []
+    if args.legacy:
+        inputs.append(("legacy", args.legacy))
+    if args.pen:
+        inputs.append(("pen", args.pen))
+    inputs += [("mib", path) for path in args.mib]
+    inputs += [("products", path) for path in args.products]
+    if not inputs:
+        raise RegistryBuildError("Please provide at least one of --legacy, --pen or --products")
+    return inputs
+
+
+def build(args):
+    inputs = build_inputs(args)
+    cache = ParseCache(args.cache)
+    entries = []
+    definitions = {}
+    product_definitions = []
+    for role, path in inputs:
+        if role == "legacy":
+            entries += [(tuple(arcs), kind, name) for arcs, kind, name in cache.load(role, path, parse_legacy)]
+        elif role == "pen":
+            entries += [
+                (ENTERPRISES + (int(number),), MANUFACTURER, name)
+                for number, name in cache.load(role, path, parse_pen).items()
+            ]
+        else:
+            parsed = cache.load("mib", path, parse_mib)
+            definitions.update(parsed)
+            if role == "products":
+                product_definitions.append(parsed)
+    if product_definitions:
+        resolved = resolve_mib_names(definitions)
+        products = product_entries(product_definitions, resolved)
+        unresolved = sum(1 for parsed in product_definitions for name in parsed if name not in resolved)
+        if unresolved:
+            print(f"WARNING: {unresolved} MIB definitions could not be resolved, pass their parent MIBs with --mib")
+        entries += products
+    write_registry(entries, args.output, inputs_digest(inputs))
+    print(
+        f"INFO: registry written to {args.output}, {cache.misses} inputs parsed, "
+        f"{cache.hits} loaded from cache"
+    )
+
+
+def check(args):
+    inputs = build_inputs(args)
+    try:
+        registry = Registry(args.output)
+    except (OSError, RegistryError) as e:
+        print(f"ERROR: {args.output} can not be read: {e}")
+        return 1
+    digest = registry.digest
+    registry.close()
+    if digest != inputs_digest(inputs):
+        print(f"ERROR: {args.output} is out of date, rebuild it")
+        return 1
+    print(f"INFO: {args.output} is up to date")
+    return 0
+
+
+parser = argparse.ArgumentParser(description="Build the snmp-diode sysObjectID registry")
+parser.add_argument("command", choices=["build", "check"])
+parser.add_argument("--legacy", type=str, help="Python module defining a manufacturers dict")
+parser.add_argument("--pen", type=str, help="IANA enterprise-numbers file")
+parser.add_argument("--products", type=str, nargs="*", default=[], help="Vendor product MIB files")
+parser.add_argument("--mib", type=str, nargs="*", default=[], help="MIB files needed to resolve names")
+parser.add_argument("-o", "--output", type=str, default=DEFAULT_PATH, help="Registry file")
+parser.add_argument("--cache", type=str, default=DEFAULT_CACHE, help="Parse cache directory")
+
+
+def main():
+    args = parser.parse_args()
+    try:
+        if args.command == "build":
+            build(args)
+        else:
+            exit(check(args))
+    except RegistryBuildError as e:
+        print(f"ERROR: {e}")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import threading
+import netaddr
+
+# Adaptive request timeouts, --timeout-mode adaptive. The round trip time
+# of every answered request feeds a smoothed estimate per host and per
+# subnet, and the timeout is derived from it the way TCP derives its
+# retransmission timeout (RFC 6298): SRTT + 4 * RTTVAR, doubled on every
+# retransmission. Answers to retransmitted requests are not sampled, they
+# can not be told apart from answers to the first copy (Karn's algorithm).
+# A host without samples of its own starts from the estimate of its
+# subnet, so in a subnet answering within milliseconds a dead host is given
+# up quickly, while a slow link backs off until it gets through.
+
+# Seconds.
+INITIAL_RTO = 1.0
+MIN_RTO = 0.1
+MAX_RTO = 10.0
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+# Hosts sharing a subnet estimate.
+SUBNET_PREFIX = {4: 24, 6: 64}
+
+# Retries of a host that never answered, the retries given to the session
+# apply once it did.
+UNANSWERED_RETRIES = 1
+
+TIMEOUT_MODES = ("fixed", "adaptive")
+
+
+class Estimate:
+    __slots__ = ("srtt", "rttvar", "rto", "samples")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        # None until sampled or backed off.
+        self.rto = None
+        self.samples = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self.rto = min(max(self.srtt + K * self.rttvar, MIN_RTO), MAX_RTO)
+        self.samples += 1
+
+    def backoff(self, timeout):
+        # timeout is the one that just expired, the doubled one is kept
+        # until the next valid sample.
+        self.rto = min(timeout * 2, MAX_RTO)
+
+
+def subnet_of(address):
+    try:
+        ip = netaddr.IPAddress(address)
+    except (netaddr.AddrFormatError, ValueError):
+        return None
+    return str(netaddr.IPNetwork(f"{ip}/{SUBNET_PREFIX[ip.version]}").cidr)
+
+
+class RTTEstimator:
+    def __init__(self):
+        # Shared by the discovery threads of the sync backend.
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.subnets = {}
+
+    def _estimates(self, address):
+        # Holding the lock, the estimates of the host and of its subnet.
+        estimates = self.hosts.get(address)
+        if estimates is None:
+            key = subnet_of(address)
+            subnet = None
+            if key is not None:
+                subnet = self.subnets.get(key)
+                if subnet is None:
+                    subnet = self.subnets[key] = Estimate()
+            estimates = self.hosts[address] = (Estimate(), subnet)
+        return estimates
+
+    def timeout(self, address, retries):
+        # The (timeout, retries) of the next request to address.
+        with self.lock:
+            host, subnet = self._estimates(address)
+            if host.rto is not None:
+                rto = host.rto
+            elif subnet is not None and subnet.samples:
+                rto = subnet.rto
+            else:
+                rto = INITIAL_RTO
+            return rto, retries if host.samples else min(retries, UNANSWERED_RETRIES)
+
+    def sample(self, address, rtt):
+        with self.lock:
+            for estimate in self._estimates(address):
+                if estimate is not None:
+                    estimate.sample(rtt)
+
+    def backoff(self, address, timeout):
+        with self.lock:
+            self._estimates(address)[0].backoff(timeout)
+
+
+# Lives as long as the process, the daemon keeps learning across cycles.
+estimator = RTTEstimator()
+
+
+def for_session(snmp_data):
+    # The estimator sessions built from snmp_data use, None for fixed
+    # timeouts.
+    if snmp_data.get("timeout_mode") == "adaptive":
+        return estimator
+    return None
@@ -0,0 +1,155 @@
+import heapq
+import itertools
+import json
+import random
+from collections import namedtuple
+import netaddr
+
+# Poll scheduling for the daemon. Targets wait on a timeline heap keyed by
+# their next due time. Once due they move to a ready heap ordered by
+# priority, then by deadline, and are handed out as poll slots free up. A
+# target still waiting when its deadline passes is shed, skipped until its
+# next interval, so an overloaded collector keeps the high priority targets
+# on schedule and defers the rest instead of falling further and further
+# behind on everything.
+#
+# Targets are assigned to groups from a schedule file:
+#
+#   {
+#     "groups": {
+#       "core": {"interval": 60, "priority": 10, "deadline": 30,
+#                "targets": ["10.0.0.0/24", "core-1.example.net"]},
+#       "access": {"interval": 900, "targets": ["10.1.0.0/16"]}
+#     }
+#   }
+#
+# A target belongs to the group with the most specific matching network,
+# or the one listing its hostname, targets matching no group to the
+# default group. A group of a single address sets a per-target interval.
+
+DEFAULT_GROUP = "default"
+
+# interval and deadline in seconds, deadline is how long after being due a
+# poll may still start. Higher priorities are polled first.
+PollGroup = namedtuple("PollGroup", ["name", "interval", "priority", "deadline"])
+
+
+class ScheduleError(Exception):
+    pass
+
+
+class PollTarget:
+    __slots__ = ("address", "group", "due", "sequence", "shed")
+
+    def __init__(self, address, group, due, sequence):
+        self.address = address
+        self.group = group
+        self.due = due
+        self.sequence = sequence
+        self.shed = 0
+
+
+class Schedule:
+    def __init__(self, default_group, groups=()):
+        self.default_group = default_group
+        self.groups = {default_group.name: default_group}
+        self.networks = []
+        self.hostnames = {}
+        for group, targets in groups:
+            self.groups[group.name] = group
+            for target in targets:
+                try:
+                    network = netaddr.IPNetwork(target)
+                except (netaddr.AddrFormatError, ValueError):
+                    self.hostnames[target] = group
+                    continue
+                self.networks.append((network, group))
+        # Most specific networks first.
+        self.networks.sort(key=lambda entry: entry[0].prefixlen, reverse=True)
+
+    def group_for(self, address):
+        group = self.hostnames.get(address)
+        if group is not None:
+            return group
+        try:
+            ip = netaddr.IPAddress(address)
+        except (netaddr.AddrFormatError, ValueError):
+            return self.default_group
+        for network, group in self.networks:
+            if network.version == ip.version and ip in network:
+                return group
+        return self.default_group
+
+
+def load_schedule(path, default_group):
+    try:
+        with open(path) as schedule_file:
+            config = json.load(schedule_file)
+    except (OSError, ValueError) as e:
+        raise ScheduleError(f"can not read schedule {path}: {e}")
+    groups = []
+    for name, entry in config.get("groups", {}).items():
+        interval = entry.get("interval", default_group.interval)
+        group = PollGroup(
+            name,
+            interval,
+            entry.get("priority", default_group.priority),
+            entry.get("deadline", interval),
+        )
+        if group.interval <= 0 or group.deadline <= 0:
+            raise ScheduleError(f"group {name} needs an interval and a deadline greater than 0")
+        groups.append((group, entry.get("targets", [])))
+    return Schedule(default_group, groups)
+
+
+class Scheduler:
+    def __init__(self, jitter=0.0):
+        self.jitter = jitter
+        self.sequence = itertools.count()
+        self.timeline = []
+        self.ready = []
+        self.shed = 0
+
+    def __len__(self):
+        return len(self.timeline) + len(self.ready)
+
+    def add(self, address, group, due):
+        target = PollTarget(address, group, due, next(self.sequence))
+        heapq.heappush(self.timeline, (due, target.sequence, target))
+
+    def next_due(self):
+        # When the next target becomes due, None if all of them are ready
+        # or being polled.
+        return self.timeline[0][0] if self.timeline else None
+
+    def take(self, now, slots):
+        # Up to slots targets to poll now, highest priority first. Returns
+        # them with the targets shed on the way.
+        while self.timeline and self.timeline[0][0] <= now:
+            _, _, target = heapq.heappop(self.timeline)
+            deadline = target.due + target.group.deadline
+            heapq.heappush(self.ready, (-target.group.priority, deadline, target.sequence, target))
+        polls = []
+        shed = []
+        while self.ready and len(polls) < slots:
+            _, deadline, _, target = heapq.heappop(self.ready)
+            if deadline < now:
+                target.shed += 1
+                self.shed += 1
+                shed.append(target)
+                self.reschedule(target, now)
+                continue
+            polls.append(target)
+        return polls, shed
+
+    def reschedule(self, target, now):
+        # The next due time follows the previous one, not the end of the
+        # poll, so a target does not drift. Intervals missed entirely are
+        # skipped.
+        interval = target.group.interval
+        due = target.due + interval * (1 + random.uniform(-self.jitter, self.jitter))
+        if due < now:
+            due += (now - due) // interval * interval + interval
+        target.due = due
+        target.sequence = next(self.sequence)
+        heapq.heappush(self.timeline, (due, target.sequence, target))
@@ -0,0 +1,86 @@
+import json
+import os
+import zlib
+import netaddr
+
+# Splits a sweep across several collectors. Every address belongs to the
+# shard int(address) % count, hostnames to the shard of their CRC32, so the
+# split only depends on the address itself: collectors given the same
+# targets agree on it whatever order they list them in, every address ends
+# up in exactly one shard and consecutive addresses are spread evenly.
+
+
+class ShardError(Exception):
+    pass
+
+
+def parse_shard(spec):
+    # "3/8" is the third of eight shards, returned zero based as (2, 8).
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ShardError(f"Invalid shard {spec}, expected INDEX/COUNT such as 3/8")
+    if count < 1 or not 1 <= index <= count:
+        raise ShardError(f"Invalid shard {spec}, INDEX must be between 1 and COUNT")
+    return index - 1, count
+
+
+def load_targets(path):
+    # A coordinator provided target list, one address, CIDR network or
+    # hostname per line, "#" starts a comment. Overlapping networks and
+    # repeated entries are merged so every address is listed once.
+    addresses = netaddr.IPSet()
+    hostnames = {}
+    with open(path) as targets_file:
+        for line in targets_file:
+            entry = line.split("#", 1)[0].strip()
+            if not entry:
+                continue
+            try:
+                addresses.add(netaddr.IPNetwork(entry))
+            except (netaddr.AddrFormatError, ValueError):
+                hostnames[entry] = None
+    return Targets(addresses, list(hostnames))
+
+
+class Targets:
+    # Picklable iterable over an IPSet and a list of hostnames, so a target
+    # list can be handed to the worker processes of a process sweep.
+
+    def __init__(self, addresses, hostnames=()):
+        self.addresses = addresses
+        self.hostnames = list(hostnames)
+
+    def __iter__(self):
+        yield from self.addresses
+        yield from self.hostnames
+
+
+def shard_of(address, count):
+    if isinstance(address, netaddr.IPAddress):
+        return int(address) % count
+    try:
+        return int(netaddr.IPAddress(address)) % count
+    except (netaddr.AddrFormatError, ValueError):
+        return zlib.crc32(str(address).encode()) % count
+
+
+class ShardedTargets:
+    def __init__(self, targets, index, count):
+        self.targets = targets
+        self.index = index
+        self.count = count
+
+    def __iter__(self):
+        for address in self.targets:
+            if shard_of(address, self.count) == self.index:
+                yield address
+
+
+def write_report(path, report):
+    # Written once the shard is done, atomically, so a coordinator polling
+    # for it never reads a partial file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,306 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from snmp_diode import models
+
+# Local record of what the previous runs discovered, one row per host with
+# the last Device, a hash of its content and when it was collected. Kept in
+# SQLite in WAL mode so the worker processes of a process sweep can write
+# to the same file, and indexed by device name as well as by address. The
+# SNMPv3 engines of the hosts are kept as well, see usm.EngineCache.
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE devices (
+    address TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    collected REAL NOT NULL,
+    device TEXT NOT NULL,
+    walked REAL,
+    uptime INTEGER,
+    if_table_last_change INTEGER,
+    if_stack_last_change INTEGER
+);
+CREATE INDEX devices_name ON devices (name);
+CREATE TABLE ingested (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    run INTEGER NOT NULL
+);
+CREATE TABLE runs (
+    run INTEGER PRIMARY KEY AUTOINCREMENT,
+    started REAL NOT NULL,
+    full INTEGER NOT NULL,
+    completed REAL
+);
+CREATE TABLE engines (
+    address TEXT PRIMARY KEY,
+    engine_id BLOB NOT NULL,
+    boots INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    received REAL NOT NULL
+);
+"""
+
+# Keys looked up per query, below SQLite's bound parameter limit.
+LOOKUP_CHUNK = 500
+
+# sysUpTime, ifTableLastChange and ifStackLastChange in TimeTicks as read
+# along with the device, the values change detection compares between runs.
+MARKERS = ("uptime", "if_table_last_change", "if_stack_last_change")
+
+# How long cached interfaces are reused by change detection before the
+# tables are walked again regardless, in seconds. ifTableLastChange only
+# moves when interfaces are added or removed, not when their description,
+# status or addresses change.
+DEFAULT_MAX_AGE = 24 * 3600
+
+# Allowed lag of sysUpTime behind the wall clock time elapsed between two
+# runs before the device is considered rebooted, in TimeTicks.
+UPTIME_SLACK = 60 * 100
+
+COLUMNS = "address, name, digest, collected, device, walked, " + ", ".join(MARKERS)
+
+# walked is when the interface tables were last walked, it lags collected
+# while change detection reuses the interfaces.
+DeviceState = namedtuple("DeviceState", ["address", "name", "digest", "collected", "device", "walked", "markers"])
+
+
+class StateError(Exception):
+    pass
+
+
+def device_to_dict(device):
+    # Device.model_dump is taken by the Diode serialization, so the plain
+    # field values are collected by hand.
+    data = {field: getattr(device, field) for field in models.Device.model_fields}
+    data["interfaces"] = [interface.model_dump() for interface in device.interfaces]
+    return data
+
+
+def encode_device(device):
+    return json.dumps(device_to_dict(device), sort_keys=True, separators=(",", ":"))
+
+
+class StateStore:
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        # Shared by the discovery threads, every access holds the lock.
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise StateError(f"{path} was written by a newer snmp-diode, schema version {version}")
+        if version == 0:
+            with self.connection:
+                self.connection.executescript(SCHEMA)
+                self.connection.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, address, device, markers=None, walked=None, collected=None):
+        # Stores the device discovered at address along with its MARKERS
+        # dict, returns True when its content differs from the one
+        # previously stored.
+        markers = markers or {}
+        encoded = encode_device(device)
+        digest = hashlib.sha256(encoded.encode()).hexdigest()
+        collected = time.time() if collected is None else collected
+        walked = collected if walked is None else walked
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT digest FROM devices WHERE address = ?", (address,)).fetchone()
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO devices ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (address, device.name, digest, collected, encoded, walked)
+                + tuple(markers.get(marker) for marker in MARKERS),
+            )
+        return row is None or row[0] != digest
+
+    def cached_state(self, address, markers, now=None):
+        # The state recorded for address when markers, read from the device
+        # now, show it has neither rebooted nor changed its interface or
+        # stack tables since, so its interfaces can be reused. None when
+        # they have to be walked again.
+        if markers.get("uptime") is None or markers.get("if_table_last_change") is None:
+            return None
+        previous = self.get(address)
+        if previous is None:
+            return None
+        now = time.time() if now is None else now
+        if previous.walked is None or now - previous.walked > self.max_age or previous.markers["uptime"] is None:
+            return None
+        elapsed = now - previous.collected
+        if markers["uptime"] + UPTIME_SLACK < previous.markers["uptime"] + elapsed * 100:
+            return None
+        for marker in ("if_table_last_change", "if_stack_last_change"):
+            if markers.get(marker) != previous.markers[marker]:
+                return None
+        return previous
+
+    def start_run(self, resync_every=0):
+        # Numbers a delta ingestion run, returns (run, full). Every
+        # resync_every runs, counted from the last full one, is a full
+        # resync sending every entity, 0 never forces one. Only the
+        # completed runs count, see finish_run, dry runs without --apply
+        # and runs with failed batches do not.
+        with self.lock, self.connection:
+            last_full = self.connection.execute(
+                "SELECT MAX(run) FROM runs WHERE full = 1 AND completed IS NOT NULL"
+            ).fetchone()[0]
+            completed = self.connection.execute(
+                "SELECT COUNT(*) FROM runs WHERE completed IS NOT NULL AND run > ?", (last_full or 0,)
+            ).fetchone()[0]
+            full = resync_every > 0 and (last_full is None or completed + 1 >= resync_every)
+            cursor = self.connection.execute("INSERT INTO runs (started, full) VALUES (?, ?)", (time.time(), int(full)))
+        return cursor.lastrowid, full
+
+    def finish_run(self, run, full, failed):
+        # Called once the run ingested its batches. A run without failed
+        # batches is completed. After a completed full resync, entities it
+        # did not send belong to objects that are gone and are forgotten.
+        if failed:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET completed = ? WHERE run = ?", (time.time(), run))
+            if full:
+                self.connection.execute("DELETE FROM ingested WHERE run < ?", (run,))
+
+    def get_engine(self, address):
+        # The SNMPv3 engine last discovered at address as (engine_id, boots,
+        # time, received), see usm.EngineCache.
+        with self.lock:
+            return self.connection.execute(
+                "SELECT engine_id, boots, time, received FROM engines WHERE address = ?", (address,)
+            ).fetchone()
+
+    def record_engine(self, address, engine_id, boots, engine_time, received):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO engines (address, engine_id, boots, time, received) VALUES (?, ?, ?, ?, ?)",
+                (address, engine_id, boots, engine_time, received),
+            )
+
+    def forget_engine(self, address):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM engines WHERE address = ?", (address,))
+
+    def _load(self, rows):
+        return [
+            DeviceState(
+                address,
+                name,
+                digest,
+                collected,
+                models.Device.model_validate(json.loads(device)),
+                walked,
+                dict(zip(MARKERS, markers)),
+            )
+            for address, name, digest, collected, device, walked, *markers in rows
+        ]
+
+    def get(self, address):
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {COLUMNS} FROM devices WHERE address = ?", (address,)
+            ).fetchall()
+        states = self._load(rows)
+        return states[0] if states else None
+
+    def find_by_name(self, name):
+        # Several addresses can answer with the same sysName.
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {COLUMNS} FROM devices WHERE name = ? ORDER BY address",
+                (name,),
+            ).fetchall()
+        return self._load(rows)
+
+
+class IngestLedger:
+    # Content digest of every entity as of its last successful ingest,
+    # keyed by entity identity, see ingest.fingerprint. A readonly ledger
+    # only filters, for sinks whose batches are ingested by another process.
+
+    def __init__(self, store, run, full=False, readonly=False):
+        self.store = store
+        self.run = run
+        self.full = full
+        self.readonly = readonly
+
+    def unchanged(self, fingerprints):
+        # Keys of the fingerprints whose digest matches the ingested one.
+        if self.full:
+            return set()
+        digests = dict(fingerprints)
+        keys = list(digests)
+        unchanged = set()
+        with self.store.lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[start:start + LOOKUP_CHUNK]
+                rows = self.store.connection.execute(
+                    f"SELECT key, digest FROM ingested WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                unchanged.update(key for key, digest in rows if digests[key] == digest)
+        return unchanged
+
+    def commit(self, fingerprints):
+        if self.readonly:
+            return
+        with self.store.lock, self.store.connection:
+            self.store.connection.executemany(
+                "INSERT OR REPLACE INTO ingested (key, digest, run) VALUES (?, ?, ?)",
+                [(key, digest, self.run) for key, digest in fingerprints],
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the snmp-diode state store")
+    parser.add_argument("state", type=str, help="State store file")
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument("--address", type=str, help="Device address")
+    query.add_argument("--name", type=str, help="Device name")
+    args = parser.parse_args()
+    with StateStore(args.state) as store:
+        if args.address:
+            state = store.get(args.address)
+            states = [] if state is None else [state]
+        else:
+            states = store.find_by_name(args.name)
+    if not states:
+        print("ERROR: no device found")
+        exit(1)
+    for state in states:
+        print(
+            json.dumps(
+                {
+                    "address": state.address,
+                    "name": state.name,
+                    "digest": state.digest,
+                    "collected": state.collected,
+                    "walked": state.walked,
+                    "markers": state.markers,
+                    "device": device_to_dict(state.device),
+                },
+                indent=2,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from snmp_diode import discover, usm
+from snmp_diode.device import DiscoveryResult
+
+
+def discover_host(address, snmp_data, role=None, site=None, state=None, pool=None):
+    # With a pool.SessionPool the session is borrowed from it.
+    stats = {}
+    start = time.perf_counter()
+    try:
+        if pool is None:
+            device_data = discover.gater_device_data(address, snmp_data, role, site, stats, state)
+        else:
+            with pool.session(address, snmp_data) as session:
+                session.refresh()
+                device_data = discover.gater_device_data(address, snmp_data, role, site, stats, state, session)
+        return DiscoveryResult(address, device_data, None, stats)
+    except Exception as e:
+        if snmp_data["version"] == 3:
+            # net-snmp does not recover from a cached engine gone stale.
+            usm.engines.forget(address)
+        error_message = f"{str(e)}\n{traceback.format_exc()}"
+        return DiscoveryResult(address, None, error_message, stats)
+    finally:
+        stats["elapsed"] = time.perf_counter() - start
+
+
+def sweep(addresses, snmp_data, role=None, site=None, workers=1, state=None):
+    # Yields DiscoveryResult tuples as hosts finish, in completion
+    # order. Only a bounded number of addresses is submitted at a time so a
+    # large network is never fully materialised as futures.
+    max_pending = workers * 2
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for address in addresses:
+            pending.add(
+                executor.submit(discover_host, str(address), snmp_data, role, site, state)
+            )
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
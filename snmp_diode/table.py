@@ -0,0 +1,56 @@
+from snmp_diode.ber import oid_to_tuple
+
+# Bookkeeping shared by the easysnmp and asyncio table walkers. Several
+# columns of the same table are advanced together in one GETNEXT/GETBULK
+# request, each column stops once it leaves its own subtree, and the
+# results are grouped into rows keyed by the instance index.
+
+
+class TableWalkError(Exception):
+    pass
+
+
+class TableWalk:
+    def __init__(self, columns, oid_of, is_end):
+        self.oid_of = oid_of
+        self.is_end = is_end
+        # Every still active column mapped to the last OID seen for it, in
+        # the order the columns are sent in the request. GETBULK responses
+        # repeat that order once per repetition.
+        self.current = {}
+        self.last_index = {}
+        for column in columns:
+            column = "." + column.strip(".")
+            self.current[column] = column
+            self.last_index[column] = ()
+        self.rows = {}
+
+    @property
+    def done(self):
+        return not self.current
+
+    def next_oids(self):
+        return list(self.current.values())
+
+    def merge(self, batch):
+        # batch holds the varbinds of one response. An empty one leaves
+        # nothing to go on and ends every column.
+        if not batch:
+            self.current.clear()
+            return
+        active = list(self.current)
+        for position, item in enumerate(batch):
+            column = active[position % len(active)]
+            if column not in self.current:
+                continue
+            item_oid = self.oid_of(item)
+            if self.is_end(item) or not item_oid.startswith(column + "."):
+                del self.current[column]
+                continue
+            index = item_oid[len(column) + 1:]
+            index_key = oid_to_tuple(index)
+            if index_key <= self.last_index[column]:
+                raise TableWalkError(f"Agent returned OIDs out of order at {item_oid}")
+            self.rows.setdefault(index, {})[column] = item
+            self.current[column] = item_oid
+            self.last_index[column] = index_key
@@ -0,0 +1,488 @@
+import asyncio
+import collections
+import heapq
+import ipaddress
+import itertools
+import random
+import socket
+import weakref
+from snmp_diode import ber, rtt, usm
+from snmp_diode.table import TableWalk
+
+
+class SNMPError(Exception):
+    pass
+
+
+class SNMPTimeoutError(SNMPError):
+    pass
+
+
+# Sockets per address family shared by all the sessions of an event loop.
+DEFAULT_SOCKETS = 1
+
+# Receive buffer asked for every shared socket, thousands of answers can
+# arrive between two reads. The kernel caps it at net.core.rmem_max.
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# Datagrams read from a socket before handing control back to the loop.
+READ_BATCH = 256
+
+_request_ids = itertools.count(random.randint(1, 2**30))
+_dispatchers = weakref.WeakKeyDictionary()
+
+
+def next_request_id():
+    return next(_request_ids) % 2**31
+
+
+class _Pending:
+    __slots__ = (
+        "future",
+        "packet",
+        "address",
+        "sock",
+        "deadline",
+        "timeout",
+        "retries",
+        "estimator",
+        "limiter",
+        "tokens",
+        "sent",
+        "attempts",
+    )
+
+    def __init__(self, future, packet, address, sock, timeout, retries, estimator, limiter):
+        self.future = future
+        self.packet = packet
+        self.address = address
+        self.sock = sock
+        self.deadline = None
+        self.timeout = timeout
+        self.retries = retries
+        self.estimator = estimator
+        self.limiter = limiter
+        # Rate limit tokens taken for the next copy sent, see
+        # Dispatcher._send.
+        self.tokens = 0
+        self.sent = None
+        self.attempts = 0
+
+
+class Dispatcher:
+    # Every AsyncSession of an event loop sends its requests over the same
+    # few non-blocking UDP sockets, sockets per address family, instead of
+    # one socket per host. Responses are matched to their request by
+    # request-id, or msgID for SNMPv3, and their source address. Timeouts
+    # and retries run off a single deadline heap, so tens of thousands of
+    # requests can be outstanding at the cost of one heap entry each. Sends
+    # held back by a ratelimit.RateLimiter wait on a second heap, and the
+    # requests beyond a host's in-flight limit in a queue per host.
+
+    def __init__(self, loop, sockets=DEFAULT_SOCKETS):
+        self.loop = loop
+        self.count = sockets
+        self.sockets = {}
+        self.pending = {}
+        self.deadlines = []
+        self.timer = None
+        self.sends = []
+        self.send_timer = None
+        self.waiting = {}
+
+    def _sockets(self, family):
+        sockets = self.sockets.get(family)
+        if sockets is None:
+            sockets = self.sockets[family] = []
+            for _ in range(self.count):
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+                except OSError:
+                    pass
+                self.loop.add_reader(sock.fileno(), self._read, sock)
+                sockets.append(sock)
+        return sockets
+
+    def request(self, request_id, packet, address, family, timeout, retries, estimator=None, limiter=None):
+        # A future resolved with the decoded Message, or the raw datagram
+        # of an SNMPv3 answer for the session to verify and decrypt. With
+        # an rtt.RTTEstimator, the round trip is sampled and the timeout
+        # doubles on every retransmission. With a ratelimit.RateLimiter,
+        # every copy sent, retransmissions included, is paced by it.
+        sockets = self._sockets(family)
+        pending = _Pending(
+            self.loop.create_future(),
+            packet,
+            address,
+            sockets[request_id % len(sockets)],
+            timeout,
+            retries,
+            estimator,
+            limiter,
+        )
+        self.pending[request_id] = pending
+        if limiter is not None and not limiter.try_acquire(address[0]):
+            self.waiting.setdefault(address[0], collections.deque()).append((request_id, pending))
+        else:
+            self._send(request_id, pending)
+        return pending.future
+
+    def _send(self, request_id, pending):
+        # Every copy takes its subnet token, then its global token, see
+        # ratelimit.RateLimiter.reserve_subnet, waiting on the sends heap
+        # for the ones not available yet.
+        limiter = pending.limiter
+        if limiter is not None:
+            now = self.loop.time()
+            if pending.tokens == 0:
+                pending.tokens = 1
+                when = limiter.reserve_subnet(pending.address[0], now)
+                if when > now:
+                    self._hold(when, request_id, pending)
+                    return
+            if pending.tokens == 1:
+                pending.tokens = 2
+                when = limiter.reserve_global(now)
+                if when > now:
+                    self._hold(when, request_id, pending)
+                    return
+        self._transmit(request_id, pending)
+
+    def _hold(self, when, request_id, pending):
+        heapq.heappush(self.sends, (when, request_id, pending))
+        if self.send_timer is None or self.send_timer.when() > when:
+            if self.send_timer is not None:
+                self.send_timer.cancel()
+            self.send_timer = self.loop.call_at(when, self._release)
+
+    def _release(self):
+        # Moves on the packets whose tokens are due.
+        self.send_timer = None
+        now = self.loop.time()
+        while self.sends and self.sends[0][0] <= now:
+            _, request_id, pending = heapq.heappop(self.sends)
+            if self.pending.get(request_id) is not pending:
+                # Answered by an earlier copy while waiting for a token.
+                continue
+            if pending.future.done():
+                # Cancelled by the caller while waiting for a token.
+                self._done(request_id, pending)
+                continue
+            self._send(request_id, pending)
+        if self.sends:
+            self.send_timer = self.loop.call_at(self.sends[0][0], self._release)
+
+    def _transmit(self, request_id, pending):
+        pending.tokens = 0
+        try:
+            pending.sock.sendto(pending.packet, pending.address)
+        except OSError:
+            # A full send buffer or an unreachable network, handled like a
+            # lost datagram.
+            pass
+        now = self.loop.time()
+        if pending.sent is None:
+            pending.sent = now
+        pending.deadline = now + pending.timeout
+        heapq.heappush(self.deadlines, (pending.deadline, request_id, pending))
+        if self.timer is None or self.timer.when() > pending.deadline:
+            self._arm()
+
+    def _arm(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.deadlines:
+            self.timer = self.loop.call_at(self.deadlines[0][0], self._expire)
+
+    def _expire(self):
+        # Answers already waiting in the sockets are read first, a busy
+        # loop must not time out requests that were answered in time.
+        self.timer = None
+        for sockets in self.sockets.values():
+            for sock in sockets:
+                self._read(sock)
+        now = self.loop.time()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, request_id, pending = heapq.heappop(self.deadlines)
+            if self.pending.get(request_id) is not pending or pending.deadline != deadline:
+                continue
+            if pending.future.done():
+                # Cancelled by the caller.
+                self._done(request_id, pending)
+            elif pending.retries > 0:
+                pending.retries -= 1
+                pending.attempts += 1
+                if pending.estimator is not None:
+                    pending.estimator.backoff(pending.address[0], pending.timeout)
+                    pending.timeout = min(pending.timeout * 2, rtt.MAX_RTO)
+                self._send(request_id, pending)
+            else:
+                self._done(request_id, pending)
+                pending.future.set_exception(SNMPTimeoutError(f"timed out waiting for {pending.address[0]}"))
+        self._arm()
+
+    def _read(self, sock):
+        for _ in range(READ_BATCH):
+            try:
+                data, addr = sock.recvfrom(ber.MAX_MESSAGE_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP errors reported on the socket, the request timeout
+                # logic retries.
+                continue
+            self._dispatch(data, addr)
+
+    def _dispatch(self, data, addr):
+        try:
+            if ber.decode_version(data) == ber.VERSION_3:
+                key = ber.decode_v3_message(data).msg_id
+                message = data
+            else:
+                message = ber.decode_message(data)
+                key = message.request_id
+        except ber.BERError:
+            return
+        pending = self.pending.get(key)
+        if pending is None or pending.sent is None or addr[0] != pending.address[0]:
+            return
+        self._done(key, pending)
+        if pending.estimator is not None and pending.attempts == 0:
+            pending.estimator.sample(pending.address[0], self.loop.time() - pending.sent)
+        if not pending.future.done():
+            pending.future.set_result(message)
+
+    def _done(self, request_id, pending):
+        # Forgets a request answered, timed out or cancelled, and hands its
+        # request slot to the next request waiting for one to the same host.
+        del self.pending[request_id]
+        limiter = pending.limiter
+        if limiter is None or limiter.host_inflight is None:
+            return
+        host = pending.address[0]
+        waiting = self.waiting.get(host)
+        while waiting:
+            request_id, pending = waiting.popleft()
+            if not waiting:
+                del self.waiting[host]
+            if pending.future.done():
+                del self.pending[request_id]
+                continue
+            self._send(request_id, pending)
+            return
+        limiter.release(host)
+
+    def close(self):
+        for timer in (self.timer, self.send_timer):
+            if timer is not None:
+                timer.cancel()
+        self.timer = None
+        self.send_timer = None
+        for sockets in self.sockets.values():
+            for sock in sockets:
+                self.loop.remove_reader(sock.fileno())
+                sock.close()
+        self.sockets.clear()
+        for pending in self.pending.values():
+            if not pending.future.done():
+                pending.future.set_exception(SNMPError("Transport closed"))
+        # The request slots held by the requests cut short are given back.
+        waiting = {request_id for queue in self.waiting.values() for request_id, _ in queue}
+        for request_id, pending in self.pending.items():
+            if pending.limiter is not None and request_id not in waiting:
+                pending.limiter.release(pending.address[0])
+        self.pending.clear()
+        self.deadlines.clear()
+        self.sends.clear()
+        self.waiting.clear()
+
+
+def get_dispatcher():
+    loop = asyncio.get_running_loop()
+    dispatcher = _dispatchers.get(loop)
+    if dispatcher is None:
+        dispatcher = _dispatchers[loop] = Dispatcher(loop)
+    return dispatcher
+
+
+def close_dispatcher():
+    # Closes the sockets of the running loop, once its sweep is done.
+    dispatcher = _dispatchers.pop(asyncio.get_running_loop(), None)
+    if dispatcher is not None:
+        dispatcher.close()
+
+
+class AsyncSession:
+    # Non-blocking counterpart of easysnmp.Session. All sessions of a sweep
+    # share the running event loop and its Dispatcher, so thousands of
+    # requests can be outstanding without a thread or a socket per host.
+    # SNMPv3 sessions take the credentials as a usm.User.
+
+    def __init__(
+        self,
+        hostname,
+        community="public",
+        version=2,
+        remote_port=161,
+        timeout=0.5,
+        retries=3,
+        max_repetitions=25,
+        user=None,
+        estimator=None,
+        limiter=None,
+    ):
+        self.hostname = hostname
+        self.community = community
+        self.version = {1: ber.VERSION_1, 3: ber.VERSION_3}.get(version, ber.VERSION_2C)
+        self.remote_port = remote_port
+        self.timeout = timeout
+        self.retries = retries
+        self.max_repetitions = max_repetitions
+        self.user = user
+        # An rtt.RTTEstimator replacing timeout and retries with adaptive
+        # ones.
+        self.estimator = estimator
+        # A ratelimit.RateLimiter pacing the requests.
+        self.limiter = limiter
+        self.pdus = 0
+        self._dispatcher = None
+        self._address = None
+        self._family = None
+
+    async def open(self):
+        try:
+            ip = ipaddress.ip_address(self.hostname)
+        except ValueError:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(self.hostname, self.remote_port, type=socket.SOCK_DGRAM)
+            self._family, _, _, _, address = infos[0]
+            self._address = address[:2]
+        else:
+            self._family = socket.AF_INET6 if ip.version == 6 else socket.AF_INET
+            self._address = (str(ip), self.remote_port)
+        self._dispatcher = get_dispatcher()
+        return self
+
+    def close(self):
+        # The sockets are shared, see Dispatcher.
+        self._dispatcher = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def exchange(self, request_id, packet):
+        # Sends packet until the answer matching request_id arrives or the
+        # retries run out.
+        if self._dispatcher is None:
+            await self.open()
+        timeout, retries = self.timeout, self.retries
+        if self.estimator is not None:
+            timeout, retries = self.estimator.timeout(self._address[0], retries)
+        try:
+            return await self._dispatcher.request(
+                request_id, packet, self._address, self._family, timeout, retries, self.estimator, self.limiter
+            )
+        except SNMPTimeoutError:
+            raise SNMPTimeoutError(f"timed out while connecting to remote host {self.hostname}") from None
+
+    async def request(self, pdu_type, oids, non_repeaters=0, max_repetitions=0):
+        self.pdus += 1
+        if self.version == ber.VERSION_3:
+            return await self.request_v3(pdu_type, oids, non_repeaters, max_repetitions)
+        request_id = next_request_id()
+        packet = ber.encode_request(
+            self.version,
+            self.community,
+            pdu_type,
+            request_id,
+            oids,
+            non_repeaters,
+            max_repetitions,
+        )
+        message = await self.exchange(request_id, packet)
+        if message.error_status:
+            raise SNMPError(
+                f"{self.hostname} returned error-status {message.error_status} at index {message.error_index}"
+            )
+        return message.varbinds
+
+    async def discover_engine(self):
+        engine = usm.engines.get(self.hostname)
+        if engine is None:
+            msg_id = next_request_id()
+            data = await self.exchange(msg_id, ber.encode_v3_discovery(msg_id, msg_id))
+            try:
+                engine = usm.engines.update(self.hostname, *usm.parse_discovery(data))
+            except (ber.BERError, usm.USMError) as e:
+                raise SNMPError(f"{self.hostname} engine discovery failed: {e}")
+        return engine
+
+    async def request_v3(self, pdu_type, oids, non_repeaters=0, max_repetitions=0):
+        engine = await self.discover_engine()
+        # An agent that rebooted or was replaced since its engine was cached
+        # answers with a Report carrying the current one, the request is
+        # sent again once with it.
+        for attempt in range(2):
+            request_id = next_request_id()
+            pdu = ber.encode_request_pdu(pdu_type, request_id, oids, non_repeaters, max_repetitions)
+            packet = self.user.wrap(request_id, engine, ber.encode_scoped_pdu(engine.engine_id, b"", pdu))
+            data = await self.exchange(request_id, packet)
+            try:
+                parameters, scoped_pdu = self.user.unwrap(data)
+            except (ber.BERError, usm.USMError) as e:
+                raise SNMPError(f"{self.hostname} returned an invalid SNMPv3 message: {e}")
+            _, _, response_type, _, error_status, error_index, varbinds = scoped_pdu
+            if response_type != ber.REPORT:
+                break
+            report = varbinds[0].oid if varbinds else ""
+            if attempt == 0 and (report == usm.NOT_IN_TIME_WINDOW or parameters.engine_id != engine.engine_id):
+                engine = usm.engines.update(
+                    self.hostname, parameters.engine_id, parameters.engine_boots, parameters.engine_time
+                )
+                continue
+            raise SNMPError(f"{self.hostname} reported usmStats {usm.USM_STATS.get(report, report)}")
+        if error_status:
+            raise SNMPError(f"{self.hostname} returned error-status {error_status} at index {error_index}")
+        return varbinds
+
+    async def get(self, oids):
+        if isinstance(oids, str):
+            return (await self.request(ber.GET_REQUEST, [oids]))[0]
+        return await self.request(ber.GET_REQUEST, oids)
+
+    async def get_next(self, oids):
+        if isinstance(oids, str):
+            return (await self.request(ber.GET_NEXT_REQUEST, [oids]))[0]
+        return await self.request(ber.GET_NEXT_REQUEST, oids)
+
+    async def get_bulk(self, oids, non_repeaters=0, max_repetitions=10):
+        if isinstance(oids, str):
+            oids = [oids]
+        return await self.request(ber.GET_BULK_REQUEST, oids, non_repeaters, max_repetitions)
+
+    async def walk_table(self, columns):
+        # GETBULK with max_repetitions rows per PDU, or GETNEXT when
+        # max_repetitions is 0 or the session is SNMPv1.
+        bulk = self.max_repetitions > 0 and self.version != ber.VERSION_1
+        walk = TableWalk(columns, varbind_oid, is_end_of_walk)
+        while not walk.done:
+            if bulk:
+                batch = await self.get_bulk(walk.next_oids(), 0, self.max_repetitions)
+            else:
+                batch = await self.get_next(walk.next_oids())
+            walk.merge(batch)
+        return walk.rows
+
+
+def varbind_oid(item):
+    return item.oid
+
+
+def is_end_of_walk(item):
+    return item.type in ber.EXCEPTION_TYPES
@@ -0,0 +1,354 @@
+import functools
+import hashlib
+import hmac
+import random
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from snmp_diode import ber, rtt
+
+# SNMPv3 User-based Security Model (RFC 3414, AES from RFC 3826) for the
+# async backend, and the caches both backends share across hosts and
+# polls. Deriving a key from a password hashes a megabyte of it, so keys
+# are cached per password and protocol, and localized per engine ID. The
+# engine ID, boots and time of every agent are cached too, so repeated
+# polls skip the discovery round trip. Everything lives for the lifetime
+# of the process, across the cycles of the daemon. Engines are also kept
+# in the state store when there is one, keys never leave memory.
+
+AUTH_PROTOCOLS = {"MD5": hashlib.md5, "SHA": hashlib.sha1}
+PRIV_PROTOCOLS = ("DES", "AES")
+
+# HMAC-MD5-96 and HMAC-SHA-96 both truncate the digest to 12 octets.
+AUTH_PARAMETERS_LENGTH = 12
+
+# Octets of the repeated password hashed into a key (RFC 3414 A.2).
+PASSWORD_EXPANSION = 1024 * 1024
+
+# Passwords and localized keys kept, a fleet usually shares a few
+# credential sets but every agent has its own engine ID.
+KEY_CACHE_SIZE = 16
+LOCALIZED_KEY_CACHE_SIZE = 65536
+
+# Counters carried by usmStats reports, RFC 3414 5.
+USM_STATS = {
+    ".1.3.6.1.6.3.15.1.1.1.0": "unsupportedSecLevels",
+    ".1.3.6.1.6.3.15.1.1.2.0": "notInTimeWindows",
+    ".1.3.6.1.6.3.15.1.1.3.0": "unknownUserNames",
+    ".1.3.6.1.6.3.15.1.1.4.0": "unknownEngineIDs",
+    ".1.3.6.1.6.3.15.1.1.5.0": "wrongDigests",
+    ".1.3.6.1.6.3.15.1.1.6.0": "decryptionErrors",
+}
+NOT_IN_TIME_WINDOW = ".1.3.6.1.6.3.15.1.1.2.0"
+
+# received is the wall clock time the boots and time were read at.
+Engine = namedtuple("Engine", ["engine_id", "boots", "time", "received"])
+
+_salts = random.Random()
+
+
+class USMError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def password_to_key(password, protocol):
+    if not password:
+        raise USMError("SNMPv3 passwords can not be empty")
+    password = password.encode()
+    repeated = password * (PASSWORD_EXPANSION // len(password) + 1)
+    return AUTH_PROTOCOLS[protocol](repeated[:PASSWORD_EXPANSION]).digest()
+
+
+@functools.lru_cache(maxsize=LOCALIZED_KEY_CACHE_SIZE)
+def localized_key(password, protocol, engine_id):
+    # Privacy keys are localized with the authentication protocol as well.
+    key = password_to_key(password, protocol)
+    return AUTH_PROTOCOLS[protocol](key + engine_id + key).digest()
+
+
+def engine_time(engine):
+    # snmpEngineTime advances once a second, the agent is assumed to be
+    # that far past the time it last reported.
+    return min(engine.time + int(time.time() - engine.received), 2**31 - 1)
+
+
+class EngineCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = {}
+        self.store = None
+
+    def attach(self, store):
+        # Engines discovered by previous runs are read from, and new ones
+        # recorded in, the StateStore store.
+        self.store = store
+
+    def get(self, address):
+        with self.lock:
+            engine = self.engines.get(address)
+        if engine is None and self.store is not None:
+            row = self.store.get_engine(address)
+            if row is not None:
+                engine = Engine(*row)
+                with self.lock:
+                    self.engines[address] = engine
+        return engine
+
+    def update(self, address, engine_id, boots, engine_time):
+        engine = Engine(engine_id, boots, engine_time, time.time())
+        with self.lock:
+            self.engines[address] = engine
+        if self.store is not None:
+            self.store.record_engine(address, *engine)
+        return engine
+
+    def forget(self, address):
+        # After an error the engine may have changed, an agent replaced or
+        # reconfigured keeps its address, so the next poll discovers again.
+        with self.lock:
+            self.engines.pop(address, None)
+        if self.store is not None:
+            self.store.forget_engine(address)
+
+
+engines = EngineCache()
+
+
+def parse_discovery(data):
+    # Engine ID, boots and time from the Report answering an engine
+    # discovery request.
+    message = ber.decode_v3_message(data)
+    parameters = ber.decode_usm_parameters(message.security_parameters)
+    if not parameters.engine_id:
+        raise USMError("Engine discovery answered without an engine ID")
+    return parameters.engine_id, parameters.engine_boots, parameters.engine_time
+
+
+def discover_engine(address, port=161, timeout=1.0, retries=3, estimator=None, limiter=None):
+    # Blocking engine discovery for the sync backend, over a socket of its
+    # own since easysnmp only takes the engine, it never hands it back.
+    # With an rtt.RTTEstimator its timeout and retries replace the given
+    # ones, and a ratelimit.RateLimiter paces every copy sent, as in
+    # transport.Dispatcher.
+    engine = engines.get(address)
+    if engine is not None:
+        return engine
+    if limiter is None:
+        return _discover_engine(address, port, timeout, retries, estimator, None)
+    limiter.acquire(address)
+    try:
+        return _discover_engine(address, port, timeout, retries, estimator, limiter)
+    finally:
+        limiter.release(address)
+
+
+def _discover_engine(address, port, timeout, retries, estimator, limiter):
+    if estimator is not None:
+        timeout, retries = estimator.timeout(address, retries)
+    msg_id = random.randint(1, 2**31 - 1)
+    packet = ber.encode_v3_discovery(msg_id, msg_id)
+    family, _, _, _, remote = socket.getaddrinfo(address, port, type=socket.SOCK_DGRAM)[0]
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.connect(remote)
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.wait(address)
+            sent = time.monotonic()
+            sock.send(packet)
+            deadline = sent + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                sock.settimeout(remaining)
+                try:
+                    data = sock.recv(ber.MAX_MESSAGE_SIZE)
+                except socket.timeout:
+                    break
+                except OSError:
+                    # ICMP unreachable, count it as a lost answer.
+                    break
+                try:
+                    if ber.decode_v3_message(data).msg_id != msg_id:
+                        continue
+                    engine = engines.update(address, *parse_discovery(data))
+                except ber.BERError:
+                    continue
+                if estimator is not None and attempt == 0:
+                    estimator.sample(address, time.monotonic() - sent)
+                return engine
+            if estimator is not None:
+                estimator.backoff(address, timeout)
+                timeout = min(timeout * 2, rtt.MAX_RTO)
+    raise USMError(f"timed out while connecting to remote host {address}")
+
+
+def _ciphers():
+    try:
+        from cryptography.hazmat.primitives import ciphers
+    except ImportError:
+        raise USMError("SNMPv3 privacy on the async backend requires the cryptography package") from None
+    return ciphers
+
+
+def _aes(key, iv):
+    ciphers = _ciphers()
+    try:
+        from cryptography.hazmat.decrepit.ciphers.modes import CFB
+    except ImportError:
+        CFB = ciphers.modes.CFB
+    return ciphers.Cipher(ciphers.algorithms.AES(key[:16]), CFB(iv))
+
+
+def _des(key, iv):
+    ciphers = _ciphers()
+    try:
+        from cryptography.hazmat.decrepit.ciphers.algorithms import TripleDES
+    except ImportError:
+        TripleDES = ciphers.algorithms.TripleDES
+    # Triple DES with three identical keys is single DES.
+    return ciphers.Cipher(TripleDES(key[:8] * 3), ciphers.modes.CBC(iv))
+
+
+def encrypt(protocol, key, boots, engine_time, plaintext):
+    # Returns the ciphertext and the salt sent as msgPrivacyParameters.
+    if protocol == "AES":
+        salt = _salts.getrandbits(64).to_bytes(8, "big")
+        encryptor = _aes(key, struct.pack(">II", boots, engine_time) + salt).encryptor()
+    else:
+        salt = struct.pack(">II", boots, _salts.getrandbits(32))
+        iv = bytes(a ^ b for a, b in zip(key[8:16], salt))
+        encryptor = _des(key, iv).encryptor()
+        plaintext += b"\x00" * (-len(plaintext) % 8)
+    return encryptor.update(plaintext) + encryptor.finalize(), salt
+
+
+def decrypt(protocol, key, boots, engine_time, salt, ciphertext):
+    if len(salt) != 8:
+        raise USMError("Malformed SNMPv3 privacy parameters")
+    if protocol == "AES":
+        decryptor = _aes(key, struct.pack(">II", boots, engine_time) + salt).decryptor()
+    else:
+        if len(ciphertext) % 8:
+            raise USMError("Malformed SNMPv3 encrypted PDU")
+        decryptor = _des(key, bytes(a ^ b for a, b in zip(key[8:16], salt))).decryptor()
+    return decryptor.update(ciphertext) + decryptor.finalize()
+
+
+class User:
+    # The credentials of an SNMPv3 user, with the security level they are
+    # used at, wrapping and unwrapping the messages sent to its agents.
+
+    def __init__(
+        self,
+        username,
+        level="noAuthNoPriv",
+        auth_protocol=None,
+        auth_password=None,
+        privacy_protocol=None,
+        privacy_password=None,
+    ):
+        self.username = username
+        self.level = level
+        self.auth = level in ("authNoPriv", "authPriv")
+        self.priv = level == "authPriv"
+        if self.auth and auth_protocol not in AUTH_PROTOCOLS:
+            raise USMError(f"Unsupported SNMPv3 auth protocol {auth_protocol}, options are: MD5, SHA")
+        privacy_protocol = (privacy_protocol or "").upper()
+        if privacy_protocol == "AES128":
+            privacy_protocol = "AES"
+        if self.priv and privacy_protocol not in PRIV_PROTOCOLS:
+            raise USMError(f"Unsupported SNMPv3 privacy protocol {privacy_protocol}, options are: DES, AES")
+        if self.priv:
+            _ciphers()
+        self.auth_protocol = auth_protocol
+        self.auth_password = auth_password
+        self.privacy_protocol = privacy_protocol
+        self.privacy_password = privacy_password
+        self.flags = ber.MSG_FLAG_REPORTABLE
+        if self.auth:
+            self.flags |= ber.MSG_FLAG_AUTH
+        if self.priv:
+            self.flags |= ber.MSG_FLAG_PRIV
+
+    def auth_key(self, engine_id):
+        return localized_key(self.auth_password, self.auth_protocol, engine_id)
+
+    def priv_key(self, engine_id):
+        return localized_key(self.privacy_password, self.auth_protocol, engine_id)
+
+    def wrap(self, msg_id, engine, scoped_pdu):
+        boots = engine.boots
+        current_time = engine_time(engine)
+        data = scoped_pdu
+        priv_parameters = b""
+        if self.priv:
+            ciphertext, priv_parameters = encrypt(
+                self.privacy_protocol, self.priv_key(engine.engine_id), boots, current_time, scoped_pdu
+            )
+            data = ber.encode_tlv(ber.OCTET_STRING, ciphertext)
+        auth_parameters = bytes(AUTH_PARAMETERS_LENGTH) if self.auth else b""
+        security_parameters = ber.encode_usm_parameters(
+            engine.engine_id, boots, current_time, self.username, auth_parameters, priv_parameters
+        )
+        packet = ber.encode_v3_message(msg_id, self.flags, security_parameters, data)
+        if self.auth:
+            # The digest covers the whole message with zeroed auth
+            # parameters, which sit right before the privacy parameters.
+            end = len(packet) - len(data) - len(ber.encode_tlv(ber.OCTET_STRING, priv_parameters))
+            digest = hmac.new(self.auth_key(engine.engine_id), packet, AUTH_PROTOCOLS[self.auth_protocol])
+            packet = packet[: end - AUTH_PARAMETERS_LENGTH] + digest.digest()[:AUTH_PARAMETERS_LENGTH] + packet[end:]
+        return packet
+
+    def unwrap(self, data):
+        # Verifies and decrypts a received message, returns its USM
+        # parameters and the decoded ScopedPDU, see ber.decode_scoped_pdu.
+        message = ber.decode_v3_message(data)
+        parameters = ber.decode_usm_parameters(message.security_parameters)
+        if message.flags & ber.MSG_FLAG_AUTH:
+            if not self.auth or len(parameters.auth_parameters) != AUTH_PARAMETERS_LENGTH:
+                raise USMError("Unexpected SNMPv3 authentication parameters")
+            end = len(data) - len(message.data) - len(ber.encode_tlv(ber.OCTET_STRING, parameters.priv_parameters))
+            start = end - AUTH_PARAMETERS_LENGTH
+            if bytes(data[start:end]) != parameters.auth_parameters:
+                raise USMError("Malformed SNMPv3 security parameters")
+            unsigned = bytes(data[:start]) + bytes(AUTH_PARAMETERS_LENGTH) + bytes(data[end:])
+            digest = hmac.new(self.auth_key(parameters.engine_id), unsigned, AUTH_PROTOCOLS[self.auth_protocol])
+            if not hmac.compare_digest(digest.digest()[:AUTH_PARAMETERS_LENGTH], parameters.auth_parameters):
+                raise USMError("SNMPv3 message failed authentication, wrong digest")
+        payload = message.data
+        if message.flags & ber.MSG_FLAG_PRIV:
+            if not self.priv:
+                raise USMError("Unexpected SNMPv3 encrypted PDU")
+            tag, start, end = ber.decode_tlv(payload)
+            if tag != ber.OCTET_STRING:
+                raise USMError("Malformed SNMPv3 encrypted PDU")
+            payload = decrypt(
+                self.privacy_protocol,
+                self.priv_key(parameters.engine_id),
+                parameters.engine_boots,
+                parameters.engine_time,
+                parameters.priv_parameters,
+                payload[start:end],
+            )
+        scoped_pdu = ber.decode_scoped_pdu(payload)
+        # Reports can come at a lower level, responses must come at ours.
+        level = ber.MSG_FLAG_AUTH | ber.MSG_FLAG_PRIV
+        if scoped_pdu[2] != ber.REPORT and message.flags & level != self.flags & level:
+            raise USMError("SNMPv3 response below the requested security level")
+        return parameters, scoped_pdu
+
+
+def build_user(version_data):
+    # From the version_data of the entrypoint's snmp_data.
+    return User(
+        version_data["username"],
+        version_data["level"],
+        version_data.get("auth_protocol"),
+        version_data.get("auth"),
+        version_data.get("privacy_protocol"),
+        version_data.get("privacy"),
+    )
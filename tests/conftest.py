@@ -0,0 +1,154 @@
+import bisect
+import collections
+import os
+import selectors
+import socket
+import threading
+import pytest
+from snmp_diode import ber
+
+ENGINE_ID = bytes.fromhex("80001f8804736e6d702d64696f6465")
+USM_STATS_UNKNOWN_ENGINE_IDS = ".1.3.6.1.6.3.15.1.1.4.0"
+
+
+def device_mib(name, interfaces=2, uptime=100000, if_table_last_change=500):
+    # System group and interface tables of a small device, {oid: (type,
+    # value)}.
+    mib = {
+        ".1.3.6.1.2.1.1.2.0": (ber.OBJECT_IDENTIFIER, ".1.3.6.1.4.1.9.1.1"),
+        ".1.3.6.1.2.1.1.3.0": (ber.TIMETICKS, uptime),
+        ".1.3.6.1.2.1.1.5.0": (ber.OCTET_STRING, name.encode()),
+        ".1.3.6.1.2.1.1.6.0": (ber.OCTET_STRING, b"lab"),
+        ".1.3.6.1.2.1.31.1.5.0": (ber.TIMETICKS, if_table_last_change),
+        ".1.3.6.1.2.1.31.1.6.0": (ber.TIMETICKS, 0),
+    }
+    for index in range(1, interfaces + 1):
+        address = f"10.0.{index}.1"
+        mib[f".1.3.6.1.2.1.2.2.1.2.{index}"] = (ber.OCTET_STRING, f"Gi0/{index}".encode())
+        mib[f".1.3.6.1.2.1.2.2.1.6.{index}"] = (ber.OCTET_STRING, bytes([0, 0x50, 0x56, 0xAB, 0xCD, index]))
+        mib[f".1.3.6.1.2.1.2.2.1.7.{index}"] = (ber.INTEGER, 1)
+        mib[f".1.3.6.1.2.1.31.1.1.1.18.{index}"] = (ber.OCTET_STRING, f"uplink {index}".encode())
+        mib[f".1.3.6.1.2.1.4.20.1.1.{address}"] = (ber.IP_ADDRESS, address)
+        mib[f".1.3.6.1.2.1.4.20.1.2.{address}"] = (ber.INTEGER, index)
+        mib[f".1.3.6.1.2.1.4.20.1.3.{address}"] = (ber.IP_ADDRESS, "255.255.255.0")
+    return mib
+
+
+class Agent:
+    # Fake SNMP agent serving a MIB per address from a thread, for the
+    # transport, probe and sweep tests. It listens on the same UDP port of
+    # every address, answers GET, GETNEXT and GETBULK for SNMPv1 and v2c
+    # and SNMPv3 engine discovery with a report. With hold set the answers
+    # are kept back until release is called.
+
+    def __init__(self, mibs):
+        self.mibs = {}
+        for address, mib in mibs.items():
+            oids = sorted(mib, key=ber.oid_to_tuple)
+            self.mibs[address] = (mib, oids, [ber.oid_to_tuple(oid) for oid in oids])
+        self.requests = collections.Counter()
+        self.messages = collections.defaultdict(list)
+        self.hold = False
+        self.held = []
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.port = 0
+        for address in self.mibs:
+            family = socket.AF_INET6 if ":" in address else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind((address, self.port))
+            self.port = sock.getsockname()[1]
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.sockets.append(sock)
+        self.wake_read, self.wake_write = os.pipe()
+        self.selector.register(self.wake_read, selectors.EVENT_READ)
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj == self.wake_read:
+                    return
+                sock = key.fileobj
+                while True:
+                    try:
+                        data, addr = sock.recvfrom(ber.MAX_MESSAGE_SIZE)
+                    except BlockingIOError:
+                        break
+                    answer = self.answer(sock.getsockname()[0], data)
+                    with self.lock:
+                        if self.hold:
+                            self.held.append((sock, answer, addr))
+                            continue
+                    sock.sendto(answer, addr)
+
+    def release(self):
+        with self.lock:
+            self.hold = False
+            held, self.held = self.held, []
+        for sock, answer, addr in held:
+            sock.sendto(answer, addr)
+
+    def stop(self):
+        os.write(self.wake_write, b"x")
+        self.thread.join()
+        for sock in self.sockets:
+            sock.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+        self.selector.close()
+
+    def next_varbind(self, address, oid):
+        mib, oids, keys = self.mibs[address]
+        position = bisect.bisect_right(keys, ber.oid_to_tuple(oid))
+        if position == len(oids):
+            return (oid, ber.END_OF_MIB_VIEW, None)
+        return (oids[position],) + mib[oids[position]]
+
+    def answer(self, address, data):
+        with self.lock:
+            self.requests[address] += 1
+        if ber.decode_version(data) == ber.VERSION_3:
+            message = ber.decode_v3_message(data)
+            parameters = ber.encode_usm_parameters(ENGINE_ID, 1, 1000, "", b"", b"")
+            pdu = ber.encode_pdu(ber.REPORT, message.msg_id, [(USM_STATS_UNKNOWN_ENGINE_IDS, ber.COUNTER32, 1)])
+            scoped_pdu = ber.encode_scoped_pdu(ENGINE_ID, b"", pdu)
+            return ber.encode_v3_message(message.msg_id, 0, parameters, scoped_pdu)
+        message = ber.decode_message(data)
+        with self.lock:
+            self.messages[address].append(message)
+        mib = self.mibs[address][0]
+        if message.pdu_type == ber.GET_REQUEST:
+            varbinds = [(item.oid,) + mib.get(item.oid, (ber.NO_SUCH_OBJECT, None)) for item in message.varbinds]
+        elif message.pdu_type == ber.GET_NEXT_REQUEST:
+            varbinds = [self.next_varbind(address, item.oid) for item in message.varbinds]
+        else:
+            non_repeaters, max_repetitions = message.error_status, message.error_index
+            varbinds = [self.next_varbind(address, item.oid) for item in message.varbinds[:non_repeaters]]
+            current = [item.oid for item in message.varbinds[non_repeaters:]]
+            for _ in range(max_repetitions):
+                row = [self.next_varbind(address, oid) for oid in current]
+                varbinds += row
+                current = [varbind[0] for varbind in row]
+        return ber.encode_message(
+            message.version, message.community, ber.GET_RESPONSE, message.request_id, varbinds
+        )
+
+
+@pytest.fixture
+def start_agent():
+    # Starts an Agent serving {address: mib}, stopped with the test.
+    agents = []
+
+    def start(mibs):
+        agent = Agent(mibs)
+        agents.append(agent)
+        return agent
+
+    yield start
+    for agent in agents:
+        agent.stop()
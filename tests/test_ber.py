@@ -0,0 +1,87 @@
+import pytest
+from snmp_diode import ber
+
+SYS_NAME = ".1.3.6.1.2.1.1.5.0"
+
+# GET sysName.0 with community public and request-id 1, as sent by net-snmp.
+GET_SYS_NAME = bytes.fromhex(
+    "3026 020101 0406 7075626c6963"
+    " a019 020101 020100 020100 300e 300c 0608 2b06010201010500 0500"
+)
+
+
+def test_encode_request_known_answer():
+    packet = ber.encode_request(ber.VERSION_2C, "public", ber.GET_REQUEST, 1, [SYS_NAME])
+    assert packet == GET_SYS_NAME
+
+
+def test_decode_request_known_answer():
+    message = ber.decode_message(GET_SYS_NAME)
+    assert message.version == ber.VERSION_2C
+    assert message.community == b"public"
+    assert message.pdu_type == ber.GET_REQUEST
+    assert message.request_id == 1
+    assert message.varbinds == [ber.Varbind(SYS_NAME, ber.NULL, None)]
+
+
+def test_message_round_trip():
+    varbinds = [
+        (".1.3.6.1.2.1.2.2.1.2.1", ber.OCTET_STRING, b"x" * 300),
+        (".1.3.6.1.2.1.1.2.0", ber.OBJECT_IDENTIFIER, ".1.3.6.1.4.1.2636.1.1.1.2.144"),
+        (".1.3.6.1.2.1.4.20.1.1.10.0.0.1", ber.IP_ADDRESS, "10.0.0.1"),
+        (".1.3.6.1.2.1.1.3.0", ber.TIMETICKS, 4294967295),
+        (".1.3.6.1.2.1.31.1.1.1.6.1", ber.COUNTER64, 2**64 - 1),
+        (".1.3.6.1.2.1.2.2.1.8.1", ber.INTEGER, -129),
+        (".1.3.6.1.2.1.2.2.1.9.1", ber.END_OF_MIB_VIEW, None),
+    ]
+    packet = ber.encode_message(ber.VERSION_2C, b"secret", ber.GET_RESPONSE, 2**31 - 1, varbinds, 5, 3)
+    message = ber.decode_message(packet)
+    assert message.request_id == 2**31 - 1
+    assert (message.error_status, message.error_index) == (5, 3)
+    assert message.varbinds == [ber.Varbind(*varbind) for varbind in varbinds]
+
+
+def test_getbulk_carries_repetitions_in_error_fields():
+    packet = ber.encode_request(ber.VERSION_2C, "public", ber.GET_BULK_REQUEST, 7, [SYS_NAME], 1, 25)
+    message = ber.decode_message(packet)
+    assert (message.error_status, message.error_index) == (1, 25)
+
+
+def test_v3_message_round_trip():
+    parameters = ber.encode_usm_parameters(b"\x80\x00\x1f\x88\x04", 3, 12345, "user", b"a" * 12, b"p" * 8)
+    pdu = ber.encode_request_pdu(ber.GET_REQUEST, 9, [SYS_NAME])
+    scoped_pdu = ber.encode_scoped_pdu(b"\x80\x00\x1f\x88\x04", b"", pdu)
+    packet = ber.encode_v3_message(9, ber.MSG_FLAG_AUTH | ber.MSG_FLAG_REPORTABLE, parameters, scoped_pdu)
+
+    assert ber.decode_version(packet) == ber.VERSION_3
+    message = ber.decode_v3_message(packet)
+    assert message.msg_id == 9
+    assert message.flags == ber.MSG_FLAG_AUTH | ber.MSG_FLAG_REPORTABLE
+    assert message.security_model == ber.USM_SECURITY_MODEL
+    assert ber.decode_usm_parameters(message.security_parameters) == ber.USMParameters(
+        b"\x80\x00\x1f\x88\x04", 3, 12345, b"user", b"a" * 12, b"p" * 8
+    )
+    engine_id, context_name, pdu_type, request_id, _, _, varbinds = ber.decode_scoped_pdu(message.data)
+    assert (engine_id, context_name, pdu_type, request_id) == (b"\x80\x00\x1f\x88\x04", b"", ber.GET_REQUEST, 9)
+    assert varbinds == [ber.Varbind(SYS_NAME, ber.NULL, None)]
+
+
+def test_truncated_message_is_rejected():
+    with pytest.raises(ber.BERError):
+        ber.decode_message(GET_SYS_NAME[:-3])
+
+
+@pytest.mark.parametrize("tag", [0x45, 0x47])
+def test_unknown_value_type_is_kept_raw(tag):
+    # NsapAddress and UInteger32, obsolete but still sent by old agents.
+    varbinds = [
+        (".1.3.6.1.2.1.1.5.0", ber.OCTET_STRING, b"router-1"),
+        (".1.3.6.1.4.1.9.1.1", ber.OPAQUE, b"\x01\x02"),
+    ]
+    packet = ber.encode_message(ber.VERSION_2C, b"public", ber.GET_RESPONSE, 3, varbinds)
+    packet = packet.replace(b"\x44\x02\x01\x02", bytes([tag]) + b"\x02\x01\x02")
+    message = ber.decode_message(packet)
+    assert message.varbinds == [
+        ber.Varbind(".1.3.6.1.2.1.1.5.0", ber.OCTET_STRING, b"router-1"),
+        ber.Varbind(".1.3.6.1.4.1.9.1.1", tag, b"\x01\x02"),
+    ]
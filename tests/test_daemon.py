@@ -0,0 +1,55 @@
+import signal
+import threading
+from snmp_diode import ingest
+from snmp_diode.daemon import Daemon
+from snmp_diode.scheduler import DEFAULT_GROUP, PollGroup, Schedule
+from snmp_diode.state import StateStore
+from conftest import device_mib
+
+SYS_NAME = ".1.3.6.1.2.1.1.5.0"
+FAST = "127.0.1.1"
+SLOW = "127.0.1.2"
+
+
+class Response:
+    errors = ()
+
+
+class Client:
+    def ingest(self, entities):
+        return Response()
+
+
+def test_delta_cycles_follow_the_schedule(start_agent, monkeypatch):
+    # The default --interval is far longer than the test, the cycles end
+    # once both groups of the schedule were polled.
+    monkeypatch.setattr(signal, "signal", lambda *args: None)
+    agent = start_agent({FAST: device_mib("fast"), SLOW: device_mib("slow")})
+    snmp_data = {"version": 2, "version_data": {"community": "public"}, "port": agent.port}
+    schedule = Schedule(PollGroup(DEFAULT_GROUP, 0.5, 0, 0.5), [(PollGroup("fast", 0.1, 10, 0.1), [FAST])])
+    with StateStore(":memory:") as store, ingest.EntitySink(Client()) as sink:
+        daemon = Daemon(
+            [FAST, SLOW],
+            snmp_data,
+            sink,
+            backend="async",
+            workers=4,
+            jitter=0,
+            schedule=schedule,
+            store=store,
+            resync_every=0,
+        )
+        stopper = threading.Timer(2.2, daemon.stop)
+        stopper.start()
+        daemon.run()
+        stopper.join()
+        completed = store.connection.execute("SELECT COUNT(*) FROM runs WHERE completed IS NOT NULL").fetchone()[0]
+
+    polls = {
+        address: sum(1 for message in agent.messages[address] if message.varbinds[0].oid == SYS_NAME)
+        for address in (FAST, SLOW)
+    }
+    assert polls[FAST] > polls[SLOW] >= 3
+    # Every poll of the slow target closes a cycle, but the one still in
+    # flight when stopping.
+    assert polls[SLOW] - 1 <= completed <= polls[SLOW]
@@ -0,0 +1,148 @@
+import pytest
+from snmp_diode import ingest, models
+from snmp_diode.state import IngestLedger, StateStore
+
+DEVICE = models.Device(
+    name="router-1",
+    device_type="unknow",
+    manufacturer="Cisco",
+    site="lab",
+    interfaces=[
+        models.Interface(name="Gi0/1", mac_address="00:50:56:AB:CD:01", enabled=True, address="10.0.1.1/24"),
+        models.Interface(name="Gi0/2", mac_address="00:50:56:AB:CD:02", enabled=False),
+    ],
+)
+
+
+class Response:
+    def __init__(self, errors=()):
+        self.errors = errors
+
+
+class Client:
+    def __init__(self, error=None, errors=()):
+        self.error = error
+        self.errors = errors
+        self.entities = []
+
+    def ingest(self, entities):
+        if self.error is not None:
+            raise self.error
+        self.entities += entities
+        return Response(self.errors)
+
+
+@pytest.fixture
+def store():
+    with StateStore(":memory:") as store:
+        yield store
+
+
+def ingest_run(store, client, device=DEVICE, resync_every=0, readonly=False):
+    run = store.start_run(resync_every)
+    with ingest.EntitySink(client, ledger=IngestLedger(store, *run, readonly=readonly)) as sink:
+        sink.add(device.model_dump())
+    if not readonly:
+        store.finish_run(*run, sink.failed_batches > 0)
+    return run, sink
+
+
+def test_fingerprint_is_stable():
+    first, second = DEVICE.model_dump(), DEVICE.model_dump()
+    second[0].timestamp.seconds = 1700000000
+    assert [ingest.fingerprint(entity) for entity in first] == [ingest.fingerprint(entity) for entity in second]
+    assert [key for key, _ in map(ingest.fingerprint, first)] == [
+        "device|lab|router-1",
+        "interface|lab|router-1|Gi0/1",
+        "ip_address|10.0.1.1/24|router-1|Gi0/1",
+        "interface|lab|router-1|Gi0/2",
+    ]
+
+
+def test_fingerprint_follows_the_content():
+    interface = DEVICE.interfaces[0].model_copy(update={"description": "uplink"})
+    changed = DEVICE.model_copy(update={"interfaces": [interface, DEVICE.interfaces[1]]})
+    before = dict(map(ingest.fingerprint, DEVICE.model_dump()))
+    after = dict(map(ingest.fingerprint, changed.model_dump()))
+    assert before.keys() == after.keys()
+    assert [key for key in before if before[key] != after[key]] == ["interface|lab|router-1|Gi0/1"]
+
+
+def test_unchanged_entities_are_skipped(store):
+    client = Client()
+    _, sink = ingest_run(store, client)
+    assert len(client.entities) == 4
+    client = Client()
+    _, sink = ingest_run(store, client)
+    assert client.entities == []
+    assert (sink.unchanged, sink.batches) == (4, 0)
+    changed = DEVICE.model_copy(update={"interfaces": [DEVICE.interfaces[0].model_copy(update={"enabled": False})]})
+    _, sink = ingest_run(store, client, changed)
+    assert [entity.interface.name for entity in client.entities] == ["Gi0/1"]
+    assert sink.unchanged == 2
+
+
+@pytest.mark.parametrize("client", [Client(error=RuntimeError("unavailable")), Client(errors=["rejected"])])
+def test_only_accepted_batches_are_committed(store, client):
+    _, sink = ingest_run(store, client)
+    assert sink.failed_batches == 1
+    assert store.connection.execute("SELECT COUNT(*) FROM ingested").fetchone()[0] == 0
+    client = Client()
+    ingest_run(store, client)
+    assert len(client.entities) == 4
+
+
+def test_readonly_ledger_filters_without_committing(store):
+    # A process sweep worker whose batches the parent ingests and commits.
+    ingest_run(store, Client())
+    changed = DEVICE.model_copy(update={"site": "dc"})
+    client = Client()
+    _, sink = ingest_run(store, client, changed, readonly=True)
+    assert len(client.entities) == 4
+    client = Client()
+    _, sink = ingest_run(store, client, changed, readonly=True)
+    assert len(client.entities) == 4
+
+
+def test_full_resync_sends_everything_and_forgets_the_rest(store):
+    ingest_run(store, Client())
+    client = Client()
+    single = DEVICE.model_copy(update={"interfaces": DEVICE.interfaces[1:]})
+    run = store.start_run()
+    with ingest.EntitySink(client, ledger=IngestLedger(store, run[0], True)) as sink:
+        sink.add(single.model_dump())
+    store.finish_run(run[0], True, False)
+    assert len(client.entities) == 2
+    keys = {key for key, in store.connection.execute("SELECT key FROM ingested")}
+    assert keys == {"device|lab|router-1", "interface|lab|router-1|Gi0/2"}
+
+
+def test_resync_every_counts_completed_runs(store):
+    # --resync-every 3, the first run is a full one.
+    assert store.start_run(3)[1]
+    store.finish_run(1, True, False)
+    run, full = store.start_run(3)
+    assert not full
+    store.finish_run(run, full, False)
+    # Dry runs are never finished, runs with failed batches not completed.
+    assert not store.start_run(3)[1]
+    run, full = store.start_run(3)
+    assert not full
+    store.finish_run(run, full, True)
+    run, full = store.start_run(3)
+    assert not full
+    store.finish_run(run, full, False)
+    run, full = store.start_run(3)
+    assert full
+    # Until the full resync completes every run is a full one.
+    run, full = store.start_run(3)
+    assert full
+    store.finish_run(run, full, False)
+    assert not store.start_run(3)[1]
+
+
+def test_no_resync_without_resync_every(store):
+    for _ in range(3):
+        run, full = store.start_run(0)
+        assert not full
+        store.finish_run(run, full, False)
@@ -0,0 +1,136 @@
+import logging
+import resource
+import pytest
+from snmp_diode import pool
+from snmp_diode.pool import SessionPool
+
+V2 = {"version": 2, "version_data": {"community": "public"}}
+ALICE = {
+    "version": 3,
+    "version_data": {"level": "authNoPriv", "username": "alice", "auth_protocol": "SHA", "auth": "secret-1"},
+}
+BOB = {
+    "version": 3,
+    "version_data": {"level": "authNoPriv", "username": "bob", "auth_protocol": "SHA", "auth": "secret-2"},
+}
+
+
+class Session:
+    def __init__(self, address, snmp_data):
+        self.address = address
+        self.snmp_data = snmp_data
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_sessions_are_reused(clock):
+    sessions = SessionPool(Session, clock=clock)
+    with sessions.session("10.0.0.1", V2) as first:
+        pass
+    with sessions.session("10.0.0.1", V2) as second:
+        pass
+    assert second is first
+    assert not first.closed
+    assert (sessions.hits, sessions.misses, len(sessions)) == (1, 1, 1)
+
+
+def test_sessions_are_keyed_by_credentials(clock):
+    sessions = SessionPool(Session, clock=clock)
+    for snmp_data in (ALICE, BOB, V2, dict(V2, port=1161)):
+        with sessions.session("10.0.0.1", snmp_data):
+            pass
+    assert (sessions.hits, sessions.misses, len(sessions)) == (0, 4, 4)
+    with sessions.session("10.0.0.1", BOB) as session:
+        assert session.snmp_data["version_data"]["username"] == "bob"
+    # The same credentials listed in another order are the same set.
+    reordered = {"version": 3, "version_data": dict(reversed(ALICE["version_data"].items()))}
+    with sessions.session("10.0.0.1", reordered):
+        pass
+    assert sessions.hits == 2
+
+
+def test_failed_poll_drops_the_session(clock):
+    sessions = SessionPool(Session, clock=clock)
+    with pytest.raises(RuntimeError):
+        with sessions.session("10.0.0.1", V2) as session:
+            raise RuntimeError("timeout")
+    assert session.closed
+    assert len(sessions) == 0
+
+
+def test_idle_sessions_are_evicted(clock):
+    sessions = SessionPool(Session, idle_timeout=60, clock=clock)
+    with sessions.session("10.0.0.1", V2) as first:
+        pass
+    clock.now = 30.0
+    with sessions.session("10.0.0.2", V2) as second:
+        pass
+    clock.now = 61.0
+    with sessions.session("10.0.0.1", V2) as again:
+        pass
+    assert again is not first
+    assert first.closed and not second.closed
+    assert (sessions.evicted, sessions.overflowed) == (1, 0)
+    clock.now = 200.0
+    with sessions.session("10.0.0.3", V2):
+        pass
+    assert second.closed and again.closed
+    assert (sessions.evicted, len(sessions)) == (3, 1)
+
+
+def test_full_pool_evicts_the_least_recently_used(clock, caplog):
+    sessions = SessionPool(Session, max_size=2, clock=clock)
+    built = {}
+    with caplog.at_level(logging.DEBUG, logger="snmp_diode.pool"):
+        for address in ("10.0.0.1", "10.0.0.2", "10.0.0.1", "10.0.0.3", "10.0.0.4"):
+            with sessions.session(address, V2) as session:
+                built.setdefault(address, session)
+    assert [key[0] for key in sessions.idle] == ["10.0.0.3", "10.0.0.4"]
+    assert built["10.0.0.2"].closed and built["10.0.0.1"].closed
+    assert (sessions.evicted, sessions.overflowed) == (2, 2)
+    warnings = [record for record in caplog.records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert [record.getMessage() for record in caplog.records if record.levelno == logging.DEBUG] == [
+        "session pool full, evicted the session of 10.0.0.2",
+        "session pool full, evicted the session of 10.0.0.1",
+    ]
+
+
+def test_close_closes_the_idle_sessions(clock):
+    sessions = SessionPool(Session, clock=clock)
+    with sessions.session("10.0.0.1", V2) as session:
+        pass
+    sessions.close()
+    assert session.closed
+    assert len(sessions) == 0
+
+
+@pytest.mark.parametrize(
+    "soft, workers, expected",
+    [
+        (1024, 32, 1024 - pool.FD_HEADROOM - 32),
+        (65536, 32, pool.DEFAULT_MAX_SIZE),
+        (resource.RLIM_INFINITY, 32, pool.DEFAULT_MAX_SIZE),
+        (256, 32, 0),
+    ],
+)
+def test_default_max_size_follows_the_open_file_limit(monkeypatch, soft, workers, expected):
+    monkeypatch.setattr(resource, "getrlimit", lambda limit: (soft, resource.RLIM_INFINITY))
+    assert pool.default_max_size("sync", workers) == expected
+    # AsyncSessions hold no socket of their own.
+    assert pool.default_max_size("async", workers) == pool.DEFAULT_MAX_SIZE
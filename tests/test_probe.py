@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from snmp_diode import probe, ratelimit
+from conftest import device_mib
+
+RESPONDERS = ["127.0.1.20", "127.0.1.21"]
+SILENT = "127.0.1.22"
+
+
+def test_resolve_keeps_addresses_and_skips_unresolvable_hostnames():
+    resolved = asyncio.run(probe.resolve(["10.0.0.1", "2001:db8::0001", "localhost", "no-such-host.invalid"], 161))
+    assert resolved["10.0.0.1"] == "10.0.0.1"
+    assert resolved["2001:db8::0001"] == "2001:db8::1"
+    assert resolved["localhost"] in ("127.0.0.1", "::1")
+    assert "no-such-host.invalid" not in resolved
+
+
+def test_paced_interleaves_subnets():
+    # One packet per 100ms per subnet, the second host of 10.0.1.0/24 waits
+    # for its subnet while 10.0.2.0/24 goes first.
+    targets = [("10.0.1.1", None), ("10.0.1.2", None), ("10.0.2.1", None)]
+    limiter = ratelimit.RateLimiter(subnet_rate=10)
+
+    async def collect():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        return [(address, loop.time() - start) async for address, _ in probe.paced(targets, limiter)]
+
+    sent = asyncio.run(collect())
+    assert [address for address, _ in sent] == ["10.0.1.1", "10.0.2.1", "10.0.1.2"]
+    assert sent[1][1] < 0.05
+    assert sent[2][1] >= 0.09
+
+
+def test_paced_without_limiter_keeps_order():
+    targets = [("10.0.1.2", None), ("10.0.1.1", None)]
+
+    async def collect():
+        return [target async for target in probe.paced(targets, None)]
+
+    assert asyncio.run(collect()) == targets
+
+
+def test_probe_targets_keeps_resolved_responders_in_order(monkeypatch):
+    probed = []
+
+    async def fake_probe(addresses, snmp_data, timeout, retries, rate):
+        probed.append(addresses)
+        return {"127.0.0.1", "::1", "10.0.0.2"}
+
+    monkeypatch.setattr(probe, "probe", fake_probe)
+    addresses = ["10.0.0.2", "no-such-host.invalid", "10.0.0.1", "localhost"]
+    responders = asyncio.run(probe.probe_targets(addresses, {"version": 2}))
+    assert responders == ["10.0.0.2", "localhost"]
+    assert probed[0][:2] == ["10.0.0.2", "10.0.0.1"]
+    assert len(probed[0]) == 3
+
+
+@pytest.mark.parametrize("snmp_data", [
+    {"version": 2, "version_data": {"community": "public"}},
+    {"version": 3, "version_data": {"username": "monitor"}},
+], ids=["v2c", "v3"])
+def test_only_responders_are_returned(start_agent, snmp_data):
+    agent = start_agent({address: device_mib(address) for address in RESPONDERS})
+    snmp_data = dict(snmp_data, port=agent.port)
+    responders = probe.run_probe(RESPONDERS + [SILENT], snmp_data, timeout=0.2, retries=1)
+    assert responders == RESPONDERS
+    # Answered addresses are not probed again by the retry.
+    assert agent.requests == {address: 1 for address in RESPONDERS}
@@ -0,0 +1,69 @@
+from snmp_diode import ingest
+from snmp_diode.procsweep import ProcessSweep
+from snmp_diode.state import IngestLedger, StateStore
+from conftest import device_mib
+
+SYS_NAME = ".1.3.6.1.2.1.1.5.0"
+
+
+class Response:
+    errors = ()
+
+
+class Client:
+    def __init__(self):
+        self.entities = []
+
+    def ingest(self, entities):
+        self.entities += entities
+        return Response()
+
+
+def sweep_once(addresses, snmp_data, path):
+    # A delta run over two spawned workers whose batches go through the
+    # parent sink, as entrypoint runs --processes 2 --delta.
+    client = Client()
+    with StateStore(path) as store:
+        run = store.start_run()
+        sweep = ProcessSweep(
+            addresses, snmp_data, processes=2, backend="async", workers=4, state=path, ledger_run=run
+        )
+        with ingest.EntitySink(client, 5, ledger=IngestLedger(store, *run)) as sink:
+            results = list(sweep.results(sink))
+        store.finish_run(*run, sink.failed_batches > 0)
+    return sweep, sink, client, results
+
+
+def test_every_target_is_discovered_once(start_agent, tmp_path):
+    addresses = [f"127.0.1.{index}" for index in range(1, 8)]
+    agent = start_agent({address: device_mib(f"router-{address}") for address in addresses})
+    snmp_data = {"version": 2, "version_data": {"community": "public"}, "port": agent.port}
+    path = str(tmp_path / "state.db")
+
+    sweep, sink, client, results = sweep_once(addresses, snmp_data, path)
+
+    assert sorted(result.address for result in results) == addresses
+    assert all(result.error is None and result.device is None for result in results)
+    for address in addresses:
+        gets = [message for message in agent.messages[address] if message.varbinds[0].oid == SYS_NAME]
+        assert len(gets) == 1
+    assert sorted(summary.index for summary in sweep.summaries) == [0, 1]
+    assert sum(summary.addresses for summary in sweep.summaries) == len(addresses)
+    assert all(summary.error is None for summary in sweep.summaries)
+
+    # The workers recorded the devices, their batches were sent and
+    # committed to the ledger by the parent.
+    devices = {entity.device.name for entity in client.entities if entity.WhichOneof("entity") == "device"}
+    assert devices == {f"router-{address}" for address in addresses}
+    assert sink.entities == len(client.entities)
+    assert sink.unchanged == 0
+    with StateStore(path) as store:
+        assert all(store.get(address).name == f"router-{address}" for address in addresses)
+        ingested = store.connection.execute("SELECT COUNT(*) FROM ingested").fetchone()[0]
+    assert ingested == len({ingest.fingerprint(entity)[0] for entity in client.entities})
+
+    # Nothing changed, the workers filter every entity out.
+    _, sink, client, results = sweep_once(addresses, snmp_data, path)
+    assert len(results) == len(addresses)
+    assert client.entities == []
+    assert sink.unchanged == ingested
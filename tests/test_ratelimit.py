@@ -0,0 +1,61 @@
+import pytest
+from snmp_diode import ratelimit
+
+
+def send_times(reserve, packets, now=100.0):
+    return [reserve(now) for _ in range(packets)]
+
+
+def test_bucket_bursts_then_paces():
+    limiter = ratelimit.RateLimiter(rate=100)
+    times = send_times(limiter.reserve_global, 15)
+    # A tenth of a second worth of tokens goes at once, then one every 10 ms.
+    assert times == pytest.approx([100.0] * 10 + [100.01, 100.02, 100.03, 100.04, 100.05])
+    assert limiter.delayed == 5
+
+
+def test_slow_bucket_has_no_burst():
+    limiter = ratelimit.RateLimiter(rate=5)
+    assert send_times(limiter.reserve_global, 3) == pytest.approx([100.0, 100.2, 100.4])
+
+
+def test_bucket_refills_while_idle():
+    limiter = ratelimit.RateLimiter(rate=10)
+    send_times(limiter.reserve_global, 3)
+    assert limiter.reserve_global(200.0) == 200.0
+
+
+def test_subnets_have_their_own_buckets():
+    limiter = ratelimit.RateLimiter(subnet_rate=5)
+    assert limiter.reserve_subnet("192.0.2.1", 100.0) == 100.0
+    assert limiter.reserve_subnet("192.0.2.2", 100.0) == pytest.approx(100.2)
+    assert limiter.reserve_subnet("198.51.100.1", 100.0) == 100.0
+    # Hostnames have no subnet.
+    assert limiter.reserve_subnet("router.example.net", 100.0) == 100.0
+
+
+def test_busy_subnet_does_not_hold_back_the_global_tokens():
+    limiter = ratelimit.RateLimiter(rate=10, subnet_rate=1)
+    assert limiter.reserve_subnet("192.0.2.1", 100.0) == 100.0
+    assert limiter.reserve_global(100.0) == 100.0
+    # Waits a second for its subnet token, the global one is only taken then.
+    assert limiter.reserve_subnet("192.0.2.2", 100.0) == pytest.approx(101.0)
+    assert limiter.reserve_subnet("198.51.100.1", 100.0) == 100.0
+    assert limiter.reserve_global(100.0) == pytest.approx(100.1)
+
+
+def test_host_inflight():
+    limiter = ratelimit.RateLimiter(host_inflight=2)
+    assert limiter.try_acquire("192.0.2.1")
+    assert limiter.try_acquire("192.0.2.1")
+    assert not limiter.try_acquire("192.0.2.1")
+    assert limiter.try_acquire("192.0.2.2")
+    limiter.release("192.0.2.1")
+    assert limiter.try_acquire("192.0.2.1")
+
+
+def test_for_session():
+    assert ratelimit.for_session({}) is None
+    assert ratelimit.for_session({"rate_limit": {"rate": None, "subnet_rate": None, "host_inflight": None}}) is None
+    limits = {"rate_limit": {"rate": 50.0, "subnet_rate": None, "host_inflight": 1}}
+    assert ratelimit.for_session(limits) is ratelimit.for_session(dict(limits))
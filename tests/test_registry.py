@@ -0,0 +1,94 @@
+import pytest
+from snmp_diode import device, registry
+from snmp_diode.registry import MANUFACTURER, PRODUCT, Registry, RegistryError
+
+MANUFACTURERS = {
+    9: {"name": "Cisco", "products": {1: "ciscoGatewayServer", 12: "cisco2500"}},
+    2636: {
+        "name": "Juniper",
+        "products": {(1, 1, 1): "jnxProductLineM", (1, 1, 1, 2, 144): "jnxProductNameEX4300"},
+    },
+    99999: {"name": "Acme", "products": {}},
+}
+
+
+@pytest.fixture
+def trie(tmp_path):
+    path = tmp_path / "sysobjectid.bin"
+    registry.write_registry(registry.registry_entries(MANUFACTURERS), path)
+    opened = Registry(path)
+    yield opened
+    opened.close()
+
+
+@pytest.mark.parametrize(
+    "oid, expected",
+    [
+        (".1.3.6.1.4.1.2636.1.1.1.2.144", ("Juniper", "jnxProductNameEX4300")),
+        # The deepest registered prefix wins, below it and beside it.
+        ("1.3.6.1.4.1.2636.1.1.1.2.144.7", ("Juniper", "jnxProductNameEX4300")),
+        (".1.3.6.1.4.1.2636.1.1.1.2.57", ("Juniper", "jnxProductLineM")),
+        (".1.3.6.1.4.1.2636.3", ("Juniper", None)),
+        (".1.3.6.1.4.1.99999.1.2", ("Acme", None)),
+        (".1.3.6.1.4.1.12345.1.1", (None, None)),
+        (".1.3.6.1.2.1.1", (None, None)),
+        ("", (None, None)),
+        (".1.3.6.1.4.1.9.1.x", ("Cisco", None)),
+    ],
+)
+def test_resolve_longest_prefix(trie, oid, expected):
+    assert trie.resolve(oid) == expected
+
+
+def test_numbered_products_live_in_the_product_subtree(trie):
+    # Cisco products are numbered below ciscoProducts, 9.1, the same number
+    # elsewhere under the enterprise is something else.
+    assert trie.resolve(".1.3.6.1.4.1.9.1.12") == ("Cisco", "cisco2500")
+    assert trie.resolve(".1.3.6.1.4.1.9.12") == ("Cisco", None)
+    assert trie.resolve(".1.3.6.1.4.1.9.9.1") == ("Cisco", None)
+    # Without a subtree listed, products sit right below the enterprise.
+    entries = list(registry.registry_entries({7: {"name": "Seven", "products": {3: "seven3"}}}))
+    assert entries == [
+        ((1, 3, 6, 1, 4, 1, 7), MANUFACTURER, "Seven"),
+        ((1, 3, 6, 1, 4, 1, 7, 3), PRODUCT, "seven3"),
+    ]
+
+
+def test_later_entries_override_earlier_ones(tmp_path):
+    path = tmp_path / "sysobjectid.bin"
+    prefix = (1, 3, 6, 1, 4, 1, 9)
+    registry.write_registry([(prefix, MANUFACTURER, "ciscoSystems"), (prefix, MANUFACTURER, "Cisco")], path)
+    opened = Registry(path)
+    assert opened.resolve(".1.3.6.1.4.1.9.1.1") == ("Cisco", None)
+    assert opened.digest is None
+    opened.close()
+
+
+def test_digest_trailer(tmp_path):
+    path = tmp_path / "sysobjectid.bin"
+    registry.write_registry(registry.registry_entries(MANUFACTURERS), path, "ab" * 32)
+    opened = Registry(path)
+    assert opened.digest == "ab" * 32
+    opened.close()
+
+
+def test_not_a_registry(tmp_path):
+    path = tmp_path / "sysobjectid.bin"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(RegistryError):
+        Registry(path)
+
+
+def test_unknown_enterprise_falls_back_to_unknow(trie, monkeypatch):
+    monkeypatch.setattr(registry, "_registry", trie)
+    device.get_device_model.cache_clear()
+    try:
+        assert device.get_device_model(".1.3.6.1.4.1.2636.1.1.1.2.144") == ("Juniper", "jnxProductNameEX4300")
+        assert device.get_device_model(".1.3.6.1.4.1.99999.1.2") == ("Acme", "unknow")
+        assert device.get_device_model(".1.3.6.1.4.1.12345.1.1") == ("unknow", "unknow")
+    finally:
+        device.get_device_model.cache_clear()
+
+
+def test_shipped_registry_resolves():
+    assert registry.get_registry().resolve(".1.3.6.1.4.1.9.1.1") == ("Cisco", "ciscoGatewayServer")
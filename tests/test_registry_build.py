@@ -0,0 +1,118 @@
+import pytest
+from snmp_diode import registry_build
+from snmp_diode.registry import Registry
+
+PEN = """\
+0
+  Reserved
+    Internet Assigned Numbers Authority
+      iana&iana.org
+9
+  ciscoSystems
+    John Doe
+      john&example.com
+99999
+  Acme Networks
+    Jane Doe
+      jane&example.com
+"""
+
+ACME_SMI = """\
+ACME-SMI DEFINITIONS ::= BEGIN
+acme MODULE-IDENTITY
+    LAST-UPDATED "202601010000Z"
+    DESCRIPTION "The Acme enterprise, { not an OID }"
+    ::= { enterprises 99999 }
+acmeProducts OBJECT IDENTIFIER ::= { acme 1 }  -- products live here
+END
+"""
+
+ACME_PRODUCTS = """\
+ACME-PRODUCTS-MIB DEFINITIONS ::= BEGIN
+acmeRouters OBJECT IDENTIFIER ::= { acmeProducts 1 }
+acmeR100 OBJECT-IDENTITY
+    STATUS current
+    DESCRIPTION "R100 router"
+    ::= { acmeRouters 100 }
+acmeSwitch OBJECT IDENTIFIER ::= { acmeProducts 2 }
+END
+"""
+
+
+@pytest.fixture
+def sources(tmp_path):
+    (tmp_path / "enterprise-numbers").write_text(PEN)
+    (tmp_path / "ACME-SMI").write_text(ACME_SMI)
+    (tmp_path / "ACME-PRODUCTS-MIB").write_text(ACME_PRODUCTS)
+    return tmp_path
+
+
+def arguments(sources, command="build"):
+    return registry_build.parser.parse_args(
+        [
+            command,
+            "--pen", str(sources / "enterprise-numbers"),
+            "--mib", str(sources / "ACME-SMI"),
+            "--products", str(sources / "ACME-PRODUCTS-MIB"),
+            "--output", str(sources / "sysobjectid.bin"),
+            "--cache", str(sources / "cache"),
+        ]
+    )
+
+
+def test_build_from_pen_and_mibs(sources):
+    registry_build.build(arguments(sources))
+    built = Registry(sources / "sysobjectid.bin")
+    try:
+        assert built.resolve(".1.3.6.1.4.1.99999.1.1.100") == ("Acme Networks", "acmeR100")
+        assert built.resolve(".1.3.6.1.4.1.99999.1.1.100.3") == ("Acme Networks", "acmeR100")
+        assert built.resolve(".1.3.6.1.4.1.99999.1.2") == ("Acme Networks", "acmeSwitch")
+        # acmeRouters has products below it, it is not one itself.
+        assert built.resolve(".1.3.6.1.4.1.99999.1.1.7") == ("Acme Networks", None)
+        assert built.resolve(".1.3.6.1.4.1.9.1.1") == ("ciscoSystems", None)
+        assert built.resolve(".1.3.6.1.4.1.12345.1") == (None, None)
+    finally:
+        built.close()
+
+
+def test_parse_mib_ignores_strings_and_comments(sources):
+    definitions = registry_build.parse_mib(sources / "ACME-SMI")
+    assert definitions == {"acme": ["other", "enterprises", [99999]], "acmeProducts": ["oid", "acme", [1]]}
+
+
+def test_check_reports_stale_inputs(sources, capsys):
+    registry_build.build(arguments(sources))
+    assert registry_build.check(arguments(sources, "check")) == 0
+    with open(sources / "ACME-PRODUCTS-MIB", "a") as mib:
+        mib.write("-- touched\n")
+    assert registry_build.check(arguments(sources, "check")) == 1
+    assert "out of date" in capsys.readouterr().out
+    registry_build.build(arguments(sources))
+    assert registry_build.check(arguments(sources, "check")) == 0
+
+
+def test_check_without_registry(sources):
+    assert registry_build.check(arguments(sources, "check")) == 1
+
+
+def test_parse_cache_only_parses_changed_inputs(sources):
+    registry_build.build(arguments(sources))
+    (sources / "ACME-SMI").write_text(ACME_SMI.replace("acme 1", "acme 2"))
+    cache = registry_build.ParseCache(sources / "cache")
+    parsed = []
+
+    def parser(path):
+        parsed.append(path)
+        return registry_build.parse_mib(path)
+
+    cache.load("mib", sources / "ACME-PRODUCTS-MIB", parser)
+    definitions = cache.load("mib", sources / "ACME-SMI", parser)
+    assert parsed == [sources / "ACME-SMI"]
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert definitions["acmeProducts"] == ["oid", "acme", [2]]
+
+
+def test_build_needs_inputs(sources):
+    args = registry_build.parser.parse_args(["build", "--output", str(sources / "sysobjectid.bin")])
+    with pytest.raises(registry_build.RegistryBuildError):
+        registry_build.build(args)
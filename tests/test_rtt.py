@@ -0,0 +1,54 @@
+import pytest
+from snmp_diode import rtt
+
+
+def test_first_sample_sets_rto():
+    estimate = rtt.Estimate()
+    estimate.sample(0.2)
+    # RFC 6298 2.2: SRTT = R, RTTVAR = R / 2, RTO = SRTT + 4 * RTTVAR.
+    assert estimate.srtt == pytest.approx(0.2)
+    assert estimate.rttvar == pytest.approx(0.1)
+    assert estimate.rto == pytest.approx(0.6)
+
+
+def test_later_samples_are_smoothed():
+    estimate = rtt.Estimate()
+    estimate.sample(0.2)
+    estimate.sample(0.4)
+    # RFC 6298 2.3, RTTVAR first from the previous SRTT.
+    assert estimate.rttvar == pytest.approx(0.75 * 0.1 + 0.25 * 0.2)
+    assert estimate.srtt == pytest.approx(0.875 * 0.2 + 0.125 * 0.4)
+    assert estimate.rto == pytest.approx(estimate.srtt + 4 * estimate.rttvar)
+
+
+def test_rto_is_clamped():
+    fast = rtt.Estimate()
+    fast.sample(0.001)
+    assert fast.rto == rtt.MIN_RTO
+    slow = rtt.Estimate()
+    slow.sample(30.0)
+    assert slow.rto == rtt.MAX_RTO
+
+
+def test_unknown_host_starts_from_its_subnet():
+    estimator = rtt.RTTEstimator()
+    assert estimator.timeout("192.0.2.1", 3) == (rtt.INITIAL_RTO, rtt.UNANSWERED_RETRIES)
+    estimator.sample("192.0.2.1", 0.01)
+    assert estimator.timeout("192.0.2.1", 3) == (rtt.MIN_RTO, 3)
+    # Same /24, never answered.
+    assert estimator.timeout("192.0.2.200", 3) == (rtt.MIN_RTO, rtt.UNANSWERED_RETRIES)
+    assert estimator.timeout("198.51.100.1", 3) == (rtt.INITIAL_RTO, rtt.UNANSWERED_RETRIES)
+
+
+def test_backoff_doubles_the_host_only():
+    estimator = rtt.RTTEstimator()
+    estimator.sample("192.0.2.1", 0.2)
+    estimator.backoff("192.0.2.1", 0.6)
+    assert estimator.timeout("192.0.2.1", 3) == (pytest.approx(1.2), 3)
+    assert estimator.timeout("192.0.2.2", 3) == (pytest.approx(0.6), rtt.UNANSWERED_RETRIES)
+
+
+def test_for_session():
+    assert rtt.for_session({"timeout_mode": "adaptive"}) is rtt.estimator
+    assert rtt.for_session({"timeout_mode": "fixed"}) is None
+    assert rtt.for_session({}) is None
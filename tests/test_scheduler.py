@@ -0,0 +1,71 @@
+import pytest
+from snmp_diode.scheduler import DEFAULT_GROUP, PollGroup, Schedule, ScheduleError, Scheduler, load_schedule
+
+DEFAULT = PollGroup(DEFAULT_GROUP, 300, 0, 300)
+CORE = PollGroup("core", 60, 10, 30)
+ACCESS = PollGroup("access", 900, 0, 900)
+
+
+def test_group_for_picks_most_specific_network():
+    schedule = Schedule(DEFAULT, [(ACCESS, ["10.0.0.0/8"]), (CORE, ["10.1.0.0/24", "core-1.example.net"])])
+    assert schedule.group_for("10.1.0.5") is CORE
+    assert schedule.group_for("10.2.0.5") is ACCESS
+    assert schedule.group_for("core-1.example.net") is CORE
+    assert schedule.group_for("192.0.2.1") is DEFAULT
+    assert schedule.group_for("other.example.net") is DEFAULT
+
+
+def test_take_orders_by_priority_then_deadline():
+    scheduler = Scheduler()
+    scheduler.add("access-1", ACCESS, 0.0)
+    scheduler.add("default-1", PollGroup(DEFAULT_GROUP, 300, 0, 100), 0.0)
+    scheduler.add("core-1", CORE, 5.0)
+    polls, shed = scheduler.take(10.0, 3)
+    assert [target.address for target in polls] == ["core-1", "default-1", "access-1"]
+    assert shed == []
+
+
+def test_take_hands_out_at_most_the_free_slots():
+    scheduler = Scheduler()
+    for index in range(5):
+        scheduler.add(f"host-{index}", DEFAULT, 0.0)
+    polls, _ = scheduler.take(1.0, 2)
+    assert len(polls) == 2
+    assert len(scheduler) == 3
+
+
+def test_targets_not_due_yet_wait():
+    scheduler = Scheduler()
+    scheduler.add("later", DEFAULT, 50.0)
+    assert scheduler.take(10.0, 10) == ([], [])
+    assert scheduler.next_due() == 50.0
+
+
+def test_target_past_its_deadline_is_shed_and_rescheduled():
+    scheduler = Scheduler()
+    scheduler.add("core-1", CORE, 0.0)
+    polls, shed = scheduler.take(31.0, 1)
+    assert polls == []
+    assert [target.address for target in shed] == ["core-1"]
+    assert scheduler.shed == 1
+    # The next poll follows the missed one by an interval.
+    assert scheduler.next_due() == 60.0
+
+
+def test_reschedule_skips_missed_intervals():
+    scheduler = Scheduler()
+    scheduler.add("core-1", CORE, 0.0)
+    (target,), _ = scheduler.take(0.0, 1)
+    scheduler.reschedule(target, 200.0)
+    assert scheduler.next_due() == 240.0
+
+
+def test_load_schedule(tmp_path):
+    path = tmp_path / "schedule.json"
+    path.write_text('{"groups": {"core": {"interval": 60, "priority": 10, "targets": ["10.1.0.0/24"]}}}')
+    schedule = load_schedule(path, DEFAULT)
+    assert schedule.group_for("10.1.0.1") == PollGroup("core", 60, 10, 60)
+
+    path.write_text('{"groups": {"broken": {"interval": 0}}}')
+    with pytest.raises(ScheduleError):
+        load_schedule(path, DEFAULT)
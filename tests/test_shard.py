@@ -0,0 +1,63 @@
+import netaddr
+import pytest
+from snmp_diode import shard
+
+HOSTNAMES = ["core-1.example.net", "core-2.example.net", "edge-1.example.net", "edge-2.example.net"]
+
+
+def targets():
+    addresses = netaddr.IPSet(["10.0.0.0/26", "192.0.2.1", "2001:db8::/124"])
+    return shard.Targets(addresses, HOSTNAMES)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 8])
+def test_shards_are_disjoint_and_complete(count):
+    everything = [str(address) for address in targets()]
+    shards = [
+        [str(address) for address in shard.ShardedTargets(targets(), index, count)] for index in range(count)
+    ]
+    assert sorted(sum(shards, [])) == sorted(everything)
+    assert sum(len(part) for part in shards) == len(set(everything))
+
+
+@pytest.mark.parametrize("count", [2, 3, 8])
+def test_split_is_stable(count):
+    # The shard only depends on the address, not on its form or on where
+    # it is listed.
+    everything = list(targets())
+    first = {str(address): shard.shard_of(address, count) for address in everything}
+    again = {str(address): shard.shard_of(str(address), count) for address in reversed(everything)}
+    assert first == again
+    assert first["10.0.0.7"] == 0x0A000007 % count
+    assert first["2001:db8::5"] == int(netaddr.IPAddress("2001:db8::5")) % count
+
+
+def test_consecutive_addresses_are_spread_evenly():
+    counts = [len(list(shard.ShardedTargets(targets(), index, 4))) for index in range(4)]
+    # 64 IPv4, 16 IPv6 and one more address spread by value, the hostnames
+    # by CRC32.
+    assert max(counts) - min(counts) <= len(HOSTNAMES) + 1
+
+
+@pytest.mark.parametrize("spec, expected", [("1/1", (0, 1)), ("3/8", (2, 8)), ("8/8", (7, 8))])
+def test_parse_shard(spec, expected):
+    assert shard.parse_shard(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["0/8", "9/8", "1/0", "3", "a/b"])
+def test_parse_shard_rejects(spec):
+    with pytest.raises(shard.ShardError):
+        shard.parse_shard(spec)
+
+
+def test_load_targets_merges_repeated_entries(tmp_path):
+    path = tmp_path / "targets.txt"
+    path.write_text("10.0.0.0/30\n10.0.0.1  # again\n\ncore-1.example.net\ncore-1.example.net\n")
+    loaded = shard.load_targets(path)
+    assert [str(address) for address in loaded] == [
+        "10.0.0.0",
+        "10.0.0.1",
+        "10.0.0.2",
+        "10.0.0.3",
+        "core-1.example.net",
+    ]
@@ -0,0 +1,154 @@
+import asyncio
+from collections import namedtuple
+import pytest
+from snmp_diode import aiodiscover, models
+from snmp_diode.state import DEFAULT_MAX_AGE, UPTIME_SLACK, StateStore
+from snmp_diode.transport import close_dispatcher
+from conftest import device_mib
+
+ADDRESS = "127.0.0.1"
+UPTIME = ".1.3.6.1.2.1.1.3.0"
+IF_TABLE_LAST_CHANGE = ".1.3.6.1.2.1.31.1.5.0"
+IF_STACK_LAST_CHANGE = ".1.3.6.1.2.1.31.1.6.0"
+
+MARKERS = {"uptime": 100000, "if_table_last_change": 500, "if_stack_last_change": 0}
+DEVICE = models.Device(
+    name="router-1",
+    device_type="unknow",
+    manufacturer="Cisco",
+    site="lab",
+    interfaces=[models.Interface(name="Gi0/1", mac_address="00:50:56:AB:CD:01", enabled=True)],
+)
+
+
+@pytest.fixture
+def store():
+    with StateStore(":memory:") as store:
+        yield store
+
+
+def test_record_reports_changes(store):
+    assert store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    assert not store.record(ADDRESS, DEVICE, MARKERS, collected=1100.0)
+    assert store.record(ADDRESS, DEVICE.model_copy(update={"site": "dc"}), MARKERS, collected=1200.0)
+    state = store.get(ADDRESS)
+    assert (state.device.site, state.collected, state.walked, state.markers) == ("dc", 1200.0, 1200.0, MARKERS)
+    assert [state.address for state in store.find_by_name("router-1")] == [ADDRESS]
+
+
+def test_unchanged_markers_reuse_the_interfaces(store):
+    store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    # 300 seconds later sysUpTime went on by 30000 TimeTicks.
+    markers = dict(MARKERS, uptime=MARKERS["uptime"] + 30000)
+    previous = store.cached_state(ADDRESS, markers, now=1300.0)
+    assert previous is not None
+    assert previous.device.interfaces == DEVICE.interfaces
+    assert previous.walked == 1000.0
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        # Rebooted, sysUpTime went backwards.
+        {"uptime": 50},
+        # Rebooted since, sysUpTime went on by less than the time elapsed.
+        {"uptime": MARKERS["uptime"] + 30000 - UPTIME_SLACK - 1},
+        {"if_table_last_change": 700},
+        {"if_stack_last_change": 900},
+        # Markers the device does not have, or did not answer.
+        {"uptime": None},
+        {"if_table_last_change": None},
+    ],
+)
+def test_changed_markers_force_a_walk(store, changed):
+    store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    markers = {**MARKERS, "uptime": MARKERS["uptime"] + 30000, **changed}
+    assert store.cached_state(ADDRESS, markers, now=1300.0) is None
+
+
+def test_uptime_within_slack_reuses_the_interfaces(store):
+    store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    markers = dict(MARKERS, uptime=MARKERS["uptime"] + 30000 - UPTIME_SLACK)
+    assert store.cached_state(ADDRESS, markers, now=1300.0) is not None
+
+
+def test_stale_or_unknown_state_forces_a_walk(store):
+    assert store.cached_state(ADDRESS, MARKERS, now=1000.0) is None
+    store.record(ADDRESS, DEVICE, dict(MARKERS, uptime=None), collected=1000.0)
+    assert store.cached_state(ADDRESS, MARKERS, now=1000.0) is None
+    store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    # Walked too long ago, the interfaces are walked again regardless.
+    later = 1000.0 + DEFAULT_MAX_AGE + 1
+    markers = dict(MARKERS, uptime=MARKERS["uptime"] + (DEFAULT_MAX_AGE + 1) * 100)
+    assert store.cached_state(ADDRESS, markers, now=later) is None
+
+
+def test_reused_interfaces_keep_their_walk_time(store):
+    store.record(ADDRESS, DEVICE, MARKERS, collected=1000.0)
+    previous = store.cached_state(ADDRESS, MARKERS, now=1000.0)
+    store.record(ADDRESS, DEVICE, MARKERS, previous.walked, collected=2000.0)
+    assert store.get(ADDRESS).walked == 1000.0
+
+
+def poll(address, snmp_data, store):
+    async def collect():
+        try:
+            stats = {}
+            device = await aiodiscover.gater_device_data(address, snmp_data, stats=stats, state=store)
+            return device, stats
+        finally:
+            close_dispatcher()
+
+    device, stats = asyncio.run(collect())
+    store.record(address, device, stats["markers"], stats.get("walked"))
+    return device, stats
+
+
+@pytest.mark.parametrize(
+    "oid, value, walked",
+    [
+        (UPTIME, 100500, False),
+        (UPTIME, 100, True),
+        (IF_TABLE_LAST_CHANGE, 600, True),
+        (IF_STACK_LAST_CHANGE, 600, True),
+    ],
+)
+def test_discovery_skips_the_walk_only_when_nothing_changed(start_agent, store, oid, value, walked):
+    mib = device_mib("router-1")
+    agent = start_agent({ADDRESS: mib})
+    snmp_data = {"version": 2, "version_data": {"community": "public"}, "port": agent.port}
+
+    device, stats = poll(ADDRESS, snmp_data, store)
+    assert "walked" not in stats
+    assert stats["markers"] == {"uptime": 100000, "if_table_last_change": 500, "if_stack_last_change": 0}
+    assert len(device.interfaces) == 2
+
+    mib[oid] = (mib[oid][0], value)
+    again, stats = poll(ADDRESS, snmp_data, store)
+    assert again == device
+    if walked:
+        assert "walked" not in stats
+        assert stats["pdus"] == 3
+    else:
+        assert "walked" in stats
+        assert stats["pdus"] == 1
+
+
+TimeTicks = namedtuple("TimeTicks", ["value", "snmp_type"])
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("12345", 12345),
+        ("(12345) 0:02:03.45", 12345),
+        ("1:2:03:04.5", ((24 + 2) * 3600 + 3 * 60 + 4) * 100 + 50),
+        ("no such", None),
+    ],
+)
+def test_sync_timeticks(value, expected):
+    pytest.importorskip("easysnmp")
+    from snmp_diode import discover
+
+    assert discover.timeticks(TimeTicks(value, "TICKS")) == expected
+    assert discover.timeticks(TimeTicks("", "NOSUCHOBJECT")) is None
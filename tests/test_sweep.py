@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+import pytest
+from snmp_diode import aiodiscover, models, usm
+
+V2 = {"version": 2, "version_data": {"community": "public"}}
+V3 = {"version": 3, "version_data": {"level": "noAuthNoPriv", "username": "monitor"}}
+WORKERS = 4
+
+
+def make_device(address):
+    return models.Device(name=address, device_type="unknow", manufacturer="unknow", site="lab", interfaces=[])
+
+
+class Discovery:
+    # Stands in for gater_device_data, failing for the addresses in
+    # failing and keeping track of the hosts discovered at once.
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.most_active = 0
+
+    def start(self, address, stats):
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        stats["pdus"] = 1
+
+    def finish(self, address):
+        with self.lock:
+            self.active -= 1
+        if address in self.failing:
+            raise RuntimeError(f"{address} timed out")
+        return make_device(address)
+
+    def sync(self, address, snmp_data, role=None, site=None, stats=None, state=None, session=None):
+        self.start(address, stats)
+        time.sleep(0.01)
+        return self.finish(address)
+
+    async def run(self, address, snmp_data, role=None, site=None, stats=None, state=None, session=None):
+        self.start(address, stats)
+        await asyncio.sleep(0.01)
+        return self.finish(address)
+
+
+@pytest.fixture(params=["sync", "async"])
+def backend(request, monkeypatch):
+    # (sweep function, Discovery) with the device discovery stubbed.
+    discovery = Discovery(failing={"10.0.0.3", "10.0.0.7"})
+    if request.param == "sync":
+        pytest.importorskip("easysnmp")
+        from snmp_diode import discover, sweep
+
+        monkeypatch.setattr(discover, "gater_device_data", discovery.sync)
+        return lambda addresses, snmp_data: sweep.sweep(addresses, snmp_data, workers=WORKERS), discovery
+    monkeypatch.setattr(aiodiscover, "gater_device_data", discovery.run)
+    return (
+        lambda addresses, snmp_data: aiodiscover.run_sweep(addresses, snmp_data, concurrency=WORKERS),
+        discovery,
+    )
+
+
+def test_every_host_is_discovered_once_with_bounded_concurrency(backend):
+    sweep, discovery = backend
+    addresses = [f"10.0.0.{index}" for index in range(1, 41)]
+    results = list(sweep(iter(addresses), V2))
+    assert sorted(result.address for result in results) == sorted(addresses)
+    assert 1 < discovery.most_active <= WORKERS
+    assert all(result.stats["elapsed"] > 0 for result in results)
+
+
+def test_errors_are_captured_per_host(backend):
+    sweep, _ = backend
+    results = {result.address: result for result in sweep([f"10.0.0.{index}" for index in range(1, 9)], V2)}
+    failed = {address for address, result in results.items() if result.error is not None}
+    assert failed == {"10.0.0.3", "10.0.0.7"}
+    assert "10.0.0.3 timed out" in results["10.0.0.3"].error
+    assert "Traceback" in results["10.0.0.3"].error
+    assert results["10.0.0.3"].device is None
+    assert results["10.0.0.1"].device == make_device("10.0.0.1")
+    assert results["10.0.0.1"].stats["pdus"] == 1
+
+
+def test_addresses_are_taken_as_results_are_consumed(backend):
+    # A large network is never materialised, a slow consumer holds the
+    # sweep back.
+    sweep, _ = backend
+    taken = []
+
+    def addresses():
+        for index in range(100000):
+            taken.append(index)
+            yield f"10.{index // 65536}.{index // 256 % 256}.{index % 256}"
+
+    results = sweep(addresses(), V2)
+    next(results)
+    time.sleep(0.3)
+    assert len(taken) <= 3 * WORKERS
+    # Stopping early cancels the rest of the sweep.
+    results.close()
+    assert len(taken) <= 3 * WORKERS
+
+
+def test_failed_v3_host_forgets_its_engine(monkeypatch):
+    pytest.importorskip("easysnmp")
+    from snmp_diode import discover, sweep
+
+    discovery = Discovery(failing={"10.0.0.3"})
+    monkeypatch.setattr(discover, "gater_device_data", discovery.sync)
+    forgotten = []
+    monkeypatch.setattr(usm.engines, "forget", forgotten.append)
+    list(sweep.sweep(["10.0.0.1", "10.0.0.3"], V2, workers=WORKERS))
+    assert forgotten == []
+    list(sweep.sweep(["10.0.0.1", "10.0.0.3"], V3, workers=WORKERS))
+    assert forgotten == ["10.0.0.3"]
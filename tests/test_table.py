@@ -0,0 +1,103 @@
+import pytest
+from snmp_diode import ber
+from snmp_diode.table import TableWalk, TableWalkError
+from snmp_diode.transport import is_end_of_walk, varbind_oid
+
+IF_DESCR = ".1.3.6.1.2.1.2.2.1.2"
+IF_TYPE = ".1.3.6.1.2.1.2.2.1.3"
+IF_MTU = ".1.3.6.1.2.1.2.2.1.4"
+
+
+def item(oid, value=b"x"):
+    return ber.Varbind(oid, ber.OCTET_STRING, value)
+
+
+def end(oid):
+    return ber.Varbind(oid, ber.END_OF_MIB_VIEW, None)
+
+
+def table_walk(*columns):
+    return TableWalk(columns, varbind_oid, is_end_of_walk)
+
+
+def test_columns_are_interleaved_and_grouped_by_index():
+    walk = table_walk(IF_DESCR, IF_TYPE)
+    assert walk.next_oids() == [IF_DESCR, IF_TYPE]
+    walk.merge([item(f"{IF_DESCR}.1"), item(f"{IF_TYPE}.1"), item(f"{IF_DESCR}.2"), item(f"{IF_TYPE}.2")])
+    assert walk.next_oids() == [f"{IF_DESCR}.2", f"{IF_TYPE}.2"]
+    walk.merge([item(f"{IF_TYPE}.1"), item(f"{IF_MTU}.1")])
+    assert walk.done
+    assert list(walk.rows) == ["1", "2"]
+    assert walk.rows["2"] == {IF_DESCR: item(f"{IF_DESCR}.2"), IF_TYPE: item(f"{IF_TYPE}.2")}
+
+
+def test_ragged_column_ends_early():
+    # ifType has a single row, in the repetitions after it the agent goes
+    # on into ifMtu while ifDescr still has rows.
+    walk = table_walk(IF_DESCR, IF_TYPE)
+    walk.merge(
+        [
+            item(f"{IF_DESCR}.1"),
+            item(f"{IF_TYPE}.1"),
+            item(f"{IF_DESCR}.2"),
+            item(f"{IF_MTU}.1"),
+            item(f"{IF_DESCR}.3"),
+            item(f"{IF_MTU}.2"),
+        ]
+    )
+    assert walk.next_oids() == [f"{IF_DESCR}.3"]
+    walk.merge([item(f"{IF_DESCR}.4"), item(f"{IF_TYPE}.1")])
+    assert walk.done
+    assert {index: sorted(row) for index, row in walk.rows.items()} == {
+        "1": [IF_DESCR, IF_TYPE],
+        "2": [IF_DESCR],
+        "3": [IF_DESCR],
+        "4": [IF_DESCR],
+    }
+
+
+def test_batch_shorter_than_the_active_columns():
+    # An agent short of room answers fewer varbinds than requested, the
+    # columns left out are asked again from where they were.
+    walk = table_walk(IF_DESCR, IF_TYPE, IF_MTU)
+    walk.merge([item(f"{IF_DESCR}.1"), item(f"{IF_TYPE}.1")])
+    assert not walk.done
+    assert walk.next_oids() == [f"{IF_DESCR}.1", f"{IF_TYPE}.1", IF_MTU]
+    walk.merge([item(f"{IF_TYPE}.1"), item(f"{IF_MTU}.1"), item(f"{IF_MTU}.1", 1500)])
+    assert walk.next_oids() == [f"{IF_MTU}.1"]
+    walk.merge([item(".1.3.6.1.2.1.2.2.1.5.1")])
+    assert walk.done
+    assert walk.rows["1"][IF_MTU] == item(f"{IF_MTU}.1", 1500)
+    assert sorted(walk.rows["1"]) == [IF_DESCR, IF_TYPE, IF_MTU]
+
+
+def test_end_of_mib_view_ends_the_column():
+    walk = table_walk(IF_DESCR, IF_TYPE)
+    walk.merge([item(f"{IF_DESCR}.1"), end(f"{IF_TYPE}"), item(f"{IF_DESCR}.2"), end(f"{IF_TYPE}")])
+    assert walk.next_oids() == [f"{IF_DESCR}.2"]
+    walk.merge([end(f"{IF_DESCR}.2")])
+    assert walk.done
+    assert {index: list(row) for index, row in walk.rows.items()} == {"1": [IF_DESCR], "2": [IF_DESCR]}
+
+
+@pytest.mark.parametrize("index", ["2", "1"])
+def test_non_increasing_oid_is_an_error(index):
+    walk = table_walk(IF_DESCR)
+    walk.merge([item(f"{IF_DESCR}.2")])
+    with pytest.raises(TableWalkError):
+        walk.merge([item(f"{IF_DESCR}.{index}")])
+
+
+def test_index_order_is_numeric():
+    walk = table_walk(IF_DESCR)
+    walk.merge([item(f"{IF_DESCR}.9"), item(f"{IF_DESCR}.10")])
+    assert list(walk.rows) == ["9", "10"]
+
+
+def test_empty_response_ends_every_column():
+    walk = table_walk(IF_DESCR, IF_TYPE)
+    walk.merge([item(f"{IF_DESCR}.1"), item(f"{IF_TYPE}.1")])
+    walk.merge([])
+    assert walk.done
+    assert walk.next_oids() == []
+    assert sorted(walk.rows["1"]) == [IF_DESCR, IF_TYPE]
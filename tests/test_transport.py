@@ -0,0 +1,253 @@
+import asyncio
+import socket
+import pytest
+from snmp_diode import ber, ratelimit
+from snmp_diode.transport import Dispatcher, SNMPError, SNMPTimeoutError, next_request_id
+from conftest import device_mib
+
+SYS_NAME = ".1.3.6.1.2.1.1.5.0"
+PEER = "127.0.1.5"
+OTHER = "127.0.1.6"
+
+
+class Peer(asyncio.DatagramProtocol):
+    # A UDP endpoint on the loop whose answers the test writes by hand.
+
+    def __init__(self):
+        self.received = asyncio.Queue()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received.put_nowait((ber.decode_message(data), addr))
+
+    def answer(self, message, addr, request_id=None):
+        request_id = message.request_id if request_id is None else request_id
+        varbinds = [(SYS_NAME, ber.OCTET_STRING, b"router-1")]
+        self.transport.sendto(
+            ber.encode_message(message.version, message.community, ber.GET_RESPONSE, request_id, varbinds), addr
+        )
+
+
+async def open_peer(address, port=0):
+    loop = asyncio.get_running_loop()
+    _, peer = await loop.create_datagram_endpoint(Peer, local_addr=(address, port))
+    return peer
+
+
+def get_sys_name(request_id):
+    return ber.encode_request(ber.VERSION_2C, "public", ber.GET_REQUEST, request_id, [SYS_NAME])
+
+
+def send(dispatcher, address, timeout=1.0, retries=0, estimator=None, limiter=None):
+    request_id = next_request_id()
+    return dispatcher.request(
+        request_id, get_sys_name(request_id), address, socket.AF_INET, timeout, retries, estimator, limiter
+    )
+
+
+def run(test):
+    # Runs test(dispatcher) on a fresh loop, closing the dispatcher after.
+    async def main():
+        dispatcher = Dispatcher(asyncio.get_running_loop())
+        try:
+            return await test(dispatcher)
+        finally:
+            dispatcher.close()
+
+    return asyncio.run(main())
+
+
+def test_ten_thousand_outstanding_requests(start_agent):
+    agent = start_agent({"127.0.0.1": device_mib("router-1")})
+    request_ids = [next_request_id() for _ in range(10000)]
+
+    async def test(dispatcher):
+        agent.hold = True
+        futures = [
+            dispatcher.request(
+                request_id, get_sys_name(request_id), ("127.0.0.1", agent.port), socket.AF_INET, 10.0, 2
+            )
+            for request_id in request_ids
+        ]
+        while agent.requests["127.0.0.1"] < len(request_ids):
+            await asyncio.sleep(0.05)
+        # Every request is outstanding at once, one heap entry each.
+        assert len(dispatcher.pending) == len(request_ids)
+        assert len(dispatcher.deadlines) == len(request_ids)
+        agent.release()
+        messages = await asyncio.gather(*futures)
+        assert [message.request_id for message in messages] == request_ids
+        assert {message.varbinds[0].value for message in messages} == {b"router-1"}
+        assert dispatcher.pending == {}
+
+    run(test)
+
+
+def test_answers_are_matched_by_request_id_and_source():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        other = await open_peer(OTHER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        future = send(dispatcher, (PEER, port))
+        message, addr = await peer.received.get()
+        # Another request-id, or the right one from another host, are not
+        # the answer.
+        peer.answer(message, addr, message.request_id + 1)
+        other.answer(message, addr)
+        await asyncio.sleep(0.05)
+        assert not future.done()
+        peer.answer(message, addr)
+        answer = await future
+        assert answer.request_id == message.request_id
+        assert dispatcher.pending == {}
+        peer.transport.close()
+        other.transport.close()
+
+    run(test)
+
+
+def test_v3_answers_are_matched_by_msg_id(start_agent):
+    agent = start_agent({"127.0.0.1": device_mib("router-1")})
+
+    async def test(dispatcher):
+        msg_id = next_request_id()
+        packet = ber.encode_v3_discovery(msg_id, msg_id)
+        data = await dispatcher.request(msg_id, packet, ("127.0.0.1", agent.port), socket.AF_INET, 1.0, 0)
+        # Handed back raw, for the session to verify and decrypt.
+        assert ber.decode_v3_message(data).msg_id == msg_id
+
+    run(test)
+
+
+class Estimator:
+    def __init__(self):
+        self.samples = []
+        self.backoffs = []
+
+    def sample(self, address, rtt):
+        self.samples.append(address)
+
+    def backoff(self, address, timeout):
+        self.backoffs.append(timeout)
+
+
+def test_timeout_after_the_retries():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        estimator = Estimator()
+        with pytest.raises(SNMPTimeoutError):
+            await send(dispatcher, (PEER, port), timeout=0.02, retries=2, estimator=estimator)
+        assert peer.received.qsize() == 3
+        # The timeout doubles on every retransmission.
+        assert estimator.backoffs == [0.02, 0.04]
+        assert estimator.samples == []
+        assert dispatcher.pending == {}
+        peer.transport.close()
+
+    run(test)
+
+
+def test_retransmission_is_answered():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        estimator = Estimator()
+        future = send(dispatcher, (PEER, port), timeout=0.05, retries=2, estimator=estimator)
+        await peer.received.get()
+        message, addr = await peer.received.get()
+        peer.answer(message, addr)
+        await future
+        # Answers to retransmissions are not sampled, they are ambiguous.
+        assert estimator.samples == []
+        assert len(estimator.backoffs) == 1
+        peer.transport.close()
+
+    run(test)
+
+
+def test_request_slot_goes_to_the_next_queued_request():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        limiter = ratelimit.RateLimiter(host_inflight=1)
+        first = send(dispatcher, (PEER, port), limiter=limiter)
+        second = send(dispatcher, (PEER, port), limiter=limiter)
+        message, addr = await peer.received.get()
+        await asyncio.sleep(0.05)
+        assert peer.received.empty()
+        assert len(dispatcher.waiting[PEER]) == 1
+        peer.answer(message, addr)
+        await first
+        message, addr = await peer.received.get()
+        peer.answer(message, addr)
+        await second
+        assert dict(limiter.inflight) == {}
+        assert dispatcher.waiting == {}
+        peer.transport.close()
+
+    run(test)
+
+
+def test_cancelled_queued_request_is_not_sent():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        limiter = ratelimit.RateLimiter(host_inflight=1)
+        first = send(dispatcher, (PEER, port), limiter=limiter)
+        second = send(dispatcher, (PEER, port), limiter=limiter)
+        message, addr = await peer.received.get()
+        second.cancel()
+        peer.answer(message, addr)
+        await first
+        await asyncio.sleep(0.05)
+        assert peer.received.empty()
+        assert dispatcher.pending == {}
+        assert dict(limiter.inflight) == {}
+        peer.transport.close()
+
+    run(test)
+
+
+def test_cancelled_request_waiting_for_a_token_gives_its_slot_back():
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        # One token every 100 ms, the second request waits on the sends heap.
+        limiter = ratelimit.RateLimiter(rate=10, host_inflight=4)
+        first = send(dispatcher, (PEER, port), limiter=limiter)
+        second = send(dispatcher, (PEER, port), limiter=limiter)
+        assert len(dispatcher.sends) == 1
+        second.cancel()
+        message, addr = await peer.received.get()
+        peer.answer(message, addr)
+        await first
+        await asyncio.sleep(0.15)
+        assert peer.received.empty()
+        assert dispatcher.pending == {}
+        assert dict(limiter.inflight) == {}
+        peer.transport.close()
+
+    run(test)
+
+
+def test_close_releases_the_held_slots():
+    limiter = ratelimit.RateLimiter(host_inflight=2)
+
+    async def test(dispatcher):
+        peer = await open_peer(PEER)
+        port = peer.transport.get_extra_info("sockname")[1]
+        futures = [send(dispatcher, (PEER, port), limiter=limiter) for _ in range(3)]
+        await peer.received.get()
+        await peer.received.get()
+        assert limiter.inflight[PEER] == 2
+        dispatcher.close()
+        for future in futures:
+            with pytest.raises(SNMPError, match="Transport closed"):
+                await future
+        peer.transport.close()
+
+    run(test)
+    assert dict(limiter.inflight) == {}
@@ -0,0 +1,70 @@
+import time
+import pytest
+from snmp_diode import ber, usm
+
+ENGINE_ID = bytes.fromhex("000000000000000000000002")
+SYS_NAME = ".1.3.6.1.2.1.1.5.0"
+
+
+# RFC 3414 A.3.1 and A.3.2.
+@pytest.mark.parametrize(
+    "protocol, key, localized",
+    [
+        ("MD5", "9faf3283884e92834ebc9847d8edd963", "526f5eed9fcce26f8964c2930787d82b"),
+        ("SHA", "9fb5cc0381497b3793528939ff788d5d79145211", "6695febc9288e36282235fc7151f128497b38f3f"),
+    ],
+)
+def test_key_vectors(protocol, key, localized):
+    assert usm.password_to_key("maplesyrup", protocol).hex() == key
+    assert usm.localized_key("maplesyrup", protocol, ENGINE_ID).hex() == localized
+
+
+def response(agent, engine, pdu_type=ber.GET_RESPONSE):
+    # What the agent of engine answers with, agent being a User with the
+    # same credentials.
+    pdu = ber.encode_pdu(pdu_type, 42, [(SYS_NAME, ber.OCTET_STRING, b"router-1")])
+    return agent.wrap(42, engine, ber.encode_scoped_pdu(engine.engine_id, b"", pdu))
+
+
+@pytest.mark.parametrize(
+    "level, auth_protocol, privacy_protocol",
+    [
+        ("noAuthNoPriv", None, None),
+        ("authNoPriv", "MD5", None),
+        ("authNoPriv", "SHA", None),
+        ("authPriv", "SHA", "AES"),
+        ("authPriv", "MD5", "DES"),
+    ],
+)
+def test_wrap_unwrap_round_trip(level, auth_protocol, privacy_protocol):
+    if privacy_protocol is not None:
+        pytest.importorskip("cryptography")
+    user = usm.User("user", level, auth_protocol, "authpass1", privacy_protocol, "privpass1")
+    agent = usm.User("user", level, auth_protocol, "authpass1", privacy_protocol, "privpass1")
+    engine = usm.Engine(ENGINE_ID, 5, 1000, time.time())
+    # Agents echoing the reportable flag are accepted as well.
+    for flags in (user.flags & ~ber.MSG_FLAG_REPORTABLE, user.flags):
+        agent.flags = flags
+        parameters, scoped_pdu = user.unwrap(response(agent, engine))
+        assert (parameters.engine_id, parameters.engine_boots, parameters.user_name) == (ENGINE_ID, 5, b"user")
+        context_engine_id, _, pdu_type, request_id, error_status, _, varbinds = scoped_pdu
+        assert (context_engine_id, pdu_type, request_id, error_status) == (ENGINE_ID, ber.GET_RESPONSE, 42, 0)
+        assert varbinds == [ber.Varbind(SYS_NAME, ber.OCTET_STRING, b"router-1")]
+
+
+def test_tampered_message_fails_authentication():
+    user = usm.User("user", "authNoPriv", "SHA", "authpass1")
+    packet = bytearray(response(user, usm.Engine(ENGINE_ID, 1, 1, time.time())))
+    packet[-1] ^= 0xFF
+    with pytest.raises(usm.USMError):
+        user.unwrap(bytes(packet))
+
+
+def test_response_below_requested_level_is_rejected():
+    engine = usm.Engine(ENGINE_ID, 1, 1, time.time())
+    agent = usm.User("user", "noAuthNoPriv")
+    user = usm.User("user", "authNoPriv", "SHA", "authpass1")
+    with pytest.raises(usm.USMError):
+        user.unwrap(response(agent, engine))
+    # Reports come unauthenticated.
+    user.unwrap(response(agent, engine, pdu_type=ber.REPORT))